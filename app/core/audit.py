@@ -0,0 +1,332 @@
+"""
+The audit log: who was allowed or denied what, and who changed what.
+
+Requests never write audit records themselves. The RBAC dependencies
+(app/core/rbac.py) and the change log (app/core/changelog.py) put a small
+record in an in-memory buffer and move on. A background thread writes the
+buffer out in batches every AUDIT_FLUSH_INTERVAL_SECONDS, or sooner when a
+batch is full.
+
+Backends (AUDIT_BACKEND):
+- "none": nothing is recorded
+- "database": one multi-row INSERT into audit_events per batch
+- "file": NDJSON lines in AUDIT_FILE_DIR, one file per worker, moved to
+  .1, .2, ... once it passes AUDIT_FILE_MAX_BYTES
+
+Denies and admin changes are always recorded. Allows can be sampled with
+AUDIT_ALLOW_SAMPLE_RATE, since they are most of the traffic and the least
+interesting.
+
+The buffer holds AUDIT_BUFFER_SIZE records. If the writer falls behind:
+- once it is three quarters full, new allows are shed, leaving the rest
+  of the room for denies and admin changes
+- once it is full, new records of any kind are dropped
+Requests never wait for the writer. What was shed or dropped is counted in
+rbac_audit_records_total and shown by /health/ready.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Deque, List, Optional
+from sqlalchemy import insert
+from app.core.config import settings
+from app.core.invalidation import current_origin
+from app.core.metrics import Gauge, audit_records
+from app.core.serialization import dumps
+from app.db.base import engine
+from app.models.audit_event import AuditEvent
+
+logger = logging.getLogger(__name__)
+
+# One decision or change. `at` is a Unix timestamp; see AuditEvent for the rest.
+AuditRecord = namedtuple("AuditRecord", "at kind outcome tenant_id user_id name entity_id")
+
+# Longer names are cut to fit audit_events.name rather than failing the batch
+NAME_LENGTH = AuditEvent.__table__.c.name.type.length
+
+
+class AuditSink:
+    """Somewhere to write batches of audit records."""
+
+    def write(self, records: List[AuditRecord]):
+        pass
+
+    def close(self):
+        pass
+
+
+class DatabaseAuditSink(AuditSink):
+    """Writes each batch to the audit_events table in one transaction."""
+
+    def write(self, records):
+        rows = [
+            {
+                "created_at": datetime.fromtimestamp(record.at, timezone.utc),
+                "kind": record.kind,
+                "outcome": record.outcome,
+                "tenant_id": record.tenant_id,
+                "user_id": record.user_id,
+                "name": record.name,
+                "entity_id": record.entity_id,
+            }
+            for record in records
+        ]
+        with engine.begin() as conn:
+            conn.execute(insert(AuditEvent), rows)
+
+
+class FileAuditSink(AuditSink):
+    """
+    Appends each batch to an NDJSON file, one record per line.
+
+    When the file passes max_bytes it becomes <name>.1 (the old .1 becomes
+    .2 and so on) and the oldest past `backups` is deleted.
+    """
+
+    def __init__(self, path: str, max_bytes: int, backups: int):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = None
+
+    def write(self, records):
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "ab")
+        self._file.write(b"".join(
+            dumps({
+                "at": datetime.fromtimestamp(record.at, timezone.utc).isoformat(),
+                "kind": record.kind,
+                "outcome": record.outcome,
+                "tenant_id": record.tenant_id,
+                "user_id": record.user_id,
+                "name": record.name,
+                "entity_id": record.entity_id,
+            }) + b"\n"
+            for record in records
+        ))
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for number in range(self.backups - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{number}")
+            if older.exists():
+                os.replace(older, self.path.with_name(f"{self.path.name}.{number + 1}"))
+        if self.backups > 0:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def make_sink(name: str) -> Optional[AuditSink]:
+    """Build the sink called `name` (see AUDIT_BACKEND), None for "none"."""
+    if name == "database":
+        return DatabaseAuditSink()
+    if name == "file":
+        # Workers must not share a file, so each gets its own
+        worker = current_origin().replace(":", "-")
+        return FileAuditSink(
+            os.path.join(settings.AUDIT_FILE_DIR, f"audit-{worker}.ndjson"),
+            settings.AUDIT_FILE_MAX_BYTES,
+            settings.AUDIT_FILE_BACKUPS
+        )
+    if name == "none":
+        return None
+    raise ValueError(f"Unknown AUDIT_BACKEND: {name}")
+
+
+class AuditLog:
+    """
+    The buffer between requests and the sink, and the thread that empties it.
+
+    Nothing is buffered until start() is given a sink.
+    """
+
+    def __init__(self, capacity: int, batch_size: int, interval: float, allow_sample_rate: float):
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.interval = interval
+        self.allow_sample_rate = allow_sample_rate
+        self.sink: Optional[AuditSink] = None
+        self.shed = 0
+        self.dropped = 0
+        self.failed = 0
+        self._buffer: Deque[AuditRecord] = deque()
+        self._lock = threading.Lock()
+        # Only one thread writes to the sink at a time
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.sink is not None
+
+    def depth(self) -> int:
+        """Records waiting to be written."""
+        return len(self._buffer)
+
+    def record(self, record: AuditRecord, important: bool = True):
+        """
+        Buffer a record without waiting for it to be written.
+
+        Args:
+            record: what to write
+            important: False for allows, which are shed first when the buffer fills up
+        """
+        if self.sink is None:
+            return
+        if record.name is not None and len(record.name) > NAME_LENGTH:
+            record = record._replace(name=record.name[:NAME_LENGTH])
+        with self._lock:
+            depth = len(self._buffer)
+            if depth >= self.capacity:
+                self.dropped += 1
+                result = "dropped"
+            elif not important and depth >= self.capacity * 3 // 4:
+                self.shed += 1
+                result = "shed"
+            else:
+                self._buffer.append(record)
+                result = "recorded"
+                depth += 1
+        audit_records.inc(result)
+        if depth == self.batch_size:
+            self._wake.set()
+
+    def decision(
+        self,
+        kind: str,
+        allowed: bool,
+        tenant_id: Optional[int],
+        user_id: Optional[int],
+        name: str,
+        resource_id: Optional[int] = None
+    ):
+        """Record a permission or role check ("permission", "role", "custom" or "resource")."""
+        if self.sink is None:
+            return
+        if allowed and self.allow_sample_rate < 1 and random.random() >= self.allow_sample_rate:
+            audit_records.inc("sampled_out")
+            return
+        self.record(
+            AuditRecord(time.time(), kind, "allow" if allowed else "deny", tenant_id, user_id, name, resource_id),
+            important=not allowed
+        )
+
+    def admin_change(
+        self,
+        tenant_id: Optional[int],
+        actor_id: Optional[int],
+        entity_type: str,
+        entity_id: Optional[int],
+        action: str
+    ):
+        """Record a committed change to roles, permissions, groups or assignments."""
+        self.record(AuditRecord(time.time(), "admin", action, tenant_id, actor_id, entity_type, entity_id))
+
+    def flush(self) -> int:
+        """
+        Write everything buffered so far, batch_size records at a time.
+
+        A batch the sink can't take is written again one record at a time,
+        so one bad record doesn't lose the others. Records that still fail
+        are logged, counted and thrown away, so a broken sink can't fill the
+        buffer and stop denies being recorded.
+
+        Returns:
+            How many records were written
+        """
+        written = 0
+        with self._flush_lock:
+            while self.sink is not None:
+                with self._lock:
+                    batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                if not batch:
+                    break
+                try:
+                    self.sink.write(batch)
+                except Exception:
+                    logger.exception("Could not write %d audit records, retrying one at a time", len(batch))
+                    written += self._write_one_by_one(batch)
+                    continue
+                written += len(batch)
+                audit_records.inc("written", amount=len(batch))
+        return written
+
+    def _write_one_by_one(self, batch: List[AuditRecord]) -> int:
+        written = 0
+        for record in batch:
+            try:
+                self.sink.write([record])
+            except Exception as e:
+                logger.warning("Could not write audit record %s: %s", record, e)
+                self.failed += 1
+                audit_records.inc("failed")
+                continue
+            written += 1
+            audit_records.inc("written")
+        return written
+
+    def _flush_forever(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def start(self, sink: Optional[AuditSink] = None):
+        """Start recording. Call once per worker, after fork."""
+        self.sink = sink or make_sink(settings.AUDIT_BACKEND)
+        if self.sink is None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._flush_forever, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop recording and write out what is left."""
+        if self.sink is None:
+            return
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+            self._thread = None
+        self.flush()
+        self.sink.close()
+        self.sink = None
+
+    def check(self) -> dict:
+        """For /health/ready. A lagging audit log never makes the worker unready."""
+        if self.sink is None:
+            return {"ok": True, "detail": "off"}
+        return {
+            "ok": True,
+            "detail": f"{self.depth()} buffered, {self.shed} shed, {self.dropped} dropped, {self.failed} failed",
+        }
+
+
+audit_log = AuditLog(
+    settings.AUDIT_BUFFER_SIZE,
+    settings.AUDIT_BATCH_SIZE,
+    settings.AUDIT_FLUSH_INTERVAL_SECONDS,
+    settings.AUDIT_ALLOW_SAMPLE_RATE
+)
+
+Gauge("rbac_audit_buffer_depth", "Audit records waiting to be written", audit_log.depth)
@@ -5,19 +5,82 @@ Authentication module with JWT token handling and user extraction.
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
+from collections import namedtuple
 from typing import Optional
-from app.db.base import get_db
+from app.db.replicas import get_read_db
 from app.models.user import User
 from app.core.security import verify_token
+from app.core.cache import token_cache
 from app.schemas.auth import TokenData
+from app.core.config import settings
 
 # HTTP Bearer token scheme
 security = HTTPBearer()
 
+# Who a token belongs to
+TokenSubject = namedtuple("TokenSubject", ["user_id", "tenant_id"])
+
+# What a checked token says: who it's for, when it expires, "access" or "refresh"
+TokenClaims = namedtuple("TokenClaims", ["subject", "expires_at", "token_type"])
+
+
+def get_token_claims(token: str) -> Optional[TokenClaims]:
+    """
+    Check a JWT token and get what we need out of it, without touching the database.
+    
+    Tokens we've already checked are remembered until they expire, so
+    the signature is only verified the first time a token is seen.
+    
+    Args:
+        token: The JWT token
+        
+    Returns:
+        Optional[TokenClaims]: The token's subject, expiry and type, or None if the token is invalid
+    """
+    claims = token_cache.get(token)
+    if claims is not None:
+        return claims
+    
+    payload = verify_token(token)
+    if payload is None:
+        return None
+    
+    # Login puts the ID in "sub", older tokens use "user_id"
+    user_id = payload.get("user_id", payload.get("sub"))
+    # Tokens issued before tenants existed belong to the default tenant
+    tenant_id = payload.get("tenant_id", settings.DEFAULT_TENANT_ID)
+    try:
+        if user_id is None:
+            return None
+        subject = TokenSubject(int(user_id), int(tenant_id))
+    except (TypeError, ValueError):
+        return None
+    
+    expires_at = payload.get("exp")
+    claims = TokenClaims(subject, expires_at, payload.get("type", "access"))
+    # Tokens without an expiry are checked every time
+    if isinstance(expires_at, (int, float)):
+        token_cache.set(token, claims, expires_at)
+    return claims
+
+
+def get_token_subject(token: str) -> Optional[TokenSubject]:
+    """
+    Get the user ID and tenant ID out of a JWT token without touching the database.
+    
+    Args:
+        token: The JWT token
+        
+    Returns:
+        Optional[TokenSubject]: The user and tenant IDs, or None if the token is invalid
+    """
+    claims = get_token_claims(token)
+    return claims.subject if claims is not None else None
+
 
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ) -> User:
     """
     Get current authenticated user from JWT token.
@@ -38,18 +101,16 @@ def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    # Verify token
-    payload = verify_token(credentials.credentials)
-    if payload is None:
-        raise credentials_exception
-    
-    # Extract user data
-    user_id: Optional[int] = payload.get("user_id")
-    if user_id is None:
+    # Verify token and extract user data
+    subject = get_token_subject(credentials.credentials)
+    if subject is None:
         raise credentials_exception
     
-    # Get user from database
-    user = db.query(User).filter(User.id == user_id).first()
+    # Get user from database, only from the tenant the token was issued for
+    user = db.query(User).filter(
+        User.tenant_id == subject.tenant_id,
+        User.id == subject.user_id
+    ).first()
     if user is None:
         raise credentials_exception
     
@@ -0,0 +1,475 @@
+"""
+In-memory caches for authorization decisions.
+This file keeps track of when permissions change so cached answers never go stale.
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from typing import Callable, Dict, Iterable, Optional
+from app.core.config import settings
+
+# A cached answer to "can this user do this?"
+# We keep the username too so the route can answer without loading the user.
+Decision = namedtuple("Decision", ["allowed", "username"])
+
+# What a user can do, for token introspection
+Principal = namedtuple("Principal", ["username", "is_active", "permissions"])
+
+# Every change to roles, permissions or assignments moves this counter forward
+_lock = threading.Lock()
+_counter = 0
+_global_version = 0
+_tenant_versions: Dict[int, int] = {}
+_user_versions: Dict[int, int] = {}
+_group_versions: Dict[int, int] = {}
+
+
+def get_authz_version() -> int:
+    """Get the version of the last change that affects everybody."""
+    return _global_version
+
+
+def get_tenant_authz_version(tenant_id: int) -> int:
+    """Get the version of the last change made to one tenant's roles."""
+    return _tenant_versions.get(tenant_id, 0)
+
+
+def get_user_authz_version(user_id: int) -> int:
+    """Get the version of the last change made to one user's access."""
+    return _user_versions.get(user_id, 0)
+
+
+def get_group_authz_version(group_id: int) -> int:
+    """Get the version of the last change made to one group's roles or place."""
+    return _group_versions.get(group_id, 0)
+
+
+def get_version_stamp() -> int:
+    """
+    Get the current version, to remember when a decision was made.
+
+    Take the stamp before loading anything from the database, so a change
+    that happens while we are loading makes the new entry stale right away.
+    """
+    return _counter
+
+
+def is_fresh(stamp: int, tenant_id: int, user_id: int, group_ids: Iterable[int] = ()) -> bool:
+    """
+    Check that nothing a decision depends on changed after it was stamped.
+
+    Args:
+        stamp: the version taken before the decision was made
+        tenant_id: the tenant of the user
+        user_id: the user the decision is for
+        group_ids: the user's groups (and the groups above them)
+
+    Returns:
+        True if the decision is still good, False otherwise
+    """
+    if _global_version > stamp:
+        return False
+    if _tenant_versions.get(tenant_id, 0) > stamp or _user_versions.get(user_id, 0) > stamp:
+        return False
+    return all(_group_versions.get(group_id, 0) <= stamp for group_id in group_ids)
+
+
+# Scopes a change can have, for apply_change and change listeners
+SCOPE_GLOBAL = "global"
+SCOPE_TENANT = "tenant"
+SCOPE_USER = "user"
+SCOPE_GROUP = "group"
+
+# Called with (scope, subject_ids) after every local change, so other
+# workers can hear about it (see app/core/invalidation.py)
+_change_listeners = []
+
+
+def add_change_listener(listener: Callable[[str, tuple], None]):
+    """Call listener(scope, subject_ids) whenever a bump_* function runs here."""
+    _change_listeners.append(listener)
+
+
+def remove_change_listener(listener: Callable[[str, tuple], None]):
+    """Stop calling a listener added with add_change_listener."""
+    if listener in _change_listeners:
+        _change_listeners.remove(listener)
+
+
+def apply_change(scope: str, subject_ids: Iterable[int] = ()) -> int:
+    """
+    Move the version for a scope forward, without telling anyone.
+
+    This is how changes made by other workers are applied here. Only
+    cached decisions that depend on these subjects go stale.
+
+    Args:
+        scope: SCOPE_GLOBAL, SCOPE_TENANT, SCOPE_USER or SCOPE_GROUP
+        subject_ids: the tenants, users or groups that changed
+
+    Returns:
+        The new version
+    """
+    global _counter, _global_version
+    versions = {
+        SCOPE_TENANT: _tenant_versions,
+        SCOPE_USER: _user_versions,
+        SCOPE_GROUP: _group_versions,
+    }
+    with _lock:
+        _counter += 1
+        if scope == SCOPE_GLOBAL:
+            _global_version = _counter
+        elif scope in versions:
+            for subject_id in subject_ids:
+                versions[scope][subject_id] = _counter
+        else:
+            raise ValueError(f"Unknown authz change scope: {scope}")
+        return _counter
+
+
+def _record_change(scope: str, subject_ids: tuple) -> int:
+    version = apply_change(scope, subject_ids)
+    for listener in list(_change_listeners):
+        listener(scope, subject_ids)
+    return version
+
+
+def bump_authz_version() -> int:
+    """
+    Record a change that affects everybody (the permission catalog changed).
+
+    Returns:
+        The new version
+    """
+    return _record_change(SCOPE_GLOBAL, ())
+
+
+def bump_tenant_authz_version(tenant_id: int) -> int:
+    """
+    Record a change that affects one tenant (its roles changed).
+
+    Returns:
+        The new version
+    """
+    return _record_change(SCOPE_TENANT, (tenant_id,))
+
+
+def bump_group_authz_version(*group_ids: int) -> int:
+    """
+    Record a change to groups (their roles changed, or they moved).
+
+    Only members of these groups lose their cached decisions.
+
+    Returns:
+        The new version
+    """
+    return _record_change(SCOPE_GROUP, group_ids)
+
+
+def bump_user_authz_version(user_id: int) -> int:
+    """
+    Record a change to a single user (roles or groups assigned, account updated).
+
+    Returns:
+        The new version
+    """
+    return _record_change(SCOPE_USER, (user_id,))
+
+
+class PermissionRegistry:
+    """
+    The set of permission names that exist in the database.
+
+    Names are interned and only reloaded when the global version moves,
+    so asking about a made-up permission never touches the database.
+    """
+
+    def __init__(self):
+        self._names = frozenset()
+        self._version = -1
+        self._lock = threading.Lock()
+
+    def contains(
+        self,
+        permission_name: str,
+        load_names: Optional[Callable[[], Iterable[str]]]
+    ) -> Optional[bool]:
+        """
+        Check if a permission name exists.
+
+        Args:
+            permission_name: the permission we're checking for
+            load_names: called to fetch all permission names when the registry is stale
+
+        Returns:
+            True if the permission exists, False otherwise, or None if the
+            registry is stale and no load_names was given
+        """
+        if self._version != _global_version:
+            if load_names is None:
+                return None
+            self.reload(load_names)
+        return permission_name in self._names
+
+    def reload(self, load_names: Callable[[], Iterable[str]]):
+        """Fetch all permission names again."""
+        with self._lock:
+            version = _global_version
+            if self._version == version:
+                return
+            self._names = frozenset(sys.intern(name) for name in load_names())
+            self._version = version
+
+    @property
+    def loaded(self) -> bool:
+        """True once the registry has been filled at least once."""
+        return self._version >= 0
+
+
+class DecisionCache:
+    """
+    A bounded cache of permission decisions, both allows and denies.
+
+    There is one of these per tenant. Entries are grouped by user. Each user
+    can hold at most max_entries_per_user decisions, and the whole cache holds
+    at most max_entries. When full, the least recently used user is dropped first.
+    """
+
+    def __init__(self, tenant_id: int, max_entries: int, max_entries_per_user: int):
+        self.tenant_id = tenant_id
+        self.max_entries = max_entries
+        self.max_entries_per_user = max_entries_per_user
+        self._users: "OrderedDict[int, OrderedDict]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def stamp(self) -> int:
+        """Get the current version stamp, see get_version_stamp."""
+        return get_version_stamp()
+
+    def get(self, user_id: int, permission_name: str) -> Optional[Decision]:
+        """
+        Look up a cached decision.
+
+        Returns:
+            The decision, or None if we don't have a fresh one
+        """
+        with self._lock:
+            entries = self._users.get(user_id)
+            entry = entries.get(permission_name) if entries is not None else None
+            if entry is None:
+                self.misses += 1
+                return None
+
+            # Throw away answers computed before the last change
+            stamp, group_ids, decision = entry
+            if not is_fresh(stamp, self.tenant_id, user_id, group_ids):
+                del entries[permission_name]
+                self._size -= 1
+                self.misses += 1
+                return None
+
+            entries.move_to_end(permission_name)
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return decision
+
+    def set(
+        self,
+        user_id: int,
+        permission_name: str,
+        decision: Decision,
+        stamp: int,
+        group_ids: Iterable[int] = ()
+    ):
+        """
+        Store a decision.
+
+        Args:
+            user_id: the user the decision is for
+            permission_name: the permission that was checked
+            decision: the answer
+            stamp: the version stamp taken before the decision was computed
+            group_ids: the groups the answer came through, so changing any of them drops it
+        """
+        with self._lock:
+            entries = self._users.get(user_id)
+            if entries is None:
+                entries = self._users[user_id] = OrderedDict()
+            elif permission_name in entries:
+                self._size -= 1
+
+            entries[permission_name] = (stamp, tuple(group_ids), decision)
+            entries.move_to_end(permission_name)
+            self._users.move_to_end(user_id)
+            self._size += 1
+
+            # Keep one user from filling the cache with probes
+            while len(entries) > self.max_entries_per_user:
+                entries.popitem(last=False)
+                self._size -= 1
+
+            # Drop the least recently seen users until we fit again
+            while self._size > self.max_entries:
+                _, old_entries = self._users.popitem(last=False)
+                self._size -= len(old_entries)
+
+    def clear(self):
+        """Remove every cached decision."""
+        with self._lock:
+            self._users.clear()
+            self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class TenantDecisionCaches:
+    """
+    One decision cache per tenant.
+
+    Each tenant gets its own size limit, so a big tenant can't push
+    everyone else's decisions out. Only the most recently active
+    max_tenants tenants keep a cache.
+    """
+
+    def __init__(self, max_tenants: int, max_entries: int, max_entries_per_user: int):
+        self.max_tenants = max_tenants
+        self.max_entries = max_entries
+        self.max_entries_per_user = max_entries_per_user
+        self._caches: "OrderedDict[int, DecisionCache]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def for_tenant(self, tenant_id: int) -> DecisionCache:
+        """Get the decision cache for a tenant, creating it if needed."""
+        with self._lock:
+            cache = self._caches.get(tenant_id)
+            if cache is None:
+                cache = self._caches[tenant_id] = DecisionCache(
+                    tenant_id, self.max_entries, self.max_entries_per_user
+                )
+                while len(self._caches) > self.max_tenants:
+                    self._caches.popitem(last=False)
+            else:
+                self._caches.move_to_end(tenant_id)
+            return cache
+
+    def clear(self):
+        """Remove every tenant's cache."""
+        with self._lock:
+            self._caches.clear()
+
+
+class TokenCache:
+    """
+    Tokens whose signature was already checked, until they expire.
+
+    Checking a JWT signature costs more than the rest of a cached
+    permission check, so routes that see the same token over and over
+    (like the forward-auth check) only do it once per token. Only valid
+    tokens are kept, and at most max_entries of them.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._tokens: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        """
+        Look up a token.
+
+        Returns:
+            What was stored for the token, or None if it's unknown or expired
+        """
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._tokens[token]
+                return None
+            self._tokens.move_to_end(token)
+            return value
+
+    def set(self, token: str, value, expires_at: float):
+        """Remember a checked token until expires_at (a Unix timestamp)."""
+        with self._lock:
+            self._tokens[token] = (expires_at, value)
+            self._tokens.move_to_end(token)
+            while len(self._tokens) > self.max_entries:
+                self._tokens.popitem(last=False)
+
+    def clear(self):
+        """Forget every token."""
+        with self._lock:
+            self._tokens.clear()
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+
+class PrincipalCache:
+    """
+    A bounded cache of users' names, active flags and permission names.
+
+    Entries are stamped like decisions, so any change to the user, their
+    tenant or their groups makes them stale.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, tenant_id: int, user_id: int) -> Optional[Principal]:
+        """
+        Look up a user.
+
+        Returns:
+            The principal, or None if we don't have a fresh one
+        """
+        key = (tenant_id, user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stamp, group_ids, principal = entry
+            if not is_fresh(stamp, tenant_id, user_id, group_ids):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return principal
+
+    def set(self, tenant_id: int, user_id: int, principal: Principal, stamp: int, group_ids: Iterable[int] = ()):
+        """Store a user, see DecisionCache.set for stamp and group_ids."""
+        with self._lock:
+            self._entries[(tenant_id, user_id)] = (stamp, tuple(group_ids), principal)
+            self._entries.move_to_end((tenant_id, user_id))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Forget every user."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Shared caches used by the routes
+permission_registry = PermissionRegistry()
+token_cache = TokenCache(max_entries=settings.TOKEN_CACHE_MAX_ENTRIES)
+principal_cache = PrincipalCache(max_entries=settings.PRINCIPAL_CACHE_MAX_ENTRIES)
+decision_caches = TenantDecisionCaches(
+    max_tenants=settings.DECISION_CACHE_MAX_TENANTS,
+    max_entries=settings.DECISION_CACHE_MAX_ENTRIES,
+    max_entries_per_user=settings.DECISION_CACHE_MAX_ENTRIES_PER_USER
+)
@@ -0,0 +1,184 @@
+"""
+The authz change log: a row for every change to roles, permissions or
+assignments, written in the same transaction as the change.
+
+Routes call record_change() before db.commit(). Once the commit succeeds
+the matching cache versions are bumped (and sent to other workers) and the
+change goes to the audit log. If the transaction rolls back, none of that
+happens.
+
+Versions are handed out when a row is inserted but only show up when its
+transaction commits, so a slow transaction can commit version 10 after
+version 11 is already visible. Readers going by "newer than the last
+version I saw" would skip it. get_changes() therefore stops before the
+first missing version until the change after it is
+AUTHZ_CHANGE_GAP_SECONDS old; after that the missing version is taken to
+be rolled back (sequences on PostgreSQL don't hand rolled back values out
+again). The polling invalidation backend remembers the versions it
+skipped instead (app/core/invalidation.py).
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+from sqlalchemy import event, func, inspect, or_, select
+from sqlalchemy.orm import Session
+from app.core.audit import audit_log
+from app.core.cache import (
+    SCOPE_GLOBAL,
+    SCOPE_TENANT,
+    SCOPE_GROUP,
+    bump_authz_version,
+    bump_tenant_authz_version,
+    bump_user_authz_version,
+    bump_group_authz_version
+)
+from app.core.config import settings
+from app.core.invalidation import current_origin
+from app.db.replicas import note_committed_version
+from app.models.authz_change import AuthzChange
+
+_PENDING_KEY = "authz_pending_bumps"
+_ROWS_KEY = "authz_pending_rows"
+_AUDIT_KEY = "authz_pending_audit"
+
+
+def record_change(
+    db: Session,
+    scope: str,
+    subject_ids: Iterable[int],
+    entity_type: str,
+    entity_id: Optional[int],
+    action: str,
+    tenant_id: Optional[int] = None,
+    actor_id: Optional[int] = None
+):
+    """
+    Log a change in the current transaction and bump the caches after commit.
+
+    Args:
+        db: the session making the change
+        scope: which cached decisions go stale (SCOPE_GLOBAL, SCOPE_TENANT, ...)
+        subject_ids: the tenants, users or groups in that scope (ignored for global)
+        entity_type: what was changed, e.g. "role"
+        entity_id: the id of what was changed
+        action: what happened, e.g. "updated"
+        tenant_id: the tenant the change belongs to
+        actor_id: the user making the change
+    """
+    subject_ids = tuple(subject_ids) if scope != SCOPE_GLOBAL else ()
+    origin = current_origin()
+    rows = [
+        AuthzChange(
+            scope=scope,
+            subject_id=subject_id,
+            tenant_id=tenant_id,
+            entity_type=entity_type,
+            entity_id=entity_id,
+            action=action,
+            actor_id=actor_id,
+            origin=origin
+        )
+        for subject_id in (subject_ids or (None,))
+    ]
+    db.add_all(rows)
+    db.info.setdefault(_PENDING_KEY, []).append((scope, subject_ids))
+    db.info.setdefault(_ROWS_KEY, []).extend(rows)
+    db.info.setdefault(_AUDIT_KEY, []).append((tenant_id, actor_id, entity_type, entity_id, action))
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_after_commit(session):
+    """The changes are saved, so cached decisions about them are stale now."""
+    for scope, subject_ids in session.info.pop(_PENDING_KEY, []):
+        if scope == SCOPE_GLOBAL:
+            bump_authz_version()
+        elif scope == SCOPE_GROUP:
+            bump_group_authz_version(*subject_ids)
+        else:
+            bump = bump_tenant_authz_version if scope == SCOPE_TENANT else bump_user_authz_version
+            for subject_id in subject_ids:
+                bump(subject_id)
+    # Reads may only go to replicas that have these rows (app/db/replicas.py).
+    # The rows are expired by the commit, but their identity still has the version.
+    versions = [inspect(row).identity[0] for row in session.info.pop(_ROWS_KEY, [])]
+    if versions:
+        note_committed_version(max(versions))
+    for change in session.info.pop(_AUDIT_KEY, []):
+        audit_log.admin_change(*change)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_ROWS_KEY, None)
+    session.info.pop(_AUDIT_KEY, None)
+
+
+def settled_version(db: Session, since: int, until: int) -> int:
+    """
+    The newest version up to `until` that no slower transaction can still commit under.
+
+    Args:
+        db: the session to read with
+        since: the last version the reader has
+        until: the newest version the reader was about to take
+
+    Returns:
+        `until`, or the version before the first missing one that is still
+        being waited for
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.AUTHZ_CHANGE_GAP_SECONDS)
+    expected = since + 1
+    rows = db.execute(
+        select(AuthzChange.version, AuthzChange.created_at)
+        .where(AuthzChange.version > since, AuthzChange.version <= until)
+        .order_by(AuthzChange.version)
+    )
+    for version, created_at in rows:
+        if version != expected and created_at is not None:
+            # SQLite gives back UTC without saying so
+            if created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            if created_at > cutoff:
+                return expected - 1
+        expected = version + 1
+    return until
+
+
+def latest_tenant_version(connection, tenant_id: int) -> int:
+    """
+    The newest change a tenant can see: its own, or to the shared permission list.
+
+    Two lookups on ix_authz_changes_tenant_id_version, one for each.
+
+    Args:
+        connection: a Connection or Session to read with
+        tenant_id: the tenant
+    """
+    own = select(func.max(AuthzChange.version)).where(AuthzChange.tenant_id == tenant_id)
+    shared = select(func.max(AuthzChange.version)).where(AuthzChange.tenant_id.is_(None))
+    row = connection.execute(select(own.scalar_subquery(), shared.scalar_subquery())).one()
+    return max(row[0] or 0, row[1] or 0)
+
+
+def get_changes(db: Session, since: int, tenant_id: int, limit: int) -> List[AuthzChange]:
+    """
+    Changes newer than `since` that a tenant can see, oldest first.
+
+    A tenant sees its own changes and changes to the global permission list.
+    Changes after a version that may still be committed are left for the
+    next call (see the module docstring).
+    """
+    changes = list(db.execute(
+        select(AuthzChange)
+        .where(
+            AuthzChange.version > since,
+            or_(AuthzChange.tenant_id == tenant_id, AuthzChange.tenant_id.is_(None))
+        )
+        .order_by(AuthzChange.version)
+        .limit(limit)
+    ).scalars())
+    if not changes:
+        return changes
+    settled = settled_version(db, since, changes[-1].version)
+    return [change for change in changes if change.version <= settled]
@@ -0,0 +1,118 @@
+"""
+ETags and conditional GETs for responses that only change with RBAC data.
+
+Role lists, permission lists and a user's own permissions change only when
+a change is recorded in authz_changes (app/core/changelog.py). So the ETag
+is the newest change the caller's tenant can see, plus who is asking and
+what they asked for:
+
+    "<change version>.<tenant id>.<user id>.<hash of path and query>"
+
+The version comes from the shared change log, so every worker (and every
+restart) hands out the same tag for the same data, and changes in other
+tenants don't move it. The query string is sorted first, so ?a=1&b=2 and
+?b=2&a=1 share a tag, while ?fields=id and ?limit=10 don't.
+
+Looking the version up is one indexed query, and each worker remembers
+the answer until its own version counter (app/core/cache.py) moves, i.e.
+until it hears of a change. So a poll with a matching If-None-Match
+usually gets its 304 without touching the database: the token check is
+cached too.
+"""
+
+import hashlib
+import threading
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode
+from fastapi import HTTPException, Request, status
+from app.core.auth import get_token_subject
+from app.core.cache import get_version_stamp
+from app.core.changelog import latest_tenant_version
+from app.db.base import engine
+
+# Clients may keep the answer but must check with us before using it
+CACHE_CONTROL = "private, no-cache"
+
+# Tenant -> (local version stamp when looked up, newest change it can see)
+_tenant_versions: Dict[int, Tuple[int, int]] = {}
+_tenant_versions_lock = threading.Lock()
+
+
+def tenant_change_version(tenant_id: int) -> int:
+    """The newest authz change a tenant can see, read again only after a change reaches this worker."""
+    # Taken before the query, so a change made meanwhile makes us ask again
+    stamp = get_version_stamp()
+    cached = _tenant_versions.get(tenant_id)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    with engine.connect() as conn:
+        version = latest_tenant_version(conn, tenant_id)
+    with _tenant_versions_lock:
+        _tenant_versions[tenant_id] = (stamp, version)
+    return version
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against our tag (weak comparison, as the RFC says)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _request_hash(request: Request) -> str:
+    """A short hash of the path and the query string with its parameters sorted."""
+    query = urlencode(sorted(parse_qsl(request.url.query, keep_blank_values=True)))
+    return hashlib.sha256(f"{request.url.path}?{query}".encode()).hexdigest()[:16]
+
+
+def cache_headers(etag: Optional[str]) -> dict:
+    """The ETag and caching headers to send with a full answer."""
+    if etag is None:
+        return {}
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": "Authorization"}
+
+
+def authz_etag(request: Request) -> Optional[str]:
+    """
+    A dependency that answers 304 Not Modified when nothing changed.
+
+    Put it before the dependencies that load the user, so a 304 costs at
+    most the version lookup. Send the returned tag with the full answer
+    (see cache_headers).
+
+    You can use this in FastAPI routes like:
+    async def list_things(etag: Optional[str] = Depends(authz_etag), ...):
+        ...
+        return Response(content, media_type="application/json", headers=cache_headers(etag))
+
+    Returns:
+        The ETag, or None without a valid bearer token (the route's own
+        auth then answers as usual)
+
+    Raises:
+        HTTPException: 304 if the client's copy is still current
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    subject = get_token_subject(token)
+    if subject is None:
+        return None
+
+    # Taken before anything is loaded, so a change made meanwhile moves the tag
+    version = tenant_change_version(subject.tenant_id)
+    # The answer must not come from a replica older than the tag (see get_read_db)
+    request.state.authz_version = version
+    etag = f'"{version}.{subject.tenant_id}.{subject.user_id}.{_request_hash(request)}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers(etag))
+    return etag
+
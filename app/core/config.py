@@ -14,6 +14,9 @@ class Settings(BaseSettings):
     
     # Database connection
     DATABASE_URL: str = "sqlite:///./rbac.db"
+    # Read-only copies of the database for authorization reads (comma
+    # separated), everything goes to DATABASE_URL if empty
+    REPLICA_DATABASE_URLS: str = ""
     
     # JWT token settings
     SECRET_KEY: str = "your-super-secret-key-change-this-in-production"
@@ -33,6 +36,75 @@ class Settings(BaseSettings):
     FIRST_ADMIN_EMAIL: str = "admin@example.com"
     FIRST_ADMIN_PASSWORD: str = "admin123"
     
+    # Permissions and roles to load at setup (YAML or JSON), the built-in list if not set
+    SEED_FILE: Optional[str] = None
+    
+    # Tenants - everything created without a tenant goes to the default one
+    DEFAULT_TENANT_ID: int = 1
+    # Superusers of this tenant run the platform: only they can change the
+    # permission catalog, which every tenant shares
+    PLATFORM_TENANT_ID: int = 1
+    # How many admin requests one tenant can run at the same time
+    TENANT_MAX_CONCURRENT_ADMIN_REQUESTS: int = 4
+    
+    # SQL query tracking - warn when one statement runs this many times in a request
+    N_PLUS_ONE_THRESHOLD: int = 5
+    # Fail requests that run more queries than their declared budget (use in tests)
+    QUERY_BUDGET_STRICT: bool = False
+    
+    # Permission decision cache limits (per tenant)
+    DECISION_CACHE_MAX_TENANTS: int = 1000
+    DECISION_CACHE_MAX_ENTRIES: int = 50000
+    DECISION_CACHE_MAX_ENTRIES_PER_USER: int = 100
+    # Checked tokens kept so their signature isn't verified on every request
+    TOKEN_CACHE_MAX_ENTRIES: int = 10000
+    # Users kept in memory for token introspection
+    PRINCIPAL_CACHE_MAX_ENTRIES: int = 10000
+    
+    # Token introspection - how long answers may be cached (never past the
+    # token's expiry) and how many tokens one batch call may check
+    INTROSPECTION_CACHE_MAX_SECONDS: int = 60
+    INTROSPECTION_BATCH_MAX: int = 100
+    
+    # Serve Prometheus metrics at /metrics
+    METRICS_ENABLED: bool = True
+    
+    # Worker processes for serve.py, one per CPU core if not set
+    WEB_WORKERS: Optional[int] = None
+    
+    # How workers tell each other about role and permission changes:
+    # "none" (one process), "unix" (one host) or "database" (poll authz_changes)
+    INVALIDATION_BACKEND: str = "none"
+    INVALIDATION_SOCKET_DIR: Optional[str] = None
+    INVALIDATION_POLL_INTERVAL_SECONDS: float = 1.0
+    # How long a missing authz change version is waited for (its transaction
+    # may commit after newer ones) before it's taken as rolled back
+    AUTHZ_CHANGE_GAP_SECONDS: float = 30.0
+    
+    # Threads used for bcrypt, so hashing doesn't block requests
+    HASH_POOL_WORKERS: int = 4
+    
+    # Readiness checks - re-run in the background this often
+    HEALTH_CHECK_INTERVAL_SECONDS: float = 2.0
+    # Not ready when fewer pool connections than this are free
+    HEALTH_MIN_POOL_HEADROOM: int = 1
+    # Not ready when more bcrypt jobs than this are waiting
+    HEALTH_MAX_HASH_QUEUE: int = 64
+    
+    # Audit log of permission decisions and admin changes:
+    # "none" (off), "database" (the audit_events table) or "file" (NDJSON in AUDIT_FILE_DIR)
+    AUDIT_BACKEND: str = "none"
+    # Records waiting to be written; allows are dropped first when it fills up
+    AUDIT_BUFFER_SIZE: int = 10000
+    AUDIT_BATCH_SIZE: int = 500
+    AUDIT_FLUSH_INTERVAL_SECONDS: float = 1.0
+    # Share of allows to keep (denies and admin changes are always kept)
+    AUDIT_ALLOW_SAMPLE_RATE: float = 1.0
+    AUDIT_FILE_DIR: str = "./audit"
+    # Start a new file past this size, keeping this many old ones
+    AUDIT_FILE_MAX_BYTES: int = 100 * 1024 * 1024
+    AUDIT_FILE_BACKUPS: int = 5
+    
     @validator("BACKEND_CORS_ORIGINS", pre=True)
     def assemble_cors_origins(cls, v):
         """Convert CORS origins from string to list if needed."""
@@ -0,0 +1,101 @@
+"""
+Sparse fieldsets for the admin read routes.
+
+`fields=` picks the columns of each object, `include=` the related
+objects to embed. Only what's asked for is selected in SQL, and related
+rows aren't loaded at all unless they're included:
+
+    GET /admin/users?fields=email,is_active
+    -> [{"id": 1, "email": "...", "is_active": true}, ...]   (one query)
+
+    GET /admin/users?fields=username&include=roles
+    -> [{"username": "...", "id": 1, "roles": [{"name": ..., "description": ..., "id": ...}]}]
+
+Rules:
+- without `fields`, every column and every include is returned (the
+  normal response)
+- with `fields`, nothing is included unless `include` says so
+- `id` is always returned
+- "roles.permissions" includes the roles' permissions too
+"""
+
+from collections import namedtuple
+from typing import Dict, Optional, Tuple
+from fastapi import HTTPException, Query, status
+
+# What a request asked for: column names in response order, and included relations
+Fieldset = namedtuple("Fieldset", ["fields", "include"])
+
+
+def _split(value: str):
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+
+def parse_fieldset(
+    fields: Optional[str],
+    include: Optional[str],
+    columns: Dict[str, object],
+    includes: Tuple[str, ...] = ()
+) -> Fieldset:
+    """
+    Check and normalize fields= and include= values.
+
+    Args:
+        fields: comma separated column names, or None for all
+        include: comma separated relations, or None for the default
+        columns: the allowed columns, in the order the response lists them
+        includes: the allowed relations, e.g. ("roles", "roles.permissions")
+
+    Returns:
+        Fieldset: the columns to select and the relations to load
+
+    Raises:
+        HTTPException: 400 if a name isn't allowed
+    """
+    if fields is None:
+        chosen = tuple(columns)
+        included = set(includes) if include is None else set()
+    else:
+        requested = set(_split(fields))
+        unknown = requested - set(columns)
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown fields: {', '.join(sorted(unknown))}. Allowed: {', '.join(columns)}"
+            )
+        requested.add("id")
+        chosen = tuple(name for name in columns if name in requested)
+        included = set()
+
+    if include is not None:
+        included = set(_split(include))
+        unknown = included - set(includes)
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown include: {', '.join(sorted(unknown))}. Allowed: {', '.join(includes) or 'nothing'}"
+            )
+        # Nested relations need their parents
+        for name in list(included):
+            parts = name.split(".")
+            included.update(".".join(parts[:i]) for i in range(1, len(parts)))
+
+    return Fieldset(chosen, frozenset(included))
+
+
+def fieldset_dependency(columns: Dict[str, object], includes: Tuple[str, ...] = ()):
+    """
+    A dependency that reads fields= and include= for one kind of object.
+
+    You can use this in FastAPI routes like:
+    def list_things(fieldset: Fieldset = Depends(fieldset_dependency(THING_COLUMNS))):
+        pass
+    """
+    def dependency(
+        fields: Optional[str] = Query(None, description=f"Columns to return: {', '.join(columns)}"),
+        include: Optional[str] = Query(
+            None, description=f"Related objects to embed: {', '.join(includes)}" if includes else "Nothing to include"
+        )
+    ) -> Fieldset:
+        return parse_fieldset(fields, include, columns, includes)
+    return dependency
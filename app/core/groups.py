@@ -0,0 +1,103 @@
+"""
+Group hierarchy utilities.
+This file keeps the group_closure table in step with the group tree.
+"""
+
+from typing import List, Optional
+from sqlalchemy import select, literal, true
+from sqlalchemy.orm import Session
+from app.models.group import Group, group_closure, group_members, group_roles
+
+_CLOSURE_COLUMNS = ["ancestor_id", "descendant_id", "depth"]
+
+
+def get_subtree_ids(db: Session, group_id: int) -> List[int]:
+    """
+    Get a group and every group below it.
+
+    Args:
+        db: database session
+        group_id: the top group
+
+    Returns:
+        A list of group IDs, including group_id itself
+    """
+    query = select(group_closure.c.descendant_id).where(group_closure.c.ancestor_id == group_id)
+    return list(db.execute(query).scalars())
+
+
+def add_group_to_closure(db: Session, group: Group):
+    """
+    Add a new group to the closure table.
+
+    The group is its own ancestor, and gets every ancestor of its parent.
+    The group needs an ID: flush it first, or pass the row that
+    INSERT ... RETURNING gave back (anything with id and parent_id works).
+    """
+    db.execute(group_closure.insert().values(ancestor_id=group.id, descendant_id=group.id, depth=0))
+    if group.parent_id is not None:
+        db.execute(group_closure.insert().from_select(
+            _CLOSURE_COLUMNS,
+            select(group_closure.c.ancestor_id, literal(group.id), group_closure.c.depth + 1)
+            .where(group_closure.c.descendant_id == group.parent_id)
+        ))
+
+
+def move_group(db: Session, group: Group, new_parent_id: Optional[int]) -> List[int]:
+    """
+    Move a group (and everything below it) under a new parent.
+
+    This is a handful of set-based statements no matter how many users
+    are in the groups, because membership isn't touched at all.
+
+    Args:
+        db: database session
+        group: the group to move
+        new_parent_id: the new parent, or None to make it a top-level group
+
+    Returns:
+        IDs of every group that moved, so their caches can be invalidated
+
+    Raises:
+        ValueError: If the new parent is the group itself or below it
+    """
+    subtree = get_subtree_ids(db, group.id)
+    if new_parent_id is not None and new_parent_id in subtree:
+        raise ValueError("A group can't be moved inside itself")
+
+    # Cut the subtree loose from its old ancestors
+    db.execute(group_closure.delete().where(
+        group_closure.c.descendant_id.in_(subtree),
+        group_closure.c.ancestor_id.notin_(subtree)
+    ))
+
+    # Connect every new ancestor to every group in the subtree
+    if new_parent_id is not None:
+        above = group_closure.alias("above")
+        below = group_closure.alias("below")
+        db.execute(group_closure.insert().from_select(
+            _CLOSURE_COLUMNS,
+            select(above.c.ancestor_id, below.c.descendant_id, above.c.depth + below.c.depth + 1)
+            .select_from(above)
+            .join(below, true())
+            .where(above.c.descendant_id == new_parent_id, below.c.ancestor_id == group.id)
+        ))
+
+    group.parent_id = new_parent_id
+    return subtree
+
+
+def remove_group(db: Session, group: Group):
+    """
+    Delete a group that has no child groups, with its closure, role and member rows.
+
+    Raises:
+        ValueError: If the group still has child groups
+    """
+    if db.query(Group.id).filter(Group.parent_id == group.id).first():
+        raise ValueError("Move or delete the child groups first")
+
+    db.execute(group_closure.delete().where(group_closure.c.descendant_id == group.id))
+    db.execute(group_members.delete().where(group_members.c.group_id == group.id))
+    db.execute(group_roles.delete().where(group_roles.c.group_id == group.id))
+    db.delete(group)
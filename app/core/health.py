@@ -0,0 +1,169 @@
+"""
+Liveness and readiness checks for the load balancer.
+
+Readiness looks at the database, the connection pool, the bcrypt threads
+and the permission cache. The same round decides which read replicas are
+caught up enough to use (app/db/replicas.py). The checks run in the background every
+HEALTH_CHECK_INTERVAL_SECONDS and probes just read the last result, so a
+busy load balancer never adds load to the database.
+
+The audit log's backlog and drop counts are reported too, but never make
+a worker unready.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, Optional
+from sqlalchemy import text
+from app.core.audit import audit_log
+from app.core.cache import permission_registry
+from app.core.config import settings
+from app.core.security import hash_queue_depth
+from app.db.base import engine, SessionLocal
+from app.db.replicas import replica_router
+from app.models.permission import Permission
+
+logger = logging.getLogger(__name__)
+
+
+def warm_caches():
+    """Load the permission names so the first requests don't have to."""
+    db = SessionLocal()
+    try:
+        permission_registry.reload(lambda: [name for (name,) in db.query(Permission.name)])
+    finally:
+        db.close()
+
+
+class HealthReport:
+    """
+    The result of one round of readiness checks.
+
+    Attributes:
+        ready: True if every check passed
+        checks: each check's name, whether it passed and some detail
+        checked_at: time.monotonic() when the checks ran
+    """
+
+    def __init__(self, checks: Dict[str, dict]):
+        self.checks = checks
+        self.ready = all(check["ok"] for check in checks.values())
+        self.checked_at = time.monotonic()
+
+    @property
+    def age(self) -> float:
+        """Seconds since the checks ran."""
+        return time.monotonic() - self.checked_at
+
+    def to_dict(self) -> dict:
+        return {
+            "status": "ready" if self.ready else "not ready",
+            "checked_seconds_ago": round(self.age, 3),
+            "checks": self.checks,
+        }
+
+
+class HealthChecker:
+    """Runs the readiness checks and keeps the latest report."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._report: Optional[HealthReport] = None
+        self._lock = threading.Lock()
+
+    def check_pool(self) -> dict:
+        """Free connections left in the pool, counting overflow."""
+        pool = engine.pool
+        size = getattr(pool, "size", None)
+        checked_out = getattr(pool, "checkedout", None)
+        if not callable(size) or not callable(checked_out):
+            # Pools like SQLite's in-memory one don't keep counts
+            return {"ok": True, "detail": "pool does not report its size"}
+        max_overflow = getattr(pool, "_max_overflow", 0)
+        if max_overflow < 0:
+            return {"ok": True, "detail": "pool has no upper limit"}
+        headroom = size() + max_overflow - checked_out()
+        return {
+            "ok": headroom >= settings.HEALTH_MIN_POOL_HEADROOM,
+            "detail": f"{headroom} connections free",
+        }
+
+    def check_database(self) -> dict:
+        """Run SELECT 1 on a pooled connection."""
+        started = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+        except Exception as e:
+            return {"ok": False, "detail": f"database unreachable: {e.__class__.__name__}"}
+        return {"ok": True, "detail": f"{(time.perf_counter() - started) * 1000:.1f} ms"}
+
+    def check_hash_pool(self) -> dict:
+        """bcrypt jobs waiting for a free thread."""
+        waiting = hash_queue_depth()
+        return {
+            "ok": waiting <= settings.HEALTH_MAX_HASH_QUEUE,
+            "detail": f"{waiting} jobs waiting",
+        }
+
+    def check_caches(self) -> dict:
+        """The permission names have been loaded."""
+        if permission_registry.loaded:
+            return {"ok": True, "detail": "warm"}
+        return {"ok": False, "detail": "permission registry not loaded yet"}
+
+    def refresh(self) -> HealthReport:
+        """Run every check now and keep the result."""
+        checks = {"pool": self.check_pool()}
+        # With no free connections the database check would just wait for one
+        if checks["pool"]["ok"]:
+            checks["database"] = self.check_database()
+        else:
+            checks["database"] = {"ok": False, "detail": "skipped, no free connections"}
+        checks["hash_pool"] = self.check_hash_pool()
+        checks["caches"] = self.check_caches()
+        if checks["pool"]["ok"]:
+            checks["replicas"] = replica_router.check()
+        else:
+            # Replicas stay as they were; the primary version can't be read
+            checks["replicas"] = {"ok": True, "detail": "skipped, no free connections"}
+        checks["audit"] = audit_log.check()
+
+        report = HealthReport(checks)
+        if self._report is not None and report.ready != self._report.ready:
+            logger.warning("Readiness changed to %s: %s", report.ready, checks)
+        self._report = report
+        return report
+
+    def report(self) -> HealthReport:
+        """
+        The latest report.
+
+        If the background refresh isn't running (or has fallen behind),
+        one caller runs the checks and everyone else gets the last report.
+        """
+        report = self._report
+        if report is not None and report.age < self.interval * 3:
+            return report
+        if not self._lock.acquire(blocking=report is None):
+            return report
+        try:
+            if self._report is report:
+                return self.refresh()
+            return self._report
+        finally:
+            self._lock.release()
+
+    async def run(self):
+        """Refresh the report forever, every interval seconds."""
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception:
+                logger.exception("Readiness checks failed to run")
+            await asyncio.sleep(self.interval)
+
+
+health_checker = HealthChecker(settings.HEALTH_CHECK_INTERVAL_SECONDS)
@@ -0,0 +1,255 @@
+"""
+Tell other worker processes when roles, permissions or assignments change.
+
+Each worker keeps its own caches (app/core/cache.py). When a worker
+records a change, the bus sends (scope, subject ids) to the other
+workers, and they move the same version forward with apply_change. Only
+decisions for those tenants, users or groups go stale; nothing else in
+the cache is thrown away.
+
+Backends (INVALIDATION_BACKEND):
+- "none": a single process, nothing to send
+- "unix": workers on one host, one datagram socket each in
+  INVALIDATION_SOCKET_DIR. Changes arrive right away.
+- "database": workers anywhere, polling the authz_changes table every
+  INVALIDATION_POLL_INTERVAL_SECONDS. Changes arrive within one interval.
+"""
+
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+from sqlalchemy import func, or_, select
+from app.core.cache import add_change_listener, apply_change, remove_change_listener
+from app.core.config import settings
+from app.db.base import engine
+from app.db.replicas import replica_router
+from app.models.authz_change import AuthzChange
+
+logger = logging.getLogger(__name__)
+
+
+def current_origin() -> str:
+    """Names this worker, so it can ignore its own messages."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class InvalidationBackend:
+    """
+    A way to pass changes between workers.
+
+    publish() is called for changes made here. Changes from other workers
+    are passed to the `apply` callback given to start().
+    """
+
+    def start(self, apply: Callable[[str, tuple], None]):
+        pass
+
+    def publish(self, scope: str, subject_ids: tuple):
+        pass
+
+    def stop(self):
+        pass
+
+
+class UnixSocketBackend(InvalidationBackend):
+    """
+    Workers on one host, each with a datagram socket in one directory.
+
+    Publishing sends one small datagram to every other socket there.
+    Sockets left behind by workers that died are removed when sending fails.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.path = self.directory / f"{os.getpid()}.sock"
+        self._socket: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self, apply):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self.path.exists():
+            self.path.unlink()
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(str(self.path))
+        self._socket.settimeout(0.5)
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._receive, args=(apply,), name="authz-invalidation", daemon=True
+        )
+        self._thread.start()
+
+    def _receive(self, apply):
+        while not self._stopped.is_set():
+            try:
+                data = self._socket.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            try:
+                message = json.loads(data)
+                apply(message["scope"], tuple(message["ids"]))
+            except Exception:
+                logger.exception("Bad invalidation message: %r", data[:200])
+
+    def publish(self, scope, subject_ids):
+        if self._socket is None:
+            return
+        data = json.dumps({"scope": scope, "ids": list(subject_ids)}).encode()
+        for peer in self.directory.glob("*.sock"):
+            if peer == self.path:
+                continue
+            try:
+                self._socket.sendto(data, str(peer))
+            except (ConnectionRefusedError, FileNotFoundError):
+                # That worker is gone
+                peer.unlink(missing_ok=True)
+            except OSError as e:
+                logger.warning("Could not send invalidation to %s: %s", peer.name, e)
+
+    def stop(self):
+        self._stopped.set()
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        self.path.unlink(missing_ok=True)
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+
+
+class DatabasePollingBackend(InvalidationBackend):
+    """
+    Workers anywhere, sharing changes through the authz_changes table.
+
+    Each change is a row with an increasing version (see
+    app/core/changelog.py). Every worker remembers the last version it
+    saw and reads newer rows on a timer.
+
+    A transaction can commit after one with a newer version, so versions
+    missing below the last one seen are read again on every poll until
+    they show up, or until they are gap_seconds old and taken to be
+    rolled back.
+    """
+
+    def __init__(self, interval: float, gap_seconds: float):
+        self.interval = interval
+        self.gap_seconds = gap_seconds
+        self.origin = current_origin()
+        self.last_version = 0
+        # Versions skipped over, and when we first missed them
+        self.gaps: Dict[int, float] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self, apply):
+        # Our caches are empty, so older changes don't matter to us
+        with engine.connect() as conn:
+            self.last_version = conn.execute(select(func.max(AuthzChange.version))).scalar() or 0
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._poll_forever, args=(apply,), name="authz-invalidation", daemon=True
+        )
+        self._thread.start()
+
+    def poll(self, apply) -> int:
+        """
+        Apply changes newer than the last one seen.
+
+        Returns:
+            How many changes from other workers were applied
+        """
+        now = time.monotonic()
+        self.gaps = {version: missed for version, missed in self.gaps.items() if now - missed < self.gap_seconds}
+        newer = AuthzChange.version > self.last_version
+        with engine.connect() as conn:
+            rows = conn.execute(
+                select(AuthzChange.version, AuthzChange.scope, AuthzChange.subject_id, AuthzChange.origin)
+                .where(or_(newer, AuthzChange.version.in_(self.gaps)) if self.gaps else newer)
+                .order_by(AuthzChange.version)
+            ).all()
+        applied = 0
+        for version, scope, subject_id, origin in rows:
+            if version in self.gaps:
+                del self.gaps[version]
+            elif version > self.last_version:
+                for missing in range(self.last_version + 1, version):
+                    self.gaps[missing] = now
+                self.last_version = version
+            if origin == self.origin:
+                continue
+            apply(scope, () if subject_id is None else (subject_id,))
+            applied += 1
+        return applied
+
+    def _poll_forever(self, apply):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.poll(apply)
+            except Exception:
+                logger.exception("Polling for authz changes failed")
+
+    def publish(self, scope, subject_ids):
+        # Nothing to send: app.core.changelog already wrote the row in the
+        # same transaction as the change
+        pass
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+
+
+def default_socket_dir() -> str:
+    return settings.INVALIDATION_SOCKET_DIR or os.path.join(tempfile.gettempdir(), "rbac-invalidation")
+
+
+def make_backend(name: str) -> InvalidationBackend:
+    """Build the backend called `name` (see INVALIDATION_BACKEND)."""
+    if name == "unix":
+        return UnixSocketBackend(default_socket_dir())
+    if name == "database":
+        return DatabasePollingBackend(settings.INVALIDATION_POLL_INTERVAL_SECONDS, settings.AUTHZ_CHANGE_GAP_SECONDS)
+    if name == "none":
+        return InvalidationBackend()
+    raise ValueError(f"Unknown INVALIDATION_BACKEND: {name}")
+
+
+class InvalidationBus:
+    """Connects the local version counters to a backend."""
+
+    def __init__(self):
+        self.backend: Optional[InvalidationBackend] = None
+
+    def start(self, backend: Optional[InvalidationBackend] = None):
+        """Start sending and receiving changes. Call once per worker, after fork."""
+        self.backend = backend or make_backend(settings.INVALIDATION_BACKEND)
+        self.backend.start(self._apply)
+        add_change_listener(self._publish)
+
+    def _apply(self, scope: str, subject_ids: tuple):
+        apply_change(scope, subject_ids)
+        # We don't know the change's version, so keep reads off the replicas for now
+        replica_router.note_remote_change()
+
+    def _publish(self, scope: str, subject_ids: tuple):
+        try:
+            self.backend.publish(scope, subject_ids)
+        except Exception:
+            # The change is already saved; other workers just hear about it late
+            logger.exception("Could not publish authz change %s %s", scope, subject_ids)
+
+    def stop(self):
+        remove_change_listener(self._publish)
+        if self.backend is not None:
+            self.backend.stop()
+            self.backend = None
+
+
+invalidation_bus = InvalidationBus()
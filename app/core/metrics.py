@@ -0,0 +1,239 @@
+"""
+Metrics for the /metrics endpoint, in Prometheus text format.
+
+Every thread writes to its own copy of each metric, so recording a
+value never waits on a lock. The copies are added up when /metrics is read.
+The copies of threads that have exited (thread pools start and stop
+threads all the time) are folded into one running total and dropped.
+"""
+
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Request and database time buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_metrics: List["_Metric"] = []
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Sequence[str], extra: str = "") -> str:
+    """Build the {name="value"} part of a sample line."""
+    parts = [
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(labelnames, labelvalues)
+    ]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    """Shared code for metrics that keep one copy per thread."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        # Each thread that recorded something, with its copy
+        self._shards: List[Tuple[threading.Thread, dict]] = []
+        # What threads that have exited recorded
+        self._retired: dict = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _shard(self) -> dict:
+        """This thread's own copy of the metric."""
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            # Only taken once per thread, the first time it records something
+            with self._lock:
+                self._retire_dead_shards()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_dead_shards(self):
+        """Fold the copies of exited threads into _retired. Call with _lock held."""
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                # Nothing writes to it any more
+                self._merge(self._retired, shard.items())
+        self._shards = live
+
+    def _all_shards(self) -> List[List[tuple]]:
+        """A snapshot of every live thread's copy, plus what exited threads recorded."""
+        with self._lock:
+            self._retire_dead_shards()
+            shards = [shard for _, shard in self._shards]
+            retired = list(self._retired.items())
+        return [retired] + [list(shard.items()) for shard in shards]
+
+    def _merge(self, totals: dict, items):
+        """Add one copy's (label values, value) items into totals."""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        """Lines for the exposition format."""
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def unregister(self):
+        """Stop showing this metric on /metrics."""
+        if self in _metrics:
+            _metrics.remove(self)
+
+
+class Counter(_Metric):
+    """A number that only goes up, e.g. how many tokens we checked."""
+
+    kind = "counter"
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        """Add to the counter for these label values."""
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def _merge(self, totals, items):
+        for labelvalues, value in items:
+            totals[labelvalues] = totals.get(labelvalues, 0) + value
+
+    def collect(self) -> Dict[Tuple[str, ...], float]:
+        """Totals across all threads."""
+        totals: Dict[Tuple[str, ...], float] = {}
+        for items in self._all_shards():
+            self._merge(totals, items)
+        return totals
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for labelvalues, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Counts values into buckets, e.g. how long requests took."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labelvalues: str):
+        """Record one value for these label values."""
+        shard = self._shard()
+        series = shard.get(labelvalues)
+        if series is None:
+            # One count per bucket, one for +Inf, then the sum
+            series = shard[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def _merge(self, totals, items):
+        for labelvalues, series in items:
+            total = totals.setdefault(labelvalues, [0] * len(series))
+            for index, value in enumerate(list(series)):
+                total[index] += value
+
+    def collect(self) -> Dict[Tuple[str, ...], list]:
+        """Bucket counts and sums across all threads."""
+        totals: Dict[Tuple[str, ...], list] = {}
+        for items in self._all_shards():
+            self._merge(totals, items)
+        return totals
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for labelvalues, series in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labelnames, labelvalues, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    A value read when /metrics is scraped, e.g. connections in use.
+
+    The callback returns a number, or a dict of label values to numbers.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        try:
+            value = self.callback()
+        except Exception:
+            return lines
+        if value is None:
+            return lines
+        values = value if isinstance(value, dict) else {(): value}
+        for labelvalues, sample in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {sample}")
+        return lines
+
+
+def render_metrics() -> str:
+    """All metrics in Prometheus text exposition format."""
+    lines = []
+    for metric in list(_metrics):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Metrics recorded around the code base
+http_request_duration = Histogram(
+    "rbac_http_request_duration_seconds",
+    "Time spent handling HTTP requests",
+    ("method", "route", "status")
+)
+password_verify_duration = Histogram(
+    "rbac_password_verify_seconds",
+    "Time spent checking a password hash",
+    ("result",),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0)
+)
+token_verifications = Counter(
+    "rbac_token_verifications_total",
+    "JWT tokens checked",
+    ("result",)
+)
+permission_checks = Counter(
+    "rbac_permission_checks_total",
+    "Permission and role checks made by the RBAC dependencies",
+    ("kind", "result")
+)
+decision_cache_lookups = Counter(
+    "rbac_decision_cache_lookups_total",
+    "Lookups in the permission decision cache",
+    ("result",)
+)
+audit_records = Counter(
+    "rbac_audit_records_total",
+    "Audit records by what happened to them (recorded, sampled_out, shed, dropped, written, failed)",
+    ("result",)
+)
@@ -0,0 +1,189 @@
+"""
+Middleware that watches how many SQL queries each request runs, how
+long each request takes, and which authz changes it committed.
+"""
+
+import logging
+import time
+from fastapi import status
+from app.db.base import QueryStats, current_query_stats
+from app.db.replicas import VERSION_HEADER, RequestWrites, current_request_writes
+from app.core.config import settings
+from app.core.metrics import http_request_duration
+
+logger = logging.getLogger(__name__)
+
+
+def query_budget(max_queries: int):
+    """
+    A dependency that declares how many SQL statements a route should need.
+
+    You can use this in FastAPI routes like:
+    @router.get("/things", dependencies=[Depends(query_budget(3))])
+    def list_things():
+        pass
+
+    Going over the budget is logged. With QUERY_BUDGET_STRICT turned on
+    (for example in tests) the request fails with a 500 instead.
+    """
+    def dependency():
+        stats = current_query_stats.get()
+        if stats is not None:
+            stats.budget = max_queries
+    return dependency
+
+
+class QueryStatsMiddleware:
+    """
+    Counts SQL statements, database time and repeated statements per request.
+
+    In debug mode the numbers are added to the response as headers:
+    - X-DB-Query-Count: statements run
+    - X-DB-Duplicate-Queries: extra runs of statements that ran more than once
+    - Server-Timing: database time, so browser dev tools can show it
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+        replaced = False
+
+        async def send_with_stats(message):
+            nonlocal replaced
+            if message["type"] == "http.response.start":
+                self._check(scope, stats)
+                if stats.over_budget and settings.QUERY_BUDGET_STRICT:
+                    # Swap the real response for an error so tests notice
+                    replaced = True
+                    body = (
+                        f"Query budget exceeded: {stats.count} queries, "
+                        f"budget {stats.budget}"
+                    ).encode()
+                    await send({
+                        "type": "http.response.start",
+                        "status": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                        "headers": [
+                            (b"content-type", b"text/plain; charset=utf-8"),
+                            (b"content-length", str(len(body)).encode()),
+                        ] + self._headers(stats),
+                    })
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + self._headers(stats)
+            elif replaced:
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            current_query_stats.reset(token)
+
+    @staticmethod
+    def _headers(stats: QueryStats):
+        """Response headers with the query numbers, only in debug mode."""
+        if not settings.DEBUG:
+            return []
+        duplicate_runs = sum(seen - 1 for seen in stats.duplicates.values())
+        db_ms = stats.total_time * 1000
+        return [
+            (b"x-db-query-count", str(stats.count).encode()),
+            (b"x-db-duplicate-queries", str(duplicate_runs).encode()),
+            (b"server-timing", f'db;dur={db_ms:.2f};desc="{stats.count} queries"'.encode()),
+        ]
+
+    @staticmethod
+    def _check(scope, stats: QueryStats):
+        """Log routes that look like they have an N+1 or went over budget."""
+        path = scope.get("path", "")
+        for statement, seen in stats.duplicates.items():
+            if seen >= settings.N_PLUS_ONE_THRESHOLD:
+                logger.warning(
+                    "Possible N+1 on %s %s: statement ran %d times: %s",
+                    scope.get("method"), path, seen, " ".join(statement.split())[:200]
+                )
+        if stats.over_budget:
+            logger.warning(
+                "Query budget exceeded on %s %s: %d queries, budget %d",
+                scope.get("method"), path, stats.count, stats.budget
+            )
+
+
+class MetricsMiddleware:
+    """
+    Records how long each request took, by method, route and status code.
+
+    The route is the path template (e.g. /admin/users/{user_id}) rather
+    than the real path, so the number of label values stays small.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            http_request_duration.observe(
+                time.perf_counter() - started,
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status_code)
+            )
+
+
+class ReadYourWritesMiddleware:
+    """
+    Adds X-Authz-Version to responses of requests that changed roles,
+    permissions or assignments.
+
+    Clients send the header back on their next reads, so those reads
+    aren't answered by a replica that hasn't caught up yet (see
+    app/db/replicas.py), whichever worker they land on.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        writes = RequestWrites()
+        token = current_request_writes.set(writes)
+
+        async def send_with_version(message):
+            if message["type"] == "http.response.start" and writes.version:
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [
+                    (VERSION_HEADER.encode(), str(writes.version).encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_version)
+        finally:
+            current_request_writes.reset(token)
@@ -0,0 +1,225 @@
+"""
+A permission checker that needs no database and no ORM.
+
+Other services can embed this instead of calling check_permission()
+with a live User. It loads a snapshot of one tenant's RBAC graph (see
+app/core/snapshot.py), from the database or from a file, and builds
+small in-memory indexes:
+
+- every permission gets a bit; every role is an int with its permissions' bits set
+- every user gets one int: the bits of all their roles, direct or from groups
+- identical bit sets and role sets are shared between users
+
+A check is then a dict lookup and a bit test. Loading a newer snapshot
+builds a new index on the side and swaps it in with one assignment, so
+checks running at the same time see either the old or the new policy,
+never a mix. Until something is loaded, every check says no.
+
+You can use it like:
+    engine = PolicyEngine.from_database(tenant_id=1)
+    engine.allowed(42, "read_users")
+    engine.refresh()   # picks up changes, if there are any
+"""
+
+import io
+import threading
+from typing import Dict, FrozenSet, Iterable, Iterator, Optional
+from app.core.snapshot import export_snapshot, read_snapshot
+
+
+class _ChunkReader(io.RawIOBase):
+    """A file-like view of an iterator of bytes, so snapshots aren't buffered whole."""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class PolicyIndex:
+    """
+    One loaded snapshot. Never changed after it's built.
+
+    Attributes:
+        version: the authz change version the snapshot was taken at
+        tenant_id: the tenant it covers
+    """
+
+    def __init__(self, snapshot: dict):
+        self.version = snapshot.get("version", 0)
+        self.tenant_id = snapshot.get("tenant_id")
+
+        # Permission names -> bit positions
+        permission_bits: Dict[int, int] = {}
+        self.permission_bit: Dict[str, int] = {}
+        for position, (permission_id, name) in enumerate(snapshot["permissions"]):
+            permission_bits[permission_id] = 1 << position
+            self.permission_bit[name] = 1 << position
+
+        self.role_ids: Dict[str, int] = {name: role_id for role_id, name in snapshot["roles"]}
+        role_masks: Dict[int, int] = dict.fromkeys(self.role_ids.values(), 0)
+        for role_id, permission_id in snapshot["role_permissions"]:
+            if role_id in role_masks and permission_id in permission_bits:
+                role_masks[role_id] |= permission_bits[permission_id]
+
+        # Roles each group gives, including roles from the groups above it
+        group_direct_roles: Dict[int, set] = {}
+        for group_id, role_id in snapshot["group_roles"]:
+            group_direct_roles.setdefault(group_id, set()).add(role_id)
+        group_roles: Dict[int, set] = {}
+        for ancestor_id, descendant_id in snapshot["group_closure"]:
+            roles = group_direct_roles.get(ancestor_id)
+            if roles:
+                group_roles.setdefault(descendant_id, set()).update(roles)
+
+        user_roles: Dict[int, set] = {}
+        for user_id, role_id in snapshot["user_roles"]:
+            user_roles.setdefault(user_id, set()).add(role_id)
+        for group_id, user_id in snapshot["group_members"]:
+            roles = group_roles.get(group_id)
+            if roles:
+                user_roles.setdefault(user_id, set()).update(roles)
+
+        # Users with the same roles share one frozenset and one mask
+        shared_role_sets: Dict[FrozenSet[int], FrozenSet[int]] = {}
+        shared_masks: Dict[int, int] = {}
+        empty = frozenset()
+        self.user_masks: Dict[int, int] = {}
+        self.user_roles: Dict[int, FrozenSet[int]] = {}
+        for user_id, is_active, is_superuser in snapshot["users"]:
+            if not is_active:
+                # Inactive users are left out, so every check for them says no
+                continue
+            roles = frozenset(user_roles.get(user_id, empty))
+            roles = shared_role_sets.setdefault(roles, roles)
+            mask = 0
+            for role_id in roles:
+                mask |= role_masks.get(role_id, 0)
+            self.user_roles[user_id] = roles
+            self.user_masks[user_id] = shared_masks.setdefault(mask, mask)
+
+
+class PolicyEngine:
+    """
+    Answers "can this user do this?" from an in-memory snapshot.
+
+    Checks never touch the database. Only load_*, from_* and refresh do.
+    """
+
+    def __init__(self, index: Optional[PolicyIndex] = None):
+        self._index = index
+        # Only held while swapping, never by checks
+        self._swap_lock = threading.Lock()
+
+    @classmethod
+    def from_database(cls, tenant_id: int) -> "PolicyEngine":
+        """Build an engine from the current state of the database."""
+        engine = cls()
+        engine.load_database(tenant_id)
+        return engine
+
+    @classmethod
+    def from_file(cls, path: str) -> "PolicyEngine":
+        """Build an engine from a binary snapshot file."""
+        engine = cls()
+        engine.load_file(path)
+        return engine
+
+    @property
+    def version(self) -> int:
+        """Version of the loaded snapshot, -1 if nothing is loaded."""
+        return self._index.version if self._index is not None else -1
+
+    def swap(self, index: PolicyIndex) -> bool:
+        """
+        Start answering from another index, if it's newer.
+
+        Returns:
+            True if the new index is now in use
+        """
+        # Two refreshes finishing together must not put the older one back
+        with self._swap_lock:
+            current = self._index
+            if current is not None and index.version < current.version:
+                return False
+            # One assignment, so a check sees the old index or the new one
+            self._index = index
+        return True
+
+    def load_snapshot(self, chunks: Iterable[bytes]) -> bool:
+        """Load a binary snapshot given as chunks of bytes."""
+        return self.swap(PolicyIndex(read_snapshot(_ChunkReader(iter(chunks)))))
+
+    def load_file(self, path: str) -> bool:
+        """Load a binary snapshot file (python -m app.core.snapshot -o path)."""
+        with open(path, "rb") as f:
+            return self.swap(PolicyIndex(read_snapshot(f)))
+
+    def load_database(self, tenant_id: int) -> bool:
+        """Load a fresh snapshot of one tenant straight from the database."""
+        return self.load_snapshot(export_snapshot(tenant_id))
+
+    def refresh(self) -> bool:
+        """
+        Reload from the database, but only if the tenant's policy changed since.
+
+        Changes to other tenants don't count; changes to the shared
+        permission list do.
+
+        Returns:
+            True if a newer snapshot was loaded
+        """
+        from app.core.changelog import latest_tenant_version
+        from app.db.base import engine
+
+        index = self._index
+        if index is None:
+            raise RuntimeError("Nothing loaded yet; use load_database first")
+        with engine.connect() as conn:
+            latest = latest_tenant_version(conn, index.tenant_id)
+        if latest <= index.version:
+            return False
+        return self.load_database(index.tenant_id)
+
+    def allowed(self, user_id: int, permission_name: str) -> bool:
+        """
+        Check if a user has a permission, through any of their roles or groups.
+
+        Unknown and inactive users have no permissions.
+        """
+        index = self._index
+        if index is None:
+            return False
+        bit = index.permission_bit.get(permission_name)
+        if bit is None:
+            return False
+        return index.user_masks.get(user_id, 0) & bit != 0
+
+    def has_role(self, user_id: int, role_name: str) -> bool:
+        """Check if a user has a role, directly or through a group."""
+        index = self._index
+        if index is None:
+            return False
+        role_id = index.role_ids.get(role_name)
+        return role_id is not None and role_id in index.user_roles.get(user_id, ())
+
+    def permissions(self, user_id: int) -> FrozenSet[str]:
+        """All the permission names a user has."""
+        index = self._index
+        if index is None:
+            return frozenset()
+        mask = index.user_masks.get(user_id, 0)
+        return frozenset(name for name, bit in index.permission_bit.items() if mask & bit)
@@ -5,12 +5,40 @@ This file has functions to check if users have the right permissions.
 
 from functools import wraps
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy import and_, or_, select, true, exists
 from sqlalchemy.orm import Session
 from typing import List, Optional, Callable, Any
-from app.db.base import get_db
+from app.db.replicas import get_read_db, open_read_session
 from app.models.user import User
+from app.models.role import Role
 from app.models.permission import Permission
-from app.core.auth import get_current_active_user
+from app.models.resource_grant import ResourceGrant, PRINCIPAL_USER, PRINCIPAL_ROLE
+from app.core.auth import TokenSubject, get_current_active_user, get_token_subject, security
+from app.core.cache import (
+    Decision,
+    Principal,
+    decision_caches,
+    get_version_stamp,
+    permission_registry,
+    principal_cache
+)
+from app.core.audit import audit_log
+from app.core.metrics import permission_checks, decision_cache_lookups
+
+
+def _checked(
+    kind: str,
+    allowed: bool,
+    tenant_id: int,
+    user_id: int,
+    name: str,
+    resource_id: Optional[int] = None
+):
+    """Count a check and put it in the audit log (app/core/audit.py)."""
+    permission_checks.inc(kind, "allow" if allowed else "deny")
+    audit_log.decision(kind, allowed, tenant_id, user_id, name, resource_id)
 
 
 def require_permission(permission_name: str):
@@ -36,11 +64,13 @@ def require_permission(permission_name: str):
             
             # Check if the user has the permission we need
             if not current_user.has_permission(permission_name):
+                _checked("permission", False, current_user.tenant_id, current_user.id, permission_name)
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail=f"You need the '{permission_name}' permission to do this"
                 )
             
+            _checked("permission", True, current_user.tenant_id, current_user.id, permission_name)
             return await func(*args, **kwargs)
         return wrapper
     return decorator
@@ -69,11 +99,13 @@ def require_role(role_name: str):
             
             # Check if the user has the role we need
             if not current_user.has_role(role_name):
+                _checked("role", False, current_user.tenant_id, current_user.id, role_name)
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail=f"You need the '{role_name}' role to do this"
                 )
             
+            _checked("role", True, current_user.tenant_id, current_user.id, role_name)
             return await func(*args, **kwargs)
         return wrapper
     return decorator
@@ -115,9 +147,9 @@ def get_user_permissions(current_user: User = Depends(get_current_active_user))
         current_user: the user we're getting permissions for
         
     Returns:
-        A list of permission names that the user has
+        A sorted list of permission names that the user has
     """
-    return list(current_user.permissions)
+    return sorted(current_user.permissions)
 
 
 def require_permission_dependency(permission_name: str):
@@ -131,10 +163,12 @@ def require_permission_dependency(permission_name: str):
     """
     def dependency(current_user: User = Depends(get_current_active_user)) -> User:
         if not current_user.has_permission(permission_name):
+            _checked("permission", False, current_user.tenant_id, current_user.id, permission_name)
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"You need the '{permission_name}' permission to do this"
             )
+        _checked("permission", True, current_user.tenant_id, current_user.id, permission_name)
         return current_user
     return dependency
 
@@ -150,10 +184,345 @@ def require_role_dependency(role_name: str):
     """
     def dependency(current_user: User = Depends(get_current_active_user)) -> User:
         if not current_user.has_role(role_name):
+            _checked("role", False, current_user.tenant_id, current_user.id, role_name)
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"You need the '{role_name}' role to do this"
             )
+        _checked("role", True, current_user.tenant_id, current_user.id, role_name)
+        return current_user
+    return dependency
+
+
+def decide_custom_permission(
+    subject: TokenSubject,
+    permission_name: str,
+    db: Optional[Session]
+) -> Optional[Decision]:
+    """
+    Decide if the user behind a token has a permission, from the cache when possible.
+    
+    Anyone can ask about any string, so:
+    - permission names that don't exist are denied straight away
+    - allows and denies are both remembered per user until their access changes
+    
+    Each tenant has its own decision cache.
+    
+    Args:
+        subject: who the token belongs to
+        permission_name: the permission we're checking for
+        db: database session for cache misses, or None to only look in memory
+        
+    Returns:
+        The decision, which is always an allow (denies raise 403), or
+        None if db is None and the answer needs the database
+        
+    Raises:
+        HTTPException: 403 if denied, 401 if the user is gone, 400 if they're inactive
+    """
+    forbidden = HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail=f"Permission '{permission_name}' required"
+    )
+    
+    # A permission that doesn't exist can't be granted to anyone
+    known = permission_registry.contains(
+        permission_name,
+        (lambda: [name for (name,) in db.query(Permission.name)]) if db is not None else None
+    )
+    if known is None:
+        return None
+    if not known:
+        decision_cache_lookups.inc("unknown_permission")
+        _checked("custom", False, subject.tenant_id, subject.user_id, permission_name)
+        raise forbidden
+    
+    cache = decision_caches.for_tenant(subject.tenant_id)
+    decision = cache.get(subject.user_id, permission_name)
+    if decision is None and db is None:
+        return None
+    decision_cache_lookups.inc("miss" if decision is None else "hit")
+    if decision is None:
+        stamp = cache.stamp()
+        user = db.query(User).filter(
+            User.tenant_id == subject.tenant_id,
+            User.id == subject.user_id
+        ).first()
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        if not user.is_active:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Inactive user"
+            )
+        decision = Decision(user.has_permission(permission_name), user.username)
+        cache.set(subject.user_id, permission_name, decision, stamp, user.group_ids)
+    
+    if not decision.allowed:
+        _checked("custom", False, subject.tenant_id, subject.user_id, permission_name)
+        raise forbidden
+    _checked("custom", True, subject.tenant_id, subject.user_id, permission_name)
+    return decision
+
+
+def require_custom_permission(
+    permission_name: str,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_read_db)
+) -> Decision:
+    """
+    A dependency that checks a permission name taken from the URL.
+    
+    See decide_custom_permission for how the answer is cached.
+    
+    Returns:
+        The decision, which is always an allow (denies raise 403)
+    """
+    subject = get_token_subject(credentials.credentials)
+    if subject is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return decide_custom_permission(subject, permission_name, db)
+
+
+def _decide_with_new_session(subject: TokenSubject, permission_name: str) -> Decision:
+    db = open_read_session()
+    try:
+        return decide_custom_permission(subject, permission_name, db)
+    finally:
+        db.close()
+
+
+async def decide_custom_permission_async(subject: TokenSubject, permission_name: str) -> Decision:
+    """
+    Same as decide_custom_permission, for async routes.
+    
+    Cache hits are answered right here. Only misses go to a worker
+    thread, with their own database session.
+    """
+    decision = decide_custom_permission(subject, permission_name, None)
+    if decision is None:
+        decision = await run_in_threadpool(_decide_with_new_session, subject, permission_name)
+    return decision
+
+
+def require_cached_permission_dependency(permission_name: str):
+    """
+    A dependency that checks a fixed permission from the decision cache.
+    
+    Unlike require_permission_dependency it doesn't load the user, so it
+    suits busy routes that only need to know who is calling.
+    
+    You can use this in FastAPI routes like:
+    async def my_route(caller: TokenSubject = Depends(require_cached_permission_dependency("read_data"))):
+        pass
+    """
+    async def dependency(credentials: HTTPAuthorizationCredentials = Depends(security)) -> TokenSubject:
+        subject = get_token_subject(credentials.credentials)
+        if subject is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        await decide_custom_permission_async(subject, permission_name)
+        return subject
+    return dependency
+
+
+# A token for a user that doesn't exist (never cached)
+_NO_PRINCIPAL = Principal(None, False, frozenset())
+
+
+def load_principal(subject: TokenSubject, db: Optional[Session]) -> Optional[Principal]:
+    """
+    Get a user's name, active flag and permission names, from the cache when possible.
+    
+    Args:
+        subject: who the token belongs to
+        db: database session for cache misses, or None to only look in memory
+        
+    Returns:
+        The principal (inactive if the user doesn't exist), or None if
+        db is None and the answer needs the database
+    """
+    principal = principal_cache.get(subject.tenant_id, subject.user_id)
+    if principal is not None or db is None:
+        return principal
+    
+    stamp = get_version_stamp()
+    user = db.query(User).filter(
+        User.tenant_id == subject.tenant_id,
+        User.id == subject.user_id
+    ).first()
+    if user is None:
+        return _NO_PRINCIPAL
+    principal = Principal(user.username, bool(user.is_active), frozenset(user.permissions))
+    principal_cache.set(subject.tenant_id, subject.user_id, principal, stamp, user.group_ids)
+    return principal
+
+
+def _resource_grants_for(user: User, permission_name: str, resource_type: str):
+    """
+    Build the WHERE conditions that find a user's grants for one permission.
+    
+    A grant counts if it was given to the user directly or to one of
+    their roles (including roles from groups). The conditions follow the
+    order of the grant lookup index.
+    """
+    role_ids = [role.id for role in user.all_roles]
+    permission_id = select(Permission.id).where(Permission.name == permission_name).scalar_subquery()
+    
+    principal = and_(
+        ResourceGrant.principal_type == PRINCIPAL_USER,
+        ResourceGrant.principal_id == user.id
+    )
+    if role_ids:
+        principal = or_(principal, and_(
+            ResourceGrant.principal_type == PRINCIPAL_ROLE,
+            ResourceGrant.principal_id.in_(role_ids)
+        ))
+    
+    return and_(
+        ResourceGrant.tenant_id == user.tenant_id,
+        ResourceGrant.permission_id == permission_id,
+        ResourceGrant.resource_type == resource_type,
+        principal
+    )
+
+
+def check_resource_permission(
+    db: Session,
+    current_user: User,
+    permission_name: str,
+    resource_type: str,
+    resource_id: int
+) -> bool:
+    """
+    Check if a user can do something to one specific resource.
+    
+    Having the permission through a role means "on everything", so
+    we only look at resource grants when that isn't the case.
+    
+    Args:
+        db: database session
+        current_user: the user we're checking
+        permission_name: the permission we're checking for
+        resource_type: what kind of object it is (e.g., 'user')
+        resource_id: ID of the object
+        
+    Returns:
+        True if the user has the permission on this resource, False otherwise
+    """
+    if current_user.has_permission(permission_name):
+        return True
+    
+    query = select(exists().where(
+        _resource_grants_for(current_user, permission_name, resource_type),
+        ResourceGrant.resource_id == resource_id
+    ))
+    return bool(db.execute(query).scalar())
+
+
+def authorized_resource_ids(current_user: User, permission_name: str, resource_type: str):
+    """
+    A subquery of resource IDs the user was granted a permission on.
+    
+    Use it inside another query, e.g. `User.id.in_(authorized_resource_ids(...))`,
+    so the database does the filtering instead of Python.
+    """
+    return select(ResourceGrant.resource_id).where(
+        _resource_grants_for(current_user, permission_name, resource_type)
+    )
+
+
+def resource_filter(current_user: User, permission_name: str, resource_type: str, id_column):
+    """
+    Turn "list R where the user can P" into a WHERE clause.
+    
+    Args:
+        current_user: the user we're checking
+        permission_name: the permission we're checking for
+        resource_type: what kind of object the query returns
+        id_column: the ID column of those objects, e.g. User.id
+        
+    Returns:
+        A SQLAlchemy condition to pass to .filter()
+    """
+    if current_user.has_permission(permission_name):
+        return true()
+    return id_column.in_(authorized_resource_ids(current_user, permission_name, resource_type))
+
+
+# The permission and resource type that let someone read each kind of row
+READ_PERMISSIONS = {
+    User: ("read_users", "user"),
+    Role: ("read_roles", "role"),
+    Permission: ("read_permissions", "permission"),
+}
+
+
+def authorized_filter(current_user: User, model, permission_name: Optional[str] = None):
+    """
+    Turn what a user is allowed to see into a WHERE clause for an admin query.
+    
+    - superusers see every row in their tenant
+    - users with the read permission through a role see every row in their tenant
+    - everyone else sees only the rows they were granted the permission on
+    
+    Args:
+        current_user: the user running the query
+        model: User, Role or Permission
+        permission_name: the permission to check, defaults to the model's read permission
+        
+    Returns:
+        A SQLAlchemy condition to pass to .filter()
+    
+    For example:
+    db.query(User).filter(authorized_filter(current_user, User)).limit(100).all()
+    """
+    default_permission, resource_type = READ_PERMISSIONS[model]
+    permission_name = permission_name or default_permission
+    
+    if current_user.is_superuser:
+        allowed = true()
+    else:
+        allowed = resource_filter(current_user, permission_name, resource_type, model.id)
+    
+    # Tenant first, so the query can use the (tenant_id, ...) indexes
+    if hasattr(model, "tenant_id"):
+        return and_(model.tenant_id == current_user.tenant_id, allowed)
+    return allowed
+
+
+def require_resource_permission_dependency(permission_name: str, resource_type: str):
+    """
+    A dependency that makes sure a user has a permission on the resource in the URL.
+    
+    The route needs a `resource_id` path parameter:
+    @router.put("/posts/{resource_id}")
+    def edit_post(current_user: User = Depends(require_resource_permission_dependency("edit_posts", "post"))):
+        pass
+    """
+    def dependency(
+        resource_id: int,
+        current_user: User = Depends(get_current_active_user),
+        db: Session = Depends(get_read_db)
+    ) -> User:
+        if not check_resource_permission(db, current_user, permission_name, resource_type, resource_id):
+            _checked("resource", False, current_user.tenant_id, current_user.id, permission_name, resource_id)
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"You need the '{permission_name}' permission on this {resource_type} to do this"
+            )
+        _checked("resource", True, current_user.tenant_id, current_user.id, permission_name, resource_id)
         return current_user
     return dependency
 
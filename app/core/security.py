@@ -2,15 +2,26 @@
 Security utilities for password hashing and verification.
 """
 
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from app.core.config import settings
+from app.core.metrics import password_verify_duration, token_verifications
 
 # Password hashing context
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt is slow on purpose, so async routes hand it to these threads
+# instead of blocking the event loop
+_hash_pool = ThreadPoolExecutor(max_workers=settings.HASH_POOL_WORKERS, thread_name_prefix="bcrypt")
+_hash_jobs = 0
+_hash_jobs_lock = threading.Lock()
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
@@ -23,7 +34,10 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     Returns:
         bool: True if password matches, False otherwise
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    started = time.perf_counter()
+    result = pwd_context.verify(plain_password, hashed_password)
+    password_verify_duration.observe(time.perf_counter() - started, "match" if result else "mismatch")
+    return result
 
 
 def get_password_hash(password: str) -> str:
@@ -39,6 +53,37 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+def _hash_job_done(future):
+    global _hash_jobs
+    with _hash_jobs_lock:
+        _hash_jobs -= 1
+
+
+async def _run_in_hash_pool(func, *args):
+    """Run a bcrypt call on the hash threads and wait for it."""
+    global _hash_jobs
+    with _hash_jobs_lock:
+        _hash_jobs += 1
+    future = _hash_pool.submit(func, *args)
+    future.add_done_callback(_hash_job_done)
+    return await asyncio.wrap_future(future)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Same as verify_password, but runs on the hash threads."""
+    return await _run_in_hash_pool(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Same as get_password_hash, but runs on the hash threads."""
+    return await _run_in_hash_pool(get_password_hash, password)
+
+
+def hash_queue_depth() -> int:
+    """How many bcrypt jobs are waiting for a free hash thread."""
+    return max(0, _hash_jobs - settings.HASH_POOL_WORKERS)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
     Create a JWT access token.
@@ -61,18 +106,22 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
-def create_refresh_token(data: dict) -> str:
+def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
     Create a JWT refresh token.
     
     Args:
         data: The data to encode in the token
+        expires_delta: Optional expiration time override
         
     Returns:
         str: The encoded JWT refresh token
     """
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+    if expires_delta:
+        expire = datetime.utcnow() + expires_delta
+    else:
+        expire = datetime.utcnow() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
     to_encode.update({"exp": expire, "type": "refresh"})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
@@ -90,6 +139,8 @@ def verify_token(token: str) -> Optional[dict]:
     """
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        token_verifications.inc("valid")
         return payload
     except JWTError:
+        token_verifications.inc("invalid")
         return None 
\ No newline at end of file
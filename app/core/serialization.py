@@ -0,0 +1,81 @@
+"""
+Fast JSON for big responses.
+
+The normal FastAPI path turns every row into pydantic models and then
+into JSON. For long lists where the same roles and permissions show up
+again and again, it's much cheaper to:
+- read plain tuples from SQL
+- encode each distinct role or permission once and reuse the bytes
+- send the list in batches as it's encoded
+
+orjson is used when it's installed; otherwise the json module does the work.
+"""
+
+import json
+from typing import Iterable, Iterator
+from fastapi.responses import StreamingResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# How many encoded items go into one chunk of a streamed array
+STREAM_BATCH_SIZE = 500
+
+_json_encode = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+
+
+def dumps(obj) -> bytes:
+    """Encode plain data (dicts, lists, strings, numbers) as compact JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return _json_encode(obj).encode()
+
+
+def encoded_list(items: Iterable[bytes]) -> bytes:
+    """A JSON array made of already-encoded items."""
+    return b"[" + b",".join(items) + b"]"
+
+
+def with_field(encoded_object: bytes, name: str, encoded_value: bytes) -> bytes:
+    """
+    Add a field to an encoded JSON object without decoding it.
+
+    Args:
+        encoded_object: a JSON object, e.g. b'{"id":1}'
+        name: the new field's name
+        encoded_value: the new field's value, already encoded
+
+    Returns:
+        The object with the field added at the end
+    """
+    separator = b"," if encoded_object != b"{}" else b""
+    return encoded_object[:-1] + separator + dumps(name) + b":" + encoded_value + b"}"
+
+
+def stream_array(items: Iterable[bytes], batch_size: int = STREAM_BATCH_SIZE) -> Iterator[bytes]:
+    """
+    Yield a JSON array of already-encoded items, a batch at a time.
+
+    The first bytes go out before the last item is encoded, so clients
+    start reading big pages sooner and the whole body is never in memory.
+    """
+    yield b"["
+    batch = []
+    separator = b""
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield separator + b",".join(batch)
+            separator = b","
+            batch = []
+    if batch:
+        yield separator + b",".join(batch)
+    yield b"]"
+
+
+class JSONStreamingResponse(StreamingResponse):
+    """A streamed response whose chunks together make one JSON document."""
+
+    media_type = "application/json"
@@ -0,0 +1,272 @@
+"""
+Export a tenant's whole RBAC graph in one go, for gateways that check
+permissions themselves.
+
+Rows are read with streaming cursors and written out in batches as they
+arrive, so memory stays flat however big the graph is. Everything is read
+in one snapshot transaction (see _consistent_read) and stamped with the
+latest authz change version; follow up with
+GET /authz/changes?since=<version> to stay current.
+
+Two formats:
+
+- "binary" (default): the bytes MAGIC, then frames of
+  kind (1 byte) + payload length (uint32, big endian) + payload.
+    H  header, JSON: {"format", "version", "tenant_id"}
+    S  section start, JSON: {"name", "columns", "types"}
+    R  rows: uint32 row count, then each row's columns by type:
+       i = int64, b = uint8 (0/1), s = uint32 byte length + UTF-8
+       (all little endian)
+    E  section end, JSON: {"rows"}
+- "ndjson": one JSON object per line: the header, then for each section
+  {"section", "columns"}, a JSON array per row, and {"end", "rows"}.
+
+Command line:
+    python -m app.core.snapshot --tenant 1 --format ndjson -o snapshot.ndjson
+"""
+
+import json
+import struct
+from typing import BinaryIO, Iterator, List, Tuple
+from sqlalchemy import func, select
+from app.db.base import engine
+from app.models.authz_change import AuthzChange
+from app.models.group import Group, group_closure, group_members, group_roles
+from app.models.permission import Permission
+from app.models.resource_grant import ResourceGrant
+from app.models.role import Role, role_permissions
+from app.models.user import User, user_roles
+
+MAGIC = b"RBACSNP1"
+FORMAT_VERSION = 1
+BATCH_SIZE = 1000
+
+_FRAME = struct.Struct(">cI")
+_COUNT = struct.Struct("<I")
+_STRUCT_CODES = {"i": "q", "b": "B"}
+_to_json = json.JSONEncoder(separators=(",", ":")).encode
+
+
+def _sections(tenant_id: int) -> List[Tuple[str, List[str], str, object]]:
+    """(name, columns, types, query) for every part of the graph."""
+    tenant_groups = select(Group.id).where(Group.tenant_id == tenant_id)
+    return [
+        ("permissions", ["id", "name"], "is",
+         select(Permission.id, Permission.name).order_by(Permission.id)),
+        ("roles", ["id", "name"], "is",
+         select(Role.id, Role.name).where(Role.tenant_id == tenant_id).order_by(Role.id)),
+        ("users", ["id", "is_active", "is_superuser"], "ibb",
+         select(User.id, func.coalesce(User.is_active, False), func.coalesce(User.is_superuser, False))
+         .where(User.tenant_id == tenant_id).order_by(User.id)),
+        ("role_permissions", ["role_id", "permission_id"], "ii",
+         select(role_permissions.c.role_id, role_permissions.c.permission_id)
+         .join(Role, Role.id == role_permissions.c.role_id)
+         .where(Role.tenant_id == tenant_id)
+         .order_by(role_permissions.c.role_id, role_permissions.c.permission_id)),
+        ("user_roles", ["user_id", "role_id"], "ii",
+         select(user_roles.c.user_id, user_roles.c.role_id)
+         .join(User, User.id == user_roles.c.user_id)
+         .where(User.tenant_id == tenant_id)
+         .order_by(user_roles.c.user_id, user_roles.c.role_id)),
+        ("group_roles", ["group_id", "role_id"], "ii",
+         select(group_roles.c.group_id, group_roles.c.role_id)
+         .where(group_roles.c.group_id.in_(tenant_groups))
+         .order_by(group_roles.c.group_id, group_roles.c.role_id)),
+        ("group_members", ["group_id", "user_id"], "ii",
+         select(group_members.c.group_id, group_members.c.user_id)
+         .where(group_members.c.group_id.in_(tenant_groups))
+         .order_by(group_members.c.group_id, group_members.c.user_id)),
+        ("group_closure", ["ancestor_id", "descendant_id"], "ii",
+         select(group_closure.c.ancestor_id, group_closure.c.descendant_id)
+         .where(group_closure.c.descendant_id.in_(tenant_groups))
+         .order_by(group_closure.c.ancestor_id, group_closure.c.descendant_id)),
+        ("resource_grants", ["principal_type", "principal_id", "permission_id", "resource_type", "resource_id"], "siisi",
+         select(
+             ResourceGrant.principal_type, ResourceGrant.principal_id, ResourceGrant.permission_id,
+             ResourceGrant.resource_type, ResourceGrant.resource_id
+         ).where(ResourceGrant.tenant_id == tenant_id).order_by(ResourceGrant.id)),
+    ]
+
+
+def _consistent_read(conn):
+    """
+    Start a transaction in which every query sees the same committed data.
+
+    Under the default READ COMMITTED each section would see the changes
+    committed while the ones before it streamed out, and the version in the
+    header wouldn't match them.
+    """
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        # Waits for a moment no serializable transaction can disturb, then never blocks or fails
+        conn.execution_options(
+            isolation_level="SERIALIZABLE", postgresql_readonly=True, postgresql_deferrable=True
+        )
+        return conn.begin()
+    if dialect == "sqlite":
+        # The driver only starts transactions for writes, so start this one ourselves
+        transaction = conn.begin()
+        conn.exec_driver_sql("BEGIN")
+        return transaction
+    conn.execution_options(isolation_level="REPEATABLE READ")
+    return conn.begin()
+
+
+def _frame(kind: bytes, payload: bytes) -> bytes:
+    return _FRAME.pack(kind, len(payload)) + payload
+
+
+def _json_frame(kind: bytes, data: dict) -> bytes:
+    return _frame(kind, _to_json(data).encode())
+
+
+def _row_encoder(types: str):
+    """A function that turns one row into bytes."""
+    if "s" not in types:
+        # All numbers: one struct call per row
+        row_struct = struct.Struct("<" + "".join(_STRUCT_CODES[code] for code in types))
+        return lambda row: row_struct.pack(*row)
+
+    def encode(row):
+        parts = []
+        for code, value in zip(types, row):
+            if code == "s":
+                data = value.encode()
+                parts.append(_COUNT.pack(len(data)))
+                parts.append(data)
+            else:
+                parts.append(struct.pack("<" + _STRUCT_CODES[code], value))
+        return b"".join(parts)
+    return encode
+
+
+def export_snapshot(tenant_id: int, fmt: str = "binary") -> Iterator[bytes]:
+    """
+    Stream a tenant's RBAC graph.
+
+    Args:
+        tenant_id: the tenant to export (permissions are shared by all tenants)
+        fmt: "binary" or "ndjson"
+
+    Yields:
+        bytes: chunks of the snapshot, one batch of rows at a time
+
+    Raises:
+        ValueError: If the format is unknown
+    """
+    if fmt not in ("binary", "ndjson"):
+        raise ValueError(f"Unknown snapshot format: {fmt}")
+    binary = fmt == "binary"
+
+    with engine.connect() as conn:
+        # One snapshot, so every section and the version come from the same moment
+        with _consistent_read(conn):
+            version = conn.execute(select(func.max(AuthzChange.version))).scalar() or 0
+            header = {"format": FORMAT_VERSION, "version": version, "tenant_id": tenant_id}
+            if binary:
+                yield MAGIC + _json_frame(b"H", header)
+            else:
+                yield _to_json(header).encode() + b"\n"
+
+            for name, columns, types, query in _sections(tenant_id):
+                if binary:
+                    yield _json_frame(b"S", {"name": name, "columns": columns, "types": types})
+                    encode = _row_encoder(types)
+                else:
+                    yield _to_json({"section": name, "columns": columns}).encode() + b"\n"
+
+                total = 0
+                result = conn.execute(query.execution_options(stream_results=True, yield_per=BATCH_SIZE))
+                for batch in result.partitions():
+                    total += len(batch)
+                    if binary:
+                        yield _frame(b"R", _COUNT.pack(len(batch)) + b"".join(encode(row) for row in batch))
+                    else:
+                        yield b"".join(
+                            _to_json([bool(v) if code == "b" else v for code, v in zip(types, row)]).encode() + b"\n"
+                            for row in batch
+                        )
+
+                if binary:
+                    yield _json_frame(b"E", {"rows": total})
+                else:
+                    yield _to_json({"end": name, "rows": total}).encode() + b"\n"
+
+
+def _decode_rows(types: str, payload: bytes) -> Iterator[tuple]:
+    (count,) = _COUNT.unpack_from(payload)
+    offset = _COUNT.size
+    for _ in range(count):
+        row = []
+        for code in types:
+            if code == "s":
+                (length,) = _COUNT.unpack_from(payload, offset)
+                offset += _COUNT.size
+                row.append(payload[offset:offset + length].decode())
+                offset += length
+            else:
+                fmt = "<" + _STRUCT_CODES[code]
+                (value,) = struct.unpack_from(fmt, payload, offset)
+                offset += struct.calcsize(fmt)
+                row.append(bool(value) if code == "b" else value)
+        yield tuple(row)
+
+
+def read_snapshot(stream: BinaryIO) -> dict:
+    """
+    Read a binary snapshot back into memory.
+
+    Returns:
+        dict: the header fields, plus a list of row tuples per section name
+
+    Raises:
+        ValueError: If the data isn't a snapshot, or is cut short
+    """
+    if stream.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not an RBAC snapshot")
+    snapshot = {}
+    section = types = None
+    while True:
+        head = stream.read(_FRAME.size)
+        if not head:
+            return snapshot
+        if len(head) < _FRAME.size:
+            raise ValueError("Snapshot is cut short")
+        kind, length = _FRAME.unpack(head)
+        payload = stream.read(length)
+        if len(payload) < length:
+            raise ValueError("Snapshot is cut short")
+        if kind == b"H":
+            snapshot.update(json.loads(payload))
+        elif kind == b"S":
+            start = json.loads(payload)
+            section, types = start["name"], start["types"]
+            snapshot[section] = []
+        elif kind == b"R":
+            snapshot[section].extend(_decode_rows(types, payload))
+        elif kind == b"E":
+            section = types = None
+
+
+def main():
+    import argparse
+    import sys
+    from app.core.config import settings
+
+    parser = argparse.ArgumentParser(description="Export the RBAC graph of one tenant")
+    parser.add_argument("--tenant", type=int, default=settings.DEFAULT_TENANT_ID)
+    parser.add_argument("--format", choices=["binary", "ndjson"], default="binary")
+    parser.add_argument("-o", "--output", help="file to write (standard output if not given)")
+    args = parser.parse_args()
+
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in export_snapshot(args.tenant, args.format):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
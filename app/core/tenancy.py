@@ -0,0 +1,115 @@
+"""
+Tenant utilities.
+Every customer is a tenant, and this file keeps one tenant from using up
+resources that the others need.
+"""
+
+import threading
+from typing import Dict
+from fastapi import Depends, HTTPException, status
+from app.models.user import User
+from app.core.auth import get_current_active_user, get_current_superuser
+from app.core.config import settings
+
+
+class TenantLimiter:
+    """
+    Limits how many requests each tenant can run at the same time.
+
+    All tenants share one database pool. Capping each tenant's share means
+    a tenant running lots of heavy admin queries gets 429s instead of
+    making everyone else wait for a connection.
+    """
+
+    def __init__(self, max_concurrent: int):
+        self.max_concurrent = max_concurrent
+        self._active: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, tenant_id: int) -> bool:
+        """
+        Try to take a slot for a tenant.
+
+        Returns:
+            True if the tenant had a free slot, False otherwise
+        """
+        with self._lock:
+            active = self._active.get(tenant_id, 0)
+            if active >= self.max_concurrent:
+                return False
+            self._active[tenant_id] = active + 1
+            return True
+
+    def release(self, tenant_id: int):
+        """Give a slot back."""
+        with self._lock:
+            active = self._active.get(tenant_id, 0) - 1
+            if active > 0:
+                self._active[tenant_id] = active
+            else:
+                self._active.pop(tenant_id, None)
+
+    def active(self, tenant_id: int) -> int:
+        """How many slots a tenant is using right now."""
+        return self._active.get(tenant_id, 0)
+
+
+# Shared limiter for the admin routes
+admin_limiter = TenantLimiter(settings.TENANT_MAX_CONCURRENT_ADMIN_REQUESTS)
+
+
+def _hold_tenant_slot(current_user: User):
+    """Hold one of the user's tenant admin slots until the request is finished."""
+    tenant_id = current_user.tenant_id
+    if not admin_limiter.acquire(tenant_id):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many admin requests for this tenant, try again shortly",
+            headers={"Retry-After": "1"}
+        )
+    try:
+        yield current_user
+    finally:
+        admin_limiter.release(tenant_id)
+
+
+def get_tenant_admin(current_user: User = Depends(get_current_superuser)):
+    """
+    Get the current superuser and hold one of their tenant's admin slots.
+
+    Raises:
+        HTTPException: If the tenant already has too many admin requests running
+    """
+    yield from _hold_tenant_slot(current_user)
+
+
+def get_platform_admin(current_user: User = Depends(get_tenant_admin)) -> User:
+    """
+    Get the current superuser if they are a platform admin.
+
+    Use this for changes to things every tenant shares, like the permission
+    catalog: a tenant's own superusers must not rename or delete what other
+    tenants depend on.
+
+    Raises:
+        HTTPException: If the user is a superuser of any other tenant
+    """
+    if current_user.tenant_id != settings.PLATFORM_TENANT_ID:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only platform admins can change the permission catalog"
+        )
+    return current_user
+
+
+def get_tenant_reader(current_user: User = Depends(get_current_active_user)):
+    """
+    Get the current user for an admin read route and hold a tenant admin slot.
+
+    Any active user gets in; what they see is limited by the query
+    filters from app.core.rbac.authorized_filter.
+
+    Raises:
+        HTTPException: If the tenant already has too many admin requests running
+    """
+    yield from _hold_tenant_slot(current_user)
@@ -2,10 +2,15 @@
 Database base configuration and session management.
 """
 
-from sqlalchemy import create_engine
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
+from app.core.metrics import Gauge
 
 # Create database engine
 engine = create_engine(
@@ -13,6 +18,99 @@ engine = create_engine(
     connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {}
 )
 
+
+class QueryStats:
+    """
+    Counts the SQL statements run while handling one request.
+    
+    Attributes:
+        count: how many statements ran
+        total_time: seconds spent waiting for the database
+        shapes: how many times each statement text ran
+        budget: the most statements the route said it needs, if it said
+    """
+    
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.shapes: Dict[str, int] = {}
+        self.budget: Optional[int] = None
+    
+    @property
+    def duplicates(self) -> Dict[str, int]:
+        """Statements that ran more than once, usually the sign of an N+1."""
+        return {statement: seen for statement, seen in self.shapes.items() if seen > 1}
+    
+    @property
+    def over_budget(self) -> bool:
+        """True if the route ran more statements than it said it would."""
+        return self.budget is not None and self.count > self.budget
+
+
+# The stats for the request we're handling right now, if anyone is counting
+current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("current_query_stats", default=None)
+
+
+@contextmanager
+def track_queries():
+    """
+    Count the statements run inside a with block.
+    
+    Requests are counted by QueryStatsMiddleware, this is for code that
+    runs outside a request, for example in a test:
+    with track_queries() as stats:
+        init_db()
+    print(stats.count, stats.duplicates)
+    """
+    stats = QueryStats()
+    token = current_query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        current_query_stats.reset(token)
+
+
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if current_query_stats.get() is not None:
+        conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    stats = current_query_stats.get()
+    if stats is None:
+        return
+    start_times = conn.info.get("query_start_times")
+    if start_times:
+        stats.total_time += time.perf_counter() - start_times.pop()
+    stats.count += 1
+    # Parameters are kept apart from the text, so the text is the statement's shape
+    stats.shapes[statement] = stats.shapes.get(statement, 0) + 1
+
+
+def count_queries(target):
+    """Count the statements an engine runs in QueryStats (replica engines need this too)."""
+    event.listen(target, "before_cursor_execute", _start_query_timer)
+    event.listen(target, "after_cursor_execute", _record_query)
+
+
+count_queries(engine)
+
+
+def _pool_stat(name: str):
+    """Read one number from the connection pool, if this pool type has it."""
+    def read():
+        method = getattr(engine.pool, name, None)
+        return method() if callable(method) else None
+    return read
+
+
+# Connection pool numbers for /metrics
+Gauge("rbac_db_pool_size", "Connections the pool keeps open", _pool_stat("size"))
+Gauge("rbac_db_pool_checked_out", "Connections in use right now", _pool_stat("checkedout"))
+Gauge("rbac_db_pool_checked_in", "Idle connections in the pool", _pool_stat("checkedin"))
+Gauge("rbac_db_pool_overflow", "Connections opened beyond the pool size", _pool_stat("overflow"))
+
+
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -0,0 +1,118 @@
+"""
+Run and check database migrations (the files in migrations/).
+
+The schema is only ever changed by `alembic upgrade head` (or
+upgrade_database() below). The app itself just checks at startup that
+the database is on the latest migration.
+
+Databases made before there were migrations (by the first release, or by
+Base.metadata.create_all) have tables but no alembic_version.
+upgrade_database() works out which migration their tables match, stamps
+them with it and upgrades from there. `alembic upgrade head` can't do
+that; run `python -m app.db.migrations` on such a database once.
+"""
+
+import logging
+from pathlib import Path
+from typing import Optional
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection, Engine
+from app.db.base import engine
+
+logger = logging.getLogger(__name__)
+
+ALEMBIC_INI = Path(__file__).resolve().parents[2] / "alembic.ini"
+
+
+class SchemaVersionError(RuntimeError):
+    """The database is not on the migration this code expects."""
+
+
+def _alembic_config() -> Config:
+    config = Config(str(ALEMBIC_INI))
+    # Leave logging set up by whoever called us
+    config.attributes["configure_logger"] = False
+    return config
+
+
+def existing_revision(connection: Connection) -> Optional[str]:
+    """
+    The newest migration an unversioned database's tables already have.
+
+    Each migration leaves something behind that the ones before it don't
+    have, so look for those, newest first.
+
+    Returns:
+        A revision id, or None if the database has no tables yet
+    """
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    if "permissions" not in tables:
+        return None
+    if "authz_changes" in tables and "ix_authz_changes_tenant_id_version" in {
+        index["name"] for index in inspector.get_indexes("authz_changes")
+    }:
+        return "0009"
+    if "audit_events" in tables:
+        return "0008"
+    if "ix_users_email_lower" in {index["name"] for index in inspector.get_indexes("users")}:
+        return "0007"
+    if "authz_changes" in tables:
+        columns = {column["name"] for column in inspector.get_columns("authz_changes")}
+        return "0006" if "entity_type" in columns else "0005"
+    if "groups" in tables:
+        return "0004"
+    if "resource_grants" in tables:
+        return "0003"
+    if "tenant_id" in {column["name"] for column in inspector.get_columns("users")}:
+        return "0002"
+    return "0001"
+
+
+def upgrade_database(bind: Optional[Engine] = None):
+    """
+    Apply any migrations the database doesn't have yet.
+
+    Args:
+        bind: the database to upgrade, the app's own if not given
+    """
+    config = _alembic_config()
+    with (bind or engine).begin() as connection:
+        config.attributes["connection"] = connection
+        if not MigrationContext.configure(connection).get_current_heads():
+            revision = existing_revision(connection)
+            if revision is not None:
+                logger.warning("Database has tables but no migration version, stamping it with %s", revision)
+                command.stamp(config, revision)
+        command.upgrade(config, "head")
+
+
+def check_schema_version(bind: Optional[Engine] = None):
+    """
+    Make sure the database is on the latest migration.
+
+    This only reads the alembic_version table, so it's quick.
+
+    Args:
+        bind: the database to check, the app's own if not given
+
+    Raises:
+        SchemaVersionError: If migrations still need to run
+    """
+    expected = set(ScriptDirectory.from_config(_alembic_config()).get_heads())
+    with (bind or engine).connect() as connection:
+        current = set(MigrationContext.configure(connection).get_current_heads())
+    if current != expected:
+        raise SchemaVersionError(
+            f"Database schema is at {sorted(current) or 'nothing'} but the code needs "
+            f"{sorted(expected)}. Run `python -m app.db.migrations` first."
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    upgrade_database()
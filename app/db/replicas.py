@@ -0,0 +1,252 @@
+"""
+Read replicas for authorization reads.
+
+Routes that only read (get_current_user, permission checks, the admin
+listings) take their session from get_read_db instead of get_db. With
+REPLICA_DATABASE_URLS set, those sessions go round-robin to the replicas
+that passed their last health check. With no replicas, or none usable,
+they use the primary like everything else.
+
+Replicas lag behind the primary, so one is only used once it has caught
+up with the authz change log (app/core/changelog.py):
+- after this worker commits a change, reads stay on the primary until a
+  health check sees the replicas at that change's version
+- after another worker's change arrives on the invalidation bus, reads
+  stay on the primary until the next health check sees the replicas
+  caught up with the primary
+- the response to a write carries the change version in X-Authz-Version;
+  a client that sends it back gets the same guarantee on any worker
+- a response with an ETag (app/core/conditional.py) is read from a replica
+  that has the version in the tag, so a tag never labels older data
+- a replica that hasn't reached the version the primary had at the
+  previous check is left out, so none is more than about one
+  HEALTH_CHECK_INTERVAL_SECONDS behind. On the first check there is no
+  previous one, so a replica must have the version the primary has now.
+- a user who just registered has a change row too, so they can log in
+  and be found even if the next read lands on a replica
+
+Without this a permission change could be read back stale from a replica
+and cached under the new version, where it would stay until the next change.
+
+Requests other than GET, HEAD and OPTIONS always use the primary, with
+the same session as get_db.
+"""
+
+import itertools
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Iterable, List, Optional
+from fastapi import Depends, Request
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session, sessionmaker
+from app.core.config import settings
+from app.db.base import SessionLocal, count_queries, engine, get_db
+from app.models.authz_change import AuthzChange
+
+logger = logging.getLogger(__name__)
+
+# Sent with writes and read back from clients, see the module docstring
+VERSION_HEADER = "x-authz-version"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class ReplicaSession(Session):
+    """A session on a replica, which must never write."""
+
+    def flush(self, objects=None):
+        if self.new or self.dirty or self.deleted:
+            raise RuntimeError("Replica sessions are read-only, use get_db to make changes")
+        super().flush(objects)
+
+
+ReplicaSessionLocal = sessionmaker(class_=ReplicaSession, autocommit=False, autoflush=False)
+
+
+class Replica:
+    """
+    One read-only copy of the database.
+
+    Attributes:
+        engine: the replica's own engine and connection pool
+        healthy: whether it answered the last check and wasn't too far behind
+        version: the newest authz change it had at the last check
+        detail: what the last check found, for /health/ready
+    """
+
+    def __init__(self, url: str):
+        self.engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False} if "sqlite" in url else {}
+        )
+        count_queries(self.engine)
+        self.healthy = False
+        self.version = 0
+        self.detail = "not checked yet"
+
+    @property
+    def name(self) -> str:
+        """The URL without its password, for logs."""
+        return self.engine.url.render_as_string(hide_password=True)
+
+
+def _change_version(connection) -> int:
+    return connection.execute(select(func.max(AuthzChange.version))).scalar() or 0
+
+
+class ReplicaRouter:
+    """
+    Picks a replica for each read, or None when the primary should answer.
+
+    check() runs with the readiness checks (app/core/health.py) and is the
+    only thing that looks at the replicas; pick() just reads its results.
+    """
+
+    def __init__(self, urls: Iterable[str]):
+        self.replicas: List[Replica] = [Replica(url) for url in urls]
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        # Replicas need this version before reads go to them
+        self._required_version = 0
+        # Primary's version at the last check, the most a replica may lag
+        self._primary_version: Optional[int] = None
+        # Changes from other workers since the last check, whose versions we don't know
+        self._remote_changes = 0
+        self._checked_remote_changes = 0
+
+    def note_write(self, version: int):
+        """This worker committed the change with this version."""
+        with self._lock:
+            self._required_version = max(self._required_version, version)
+
+    def note_remote_change(self):
+        """Another worker made a change; wait for a check before trusting the replicas."""
+        with self._lock:
+            self._remote_changes += 1
+
+    def pick(self, min_version: int = 0) -> Optional[Replica]:
+        """
+        The next replica that has everything a read needs.
+
+        Args:
+            min_version: a change version the caller must be able to see
+
+        Returns:
+            A replica, or None to use the primary
+        """
+        if not self.replicas or self._remote_changes != self._checked_remote_changes:
+            return None
+        needed = max(min_version, self._required_version)
+        usable = [replica for replica in self.replicas if replica.healthy and replica.version >= needed]
+        if not usable:
+            return None
+        return usable[next(self._turn) % len(usable)]
+
+    def check(self) -> dict:
+        """Read every replica's change version and decide which can be used."""
+        if not self.replicas:
+            return {"ok": True, "detail": "no replicas, reads use the primary"}
+        remote_changes = self._remote_changes
+        # The primary first: a replica read after it that has this version is caught up
+        try:
+            with engine.connect() as conn:
+                primary_version = _change_version(conn)
+        except Exception as e:
+            return {"ok": True, "detail": f"primary unreachable, replicas not checked: {e.__class__.__name__}"}
+
+        # With no earlier check we don't know how far behind is too far, so
+        # only a replica that is fully caught up counts
+        previous_primary_version = primary_version if self._primary_version is None else self._primary_version
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as conn:
+                    replica.version = _change_version(conn)
+            except Exception as e:
+                if replica.healthy:
+                    logger.warning("Replica %s is unreachable: %s", replica.name, e)
+                replica.healthy = False
+                replica.detail = f"unreachable: {e.__class__.__name__}"
+                continue
+            # Not even where the primary was one check ago: too far behind
+            replica.healthy = replica.version >= previous_primary_version
+            replica.detail = f"version {replica.version}, primary {primary_version}"
+
+        with self._lock:
+            if remote_changes != self._checked_remote_changes:
+                # Whatever those changes were, the primary had them when we read it
+                self._required_version = max(self._required_version, primary_version)
+                self._checked_remote_changes = remote_changes
+            self._primary_version = primary_version
+
+        healthy = sum(replica.healthy for replica in self.replicas)
+        return {
+            # The primary answers when no replica can, so this never fails readiness
+            "ok": True,
+            "detail": f"{healthy} of {len(self.replicas)} replicas healthy",
+            "replicas": {replica.name: replica.detail for replica in self.replicas},
+        }
+
+
+replica_router = ReplicaRouter(
+    url.strip() for url in settings.REPLICA_DATABASE_URLS.split(",") if url.strip()
+)
+
+
+class RequestWrites:
+    """The newest change version committed while handling one request."""
+
+    def __init__(self):
+        self.version = 0
+
+
+# Set by ReadYourWritesMiddleware for the request we're handling
+current_request_writes: ContextVar[Optional[RequestWrites]] = ContextVar("current_request_writes", default=None)
+
+
+def note_committed_version(version: int):
+    """Called by the change log after a commit, see app/core/changelog.py."""
+    replica_router.note_write(version)
+    writes = current_request_writes.get()
+    if writes is not None:
+        writes.version = max(writes.version, version)
+
+
+def _client_version(request: Request) -> int:
+    """The version the client sent back, or the one an ETag was built from (app/core/conditional.py)."""
+    value = request.headers.get(VERSION_HEADER, "")
+    sent = int(value) if value.isdigit() else 0
+    return max(sent, getattr(request.state, "authz_version", 0))
+
+
+def open_read_session(min_version: int = 0) -> Session:
+    """A session for reads outside a route: a replica if one is caught up, else the primary."""
+    replica = replica_router.pick(min_version)
+    if replica is None:
+        return SessionLocal()
+    return ReplicaSessionLocal(bind=replica.engine)
+
+
+def get_read_db(request: Request, db: Session = Depends(get_db)):
+    """
+    Dependency to get a session for reading.
+
+    You can use this in FastAPI routes like:
+    async def list_things(db: Session = Depends(get_read_db)):
+        pass
+
+    Yields:
+        Session: a replica session on GET, HEAD and OPTIONS when one is
+        caught up, otherwise the request's get_db session
+    """
+    if request.method not in SAFE_METHODS:
+        yield db
+        return
+    replica = replica_router.pick(_client_version(request))
+    if replica is None:
+        yield db
+        return
+    read_db = ReplicaSessionLocal(bind=replica.engine)
+    try:
+        yield read_db
+    finally:
+        read_db.close()
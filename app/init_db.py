@@ -1,132 +1,286 @@
 """
 Set up the database with some default data.
 This creates the initial roles, permissions, and admin user.
+
+The permissions and roles come from a seed file (app/seeds/default.yaml
+unless SEED_FILE says otherwise). Loading it takes one query per table to
+see what's already there, then one bulk upsert per table, so it's quick
+even for catalogs with thousands of permissions and safe to run again.
 """
 
-from sqlalchemy.orm import Session
-from app.db.base import SessionLocal
-from app.models.user import User
-from app.models.role import Role
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+from sqlalchemy import func, insert, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from app.db.base import engine
+from app.models.user import User, user_roles
+from app.models.role import Role, role_permissions
 from app.models.permission import Permission
+from app.models.authz_change import AuthzChange
+from app.core.cache import SCOPE_GLOBAL
 from app.core.security import get_password_hash
 from app.core.config import settings
 
+DEFAULT_SEED_FILE = Path(__file__).parent / "seeds" / "default.yaml"
 
-def init_db():
-    """Create the initial database with default roles, permissions, and admin user."""
-    db = SessionLocal()
-    
-    try:
-        # Create some basic permissions that users can have
-        permissions = [
-            {"name": "admin_access", "description": "Full administrative access"},
-            {"name": "manage_users", "description": "Manage user accounts"},
-            {"name": "manage_roles", "description": "Manage roles and role assignments"},
-            {"name": "manage_permissions", "description": "Manage permissions"},
-            {"name": "read_users", "description": "Read user information"},
-            {"name": "create_users", "description": "Create new users"},
-            {"name": "update_users", "description": "Update user information"},
-            {"name": "delete_users", "description": "Delete users"},
-            {"name": "read_roles", "description": "Read role information"},
-            {"name": "create_roles", "description": "Create new roles"},
-            {"name": "update_roles", "description": "Update role information"},
-            {"name": "delete_roles", "description": "Delete roles"},
-            {"name": "read_permissions", "description": "Read permission information"},
-            {"name": "create_permissions", "description": "Create new permissions"},
-            {"name": "update_permissions", "description": "Update permission information"},
-            {"name": "delete_permissions", "description": "Delete permissions"},
-            {"name": "moderate_content", "description": "Moderate user content"},
-            {"name": "view_reports", "description": "View system reports"},
-            {"name": "export_data", "description": "Export system data"},
-        ]
-        
-        # Add each permission to the database if it doesn't exist
-        for perm_data in permissions:
-            existing_perm = db.query(Permission).filter(Permission.name == perm_data["name"]).first()
-            if not existing_perm:
-                permission = Permission(**perm_data)
-                db.add(permission)
-                print(f"Created permission: {perm_data['name']}")
-        
-        db.commit()
-        
-        # Create some basic roles that users can have
-        roles = [
-            {
-                "name": "admin",
-                "description": "System administrator with full access",
-                "permissions": [
-                    "admin_access", "manage_users", "manage_roles", "manage_permissions",
-                    "read_users", "create_users", "update_users", "delete_users",
-                    "read_roles", "create_roles", "update_roles", "delete_roles",
-                    "read_permissions", "create_permissions", "update_permissions", "delete_permissions",
-                    "moderate_content", "view_reports", "export_data"
-                ]
-            },
-            {
-                "name": "moderator",
-                "description": "Content moderator with limited administrative access",
-                "permissions": [
-                    "read_users", "update_users", "moderate_content", "view_reports"
-                ]
-            },
-            {
-                "name": "user",
-                "description": "Regular user with basic access",
-                "permissions": []
-            }
-        ]
-        
-        # Add each role to the database if it doesn't exist
-        for role_data in roles:
-            existing_role = db.query(Role).filter(Role.name == role_data["name"]).first()
-            if not existing_role:
-                role = Role(
-                    name=role_data["name"],
-                    description=role_data["description"]
-                )
-                db.add(role)
-                db.flush()  # This gets us the role ID
-                
-                # Give this role the permissions it should have
-                for perm_name in role_data["permissions"]:
-                    permission = db.query(Permission).filter(Permission.name == perm_name).first()
-                    if permission:
-                        role.permissions.append(permission)
-                
-                print(f"Created role: {role_data['name']}")
-        
-        db.commit()
-        
-        # Create the default admin user if it doesn't exist
-        admin_user = db.query(User).filter(User.email == settings.FIRST_ADMIN_EMAIL).first()
-        if not admin_user:
-            admin_user = User(
-                email=settings.FIRST_ADMIN_EMAIL,
-                username="admin",
-                hashed_password=get_password_hash(settings.FIRST_ADMIN_PASSWORD),
-                is_active=True,
-                is_superuser=True
+
+class SeedReport:
+    """
+    What loading a seed file changed.
+
+    Each attribute is a list of names (role links are "role:permission").
+    """
+
+    def __init__(self):
+        self.permissions_created: List[str] = []
+        self.permissions_updated: List[str] = []
+        self.roles_created: List[str] = []
+        self.roles_updated: List[str] = []
+        self.role_permissions_added: List[str] = []
+        self.admin_created = False
+
+    @property
+    def changed(self) -> bool:
+        return self.admin_created or any(
+            getattr(self, name) for name in (
+                "permissions_created", "permissions_updated", "roles_created",
+                "roles_updated", "role_permissions_added"
             )
-            db.add(admin_user)
-            db.flush()
-            
-            # Give the admin user the admin role
-            admin_role = db.query(Role).filter(Role.name == "admin").first()
-            if admin_role:
-                admin_user.roles.append(admin_role)
-            
-            print(f"Created admin user: {settings.FIRST_ADMIN_EMAIL}")
-        
-        db.commit()
+        )
+
+    def summary(self) -> str:
+        """One line per kind of change."""
+        return "\n".join([
+            f"Permissions: {len(self.permissions_created)} created, {len(self.permissions_updated)} updated",
+            f"Roles: {len(self.roles_created)} created, {len(self.roles_updated)} updated",
+            f"Role permissions: {len(self.role_permissions_added)} added",
+            f"Admin user: {'created' if self.admin_created else 'already there'}",
+        ])
+
+
+def load_seed_file(path: Optional[str] = None) -> dict:
+    """
+    Read a seed file.
+
+    The layout (YAML or JSON):
+        permissions: [{name, description}]
+        roles: [{name, description, permissions: [permission names]}]
+
+    Args:
+        path: file to read, SEED_FILE or the built-in default if not given
+
+    Returns:
+        dict: with "permissions" and "roles" lists
+
+    Raises:
+        ValueError: If the file is missing names or lists a name twice
+    """
+    path = Path(path or settings.SEED_FILE or DEFAULT_SEED_FILE)
+    with open(path) as f:
+        if path.suffix == ".json":
+            data = json.load(f)
+        else:
+            import yaml
+            data = yaml.safe_load(f)
+
+    data = data or {}
+    seed = {"permissions": data.get("permissions") or [], "roles": data.get("roles") or []}
+    for kind in ("permissions", "roles"):
+        names = [item.get("name") for item in seed[kind]]
+        if not all(names):
+            raise ValueError(f"Every entry under {kind} in {path} needs a name")
+        if len(names) != len(set(names)):
+            raise ValueError(f"{path} lists the same name twice under {kind}")
+    return seed
+
+
+def _upsert(conn, table, rows: List[dict], key: List[str], update_columns: List[str]):
+    """
+    Insert rows, or update update_columns where a row with the same key exists.
+
+    Uses INSERT ... ON CONFLICT on SQLite and PostgreSQL.
+    """
+    if not rows:
+        return
+    dialect = {"sqlite": sqlite, "postgresql": postgresql}.get(conn.dialect.name)
+    if dialect is None:
+        # No upsert on this database, but we already know which rows exist
+        existing = {tuple(found) for found in conn.execute(
+            select(*[table.c[column] for column in key]).where(
+                tuple_(*[table.c[column] for column in key]).in_([tuple(row[column] for column in key) for row in rows])
+            )
+        )}
+        new_rows = [row for row in rows if tuple(row[column] for column in key) not in existing]
+        if new_rows:
+            conn.execute(insert(table), new_rows)
+        for row in rows:
+            if tuple(row[column] for column in key) in existing and update_columns:
+                conn.execute(
+                    update(table)
+                    .where(*[table.c[column] == row[column] for column in key])
+                    .values({column: row[column] for column in update_columns})
+                )
+        return
+
+    statement = dialect.insert(table)
+    if update_columns:
+        statement = statement.on_conflict_do_update(
+            index_elements=key,
+            set_={column: statement.excluded[column] for column in update_columns}
+        )
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=key)
+    conn.execute(statement, rows)
+
+
+def apply_seed(conn, seed: dict, tenant_id: Optional[int] = None) -> SeedReport:
+    """
+    Bring the permissions and roles in the database in line with a seed.
+
+    Rows are added or updated, never deleted, so anything an admin added
+    by hand stays.
+
+    Args:
+        conn: connection inside a transaction
+        seed: what load_seed_file returned
+        tenant_id: tenant the roles belong to (default tenant if not given)
+
+    Returns:
+        SeedReport: what changed
+
+    Raises:
+        ValueError: If a role lists a permission that doesn't exist
+    """
+    tenant_id = tenant_id or settings.DEFAULT_TENANT_ID
+    report = SeedReport()
+    permissions = Permission.__table__
+    roles = Role.__table__
+
+    # Permissions: one query to see what's there, one upsert for the rest
+    wanted = {item["name"]: item.get("description") for item in seed["permissions"]}
+    existing = dict(conn.execute(select(permissions.c.name, permissions.c.description)).all())
+    changes = []
+    for name, description in wanted.items():
+        if name not in existing:
+            report.permissions_created.append(name)
+        elif existing[name] != description:
+            report.permissions_updated.append(name)
+        else:
+            continue
+        changes.append({"name": name, "description": description})
+    _upsert(conn, permissions, changes, ["name"], ["description"])
+
+    # Roles, the same way
+    wanted = {item["name"]: item.get("description") for item in seed["roles"]}
+    existing = dict(conn.execute(
+        select(roles.c.name, roles.c.description).where(roles.c.tenant_id == tenant_id)
+    ).all())
+    changes = []
+    for name, description in wanted.items():
+        if name not in existing:
+            report.roles_created.append(name)
+        elif existing[name] != description:
+            report.roles_updated.append(name)
+        else:
+            continue
+        changes.append({"tenant_id": tenant_id, "name": name, "description": description})
+    _upsert(conn, roles, changes, ["tenant_id", "name"], ["description"])
+
+    # Links between them, added where missing
+    role_ids = dict(conn.execute(
+        select(roles.c.name, roles.c.id).where(roles.c.tenant_id == tenant_id, roles.c.name.in_(list(wanted)))
+    ).all())
+    permission_ids: Dict[str, int] = dict(conn.execute(select(permissions.c.name, permissions.c.id)).all())
+    links = {tuple(link) for link in conn.execute(
+        select(role_permissions.c.role_id, role_permissions.c.permission_id)
+        .where(role_permissions.c.role_id.in_(list(role_ids.values())))
+    )}
+
+    missing = sorted({
+        name for item in seed["roles"] for name in item.get("permissions") or []
+        if name not in permission_ids
+    })
+    if missing:
+        raise ValueError(f"Roles in the seed use permissions that don't exist: {', '.join(missing)}")
+
+    new_links = []
+    for item in seed["roles"]:
+        role_id = role_ids[item["name"]]
+        for name in item.get("permissions") or []:
+            if (role_id, permission_ids[name]) not in links:
+                links.add((role_id, permission_ids[name]))
+                new_links.append({"role_id": role_id, "permission_id": permission_ids[name]})
+                report.role_permissions_added.append(f"{item['name']}:{name}")
+    _upsert(conn, role_permissions, new_links, ["role_id", "permission_id"], [])
+
+    return report
+
+
+def _ensure_admin(conn, report: SeedReport):
+    """Create the first admin user, if it isn't there yet."""
+    users = User.__table__
+    exists = conn.execute(
+        select(users.c.id).where(func.lower(users.c.email) == func.lower(settings.FIRST_ADMIN_EMAIL))
+    ).first()
+    if exists:
+        return
+
+    # Only pay for the bcrypt hash when we actually need it
+    admin_id = conn.execute(
+        insert(users).values(
+            tenant_id=settings.DEFAULT_TENANT_ID,
+            email=settings.FIRST_ADMIN_EMAIL,
+            username="admin",
+            hashed_password=get_password_hash(settings.FIRST_ADMIN_PASSWORD),
+            is_active=True,
+            is_superuser=True
+        )
+    ).inserted_primary_key[0]
+
+    # Give the admin user the admin role
+    admin_role_id = conn.execute(
+        select(Role.__table__.c.id).where(
+            Role.__table__.c.tenant_id == settings.DEFAULT_TENANT_ID,
+            Role.__table__.c.name == "admin"
+        )
+    ).scalar()
+    if admin_role_id:
+        conn.execute(insert(user_roles).values(user_id=admin_id, role_id=admin_role_id))
+    report.admin_created = True
+
+
+def init_db(seed_file: Optional[str] = None) -> Optional[SeedReport]:
+    """
+    Create the default roles, permissions, and admin user.
+
+    Everything happens in one transaction, so a bad seed file changes nothing.
+
+    Args:
+        seed_file: seed file to load instead of SEED_FILE or the default
+
+    Returns:
+        SeedReport: what changed, or None if something went wrong
+    """
+    try:
+        seed = load_seed_file(seed_file)
+        with engine.begin() as conn:
+            report = apply_seed(conn, seed)
+            _ensure_admin(conn, report)
+            if report.changed:
+                # So anyone syncing from /authz/changes knows to reload
+                conn.execute(insert(AuthzChange.__table__).values(
+                    scope=SCOPE_GLOBAL, entity_type="seed", action="seeded"
+                ))
+
+        print(report.summary())
         print("Database setup completed successfully!")
-        
+        return report
+
     except Exception as e:
         print(f"Error setting up database: {e}")
-        db.rollback()
-    finally:
-        db.close()
+        return None
 
 
 if __name__ == "__main__":
-    init_db() 
\ No newline at end of file
+    init_db()
@@ -3,18 +3,45 @@ Main file that starts the web application.
 This is where everything comes together.
 """
 
+import asyncio
+import contextlib
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
+from app.core.audit import audit_log
 from app.core.config import settings
-from app.routes import auth, admin, protected
-from app.db.base import engine
-from app.models import base, user, role, permission
+from app.core.health import health_checker, warm_caches
+from app.core.invalidation import invalidation_bus
+from app.core.metrics import render_metrics
+from app.core.middleware import MetricsMiddleware, QueryStatsMiddleware, ReadYourWritesMiddleware
+from app.routes import auth, admin, protected, authz
+from app.db.migrations import check_schema_version
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Check the database is migrated, warm the caches, listen for changes
+    made by other workers, start the audit log writer and keep the
+    readiness checks running in the background.
+    
+    Tables are created by migrations (alembic upgrade head), not here.
+    """
+    await asyncio.to_thread(check_schema_version)
+    await asyncio.to_thread(warm_caches)
+    await asyncio.to_thread(invalidation_bus.start)
+    await asyncio.to_thread(audit_log.start)
+    refresher = asyncio.create_task(health_checker.run())
+    yield
+    refresher.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await refresher
+    invalidation_bus.stop()
+    # Writes out whatever is still buffered
+    await asyncio.to_thread(audit_log.stop)
 
-# Create all the database tables when we start
-# This makes sure all our tables exist
-base.Base.metadata.create_all(bind=engine)
 
 # Create our web application
 app = FastAPI(
@@ -22,7 +49,8 @@ app = FastAPI(
     description="A simple user management system with roles and permissions",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # Allow other websites to talk to our API
@@ -33,8 +61,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Authz-Version"],
 )
 
+# Count the SQL queries each request runs
+app.add_middleware(QueryStatsMiddleware)
+
+# Tell clients the change version their writes made, for replica reads
+app.add_middleware(ReadYourWritesMiddleware)
+
+# Time every request for /metrics
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 
 @app.get("/api")
 async def root():
@@ -53,6 +92,34 @@ async def health_check():
     return {"status": "healthy", "message": "RBAC System is running"}
 
 
+@app.get("/health/live")
+async def liveness():
+    """The process is up and answering. Never touches the database."""
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+def readiness():
+    """
+    Whether this instance should get traffic.
+    
+    Returns the last background check, so probing often is cheap.
+    Answers 503 when any check fails.
+    """
+    report = health_checker.report()
+    return JSONResponse(
+        status_code=200 if report.ready else 503,
+        content=report.to_dict()
+    )
+
+
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        """Request, auth and database numbers in Prometheus text format."""
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # Serve our web dashboard files
 # This makes the HTML/CSS/JS files available
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -62,6 +129,7 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 app.include_router(auth.router, prefix=settings.API_V1_STR)
 app.include_router(admin.router, prefix=settings.API_V1_STR)
 app.include_router(protected.router, prefix=settings.API_V1_STR)
+app.include_router(authz.router, prefix=settings.API_V1_STR)
 
 @app.get("/")
 async def serve_dashboard():
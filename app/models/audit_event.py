@@ -0,0 +1,42 @@
+"""
+AuditEvent model: the audit trail of permission decisions and admin changes.
+"""
+
+from sqlalchemy import Column, DateTime, Index, Integer, String
+from app.db.base import Base
+
+
+class AuditEvent(Base):
+    """
+    One permission decision or admin change.
+
+    Rows are written in batches by app/core/audit.py, some time after the
+    request, so created_at is when it happened rather than when it was saved.
+
+    Attributes:
+        kind: "permission", "role", "custom" or "resource" for decisions, "admin" for changes
+        outcome: "allow" or "deny" for decisions, the action (created, deleted, ...) for changes
+        tenant_id: the tenant it happened in
+        user_id: who was checked, or who made the change
+        name: the permission or role checked, or what kind of thing was changed
+        entity_id: the id of what was changed
+        created_at: when it happened
+    """
+    
+    __tablename__ = "audit_events"
+    __table_args__ = (
+        # "What happened in this tenant lately"
+        Index("ix_audit_events_tenant_id_created_at", "tenant_id", "created_at"),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(20), nullable=False)
+    outcome = Column(String(50), nullable=False)
+    tenant_id = Column(Integer, nullable=True)
+    user_id = Column(Integer, nullable=True)
+    name = Column(String(100), nullable=True)
+    entity_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    
+    def __repr__(self):
+        return f"<AuditEvent(id={self.id}, {self.kind} {self.name} {self.outcome})>"
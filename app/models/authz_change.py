@@ -0,0 +1,52 @@
+"""
+AuthzChange model: the append-only log of changes to roles, permissions
+and assignments.
+"""
+
+from sqlalchemy import Column, DateTime, Index, Integer, String
+from sqlalchemy.sql import func
+from app.db.base import Base
+
+
+class AuthzChange(Base):
+    """
+    One change that can affect who is allowed to do what.
+
+    Rows are written in the same transaction as the change itself and are
+    never updated or deleted, so anyone who remembers the last version
+    they saw can catch up by reading newer rows (GET /authz/changes).
+
+    Attributes:
+        version: increases with every change and is never reused
+        scope: which cached decisions go stale (global, tenant, user or group)
+        subject_id: the tenant, user or group that changed (empty for global)
+        tenant_id: the tenant the change belongs to (empty for the global permission list)
+        entity_type: what was changed (user, role, permission, grant, group)
+        entity_id: the id of what was changed
+        action: what happened to it (created, updated, deleted, roles_assigned, ...)
+        actor_id: the user who made the change
+        origin: the worker that made the change, so it can skip its own rows
+        created_at: when the change was made
+    """
+    
+    __tablename__ = "authz_changes"
+    __table_args__ = (
+        # "Newest change this tenant can see", for ETags and policy refreshes
+        Index("ix_authz_changes_tenant_id_version", "tenant_id", "version"),
+        # Without AUTOINCREMENT, SQLite can hand out a deleted row's version again
+        {"sqlite_autoincrement": True},
+    )
+    
+    version = Column(Integer, primary_key=True, autoincrement=True)
+    scope = Column(String(20), nullable=False)
+    subject_id = Column(Integer, nullable=True)
+    tenant_id = Column(Integer, nullable=True)
+    entity_type = Column(String(30), nullable=True)
+    entity_id = Column(Integer, nullable=True)
+    action = Column(String(50), nullable=True)
+    actor_id = Column(Integer, nullable=True)
+    origin = Column(String(100), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    def __repr__(self):
+        return f"<AuthzChange(version={self.version}, {self.entity_type} {self.entity_id} {self.action})>"
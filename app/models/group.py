@@ -0,0 +1,71 @@
+"""
+Group model - a set of users that get roles together.
+Groups can sit inside other groups, like departments inside a company.
+"""
+
+from sqlalchemy import Column, Integer, String, Text, Table, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.orm import relationship
+from app.models.base import BaseModel
+from app.core.config import settings
+
+# Which users are in which group
+# Stored on its own so changing a group never rewrites its members
+group_members = Table(
+    'group_members',
+    BaseModel.metadata,
+    Column('group_id', ForeignKey('groups.id', ondelete="CASCADE"), primary_key=True),
+    Column('user_id', ForeignKey('users.id', ondelete="CASCADE"), primary_key=True),
+    # "which groups is this user in" is the question we ask on every check
+    Index("ix_group_members_user_id_group_id", "user_id", "group_id")
+)
+
+# Which roles a group gives to its members
+group_roles = Table(
+    'group_roles',
+    BaseModel.metadata,
+    Column('group_id', ForeignKey('groups.id', ondelete="CASCADE"), primary_key=True),
+    Column('role_id', ForeignKey('roles.id', ondelete="CASCADE"), primary_key=True)
+)
+
+# Every (ancestor, descendant) pair of groups, including each group with itself
+# Kept up to date when groups are created or moved, so finding all the
+# parents of a group is one lookup instead of walking up the tree
+group_closure = Table(
+    'group_closure',
+    BaseModel.metadata,
+    Column('ancestor_id', ForeignKey('groups.id', ondelete="CASCADE"), primary_key=True),
+    Column('descendant_id', ForeignKey('groups.id', ondelete="CASCADE"), primary_key=True),
+    Column('depth', Integer, nullable=False),
+    Index("ix_group_closure_descendant_id_ancestor_id", "descendant_id", "ancestor_id")
+)
+
+
+class Group(BaseModel):
+    """
+    A group of users.
+
+    Members get the roles of their group and of every group above it.
+
+    Attributes:
+        tenant_id: Which customer this group belongs to
+        name: Group name, unique within a tenant
+        description: Human-readable description of the group
+        parent_id: The group this one sits inside, if any
+        roles: Roles every member gets
+    """
+
+    __tablename__ = "groups"
+    __table_args__ = (
+        UniqueConstraint("tenant_id", "name", name="uq_groups_tenant_id_name"),
+    )
+
+    tenant_id = Column(Integer, nullable=False, default=settings.DEFAULT_TENANT_ID)
+    name = Column(String(100), nullable=False)
+    description = Column(Text, nullable=True)
+    parent_id = Column(Integer, ForeignKey("groups.id"), nullable=True)
+
+    roles = relationship("Role", secondary=group_roles)
+    parent = relationship("Group", remote_side="Group.id")
+
+    def __repr__(self):
+        return f"<Group(id={self.id}, name='{self.name}')>"
@@ -0,0 +1,57 @@
+"""
+Resource grant model - a permission on one specific object.
+"""
+
+from sqlalchemy import Column, Integer, String, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.orm import relationship
+from app.models.base import BaseModel
+from app.core.config import settings
+
+# Who a grant can be given to
+PRINCIPAL_USER = "user"
+PRINCIPAL_ROLE = "role"
+
+
+class ResourceGrant(BaseModel):
+    """
+    A permission given on a single resource instead of everywhere.
+
+    For example "moderator role can update_users on user 42".
+
+    Attributes:
+        tenant_id: Which customer this grant belongs to
+        principal_type: 'user' or 'role'
+        principal_id: ID of the user or role getting the permission
+        permission_id: The permission being granted
+        resource_type: What kind of object it is for (e.g., 'user', 'role')
+        resource_id: ID of the object
+    """
+
+    __tablename__ = "resource_grants"
+    __table_args__ = (
+        # One index for both questions we ask:
+        # "can X do P on R" (all six columns) and
+        # "list R where X can P" (everything but resource_id, which it returns)
+        UniqueConstraint(
+            "tenant_id", "permission_id", "resource_type",
+            "principal_type", "principal_id", "resource_id",
+            name="uq_resource_grants_lookup"
+        ),
+        # "who has access to R" - used when showing or cleaning up an object
+        Index("ix_resource_grants_resource", "tenant_id", "resource_type", "resource_id"),
+    )
+
+    tenant_id = Column(Integer, nullable=False, default=settings.DEFAULT_TENANT_ID)
+    principal_type = Column(String(20), nullable=False)
+    principal_id = Column(Integer, nullable=False)
+    permission_id = Column(Integer, ForeignKey("permissions.id", ondelete="CASCADE"), nullable=False)
+    resource_type = Column(String(50), nullable=False)
+    resource_id = Column(Integer, nullable=False)
+
+    permission = relationship("Permission")
+
+    def __repr__(self):
+        return (
+            f"<ResourceGrant(id={self.id}, {self.principal_type}={self.principal_id}, "
+            f"permission_id={self.permission_id}, {self.resource_type}={self.resource_id})>"
+        )
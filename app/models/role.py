@@ -2,9 +2,10 @@
 Role model for RBAC system with permission relationships.
 """
 
-from sqlalchemy import Column, String, Text, Table, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, Table, ForeignKey, UniqueConstraint
 from sqlalchemy.orm import relationship
 from app.models.base import BaseModel
+from app.core.config import settings
 
 # Association table for role-permission many-to-many relationship
 role_permissions = Table(
@@ -20,14 +21,23 @@ class Role(BaseModel):
     Role model representing user roles in the system.
     
     Attributes:
-        name: Unique role name (e.g., 'admin', 'user', 'moderator')
+        tenant_id: Which customer this role belongs to
+        name: Role name, unique within a tenant (e.g., 'admin', 'user', 'moderator')
         description: Human-readable description of the role
         permissions: Many-to-many relationship with permissions
+    
+    Permissions are a shared catalog, so role_permissions and user_roles
+    rows belong to the tenant of their role.
     """
     
     __tablename__ = "roles"
+    __table_args__ = (
+        # Also serves "roles of this tenant" lookups, led by tenant_id
+        UniqueConstraint("tenant_id", "name", name="uq_roles_tenant_id_name"),
+    )
     
-    name = Column(String(100), unique=True, index=True, nullable=False)
+    tenant_id = Column(Integer, nullable=False, default=settings.DEFAULT_TENANT_ID)
+    name = Column(String(100), nullable=False)
     description = Column(Text, nullable=True)
     
     # Many-to-many relationship with permissions
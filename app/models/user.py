@@ -3,9 +3,12 @@ User model - this represents a user in our system.
 Each user has an email, username, password, and can have roles.
 """
 
-from sqlalchemy import Column, String, Boolean, Table, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Boolean, Table, ForeignKey, Index, func, select
+from sqlalchemy.orm import relationship, object_session
 from app.models.base import BaseModel
+from app.models.role import Role
+from app.models.group import group_members, group_roles, group_closure
+from app.core.config import settings
 
 # This table connects users to their roles
 # A user can have many roles, and a role can have many users
@@ -26,24 +29,97 @@ class User(BaseModel):
     - username: their username (must be unique)
     - hashed_password: their password (stored securely)
     - is_active: whether their account is active
-    - is_superuser: whether they have admin powers
+    - is_superuser: whether they have admin powers (inside their tenant)
+    - tenant_id: which customer this user belongs to
     - roles: what roles they have (admin, user, etc.)
+    - groups: what groups they are in (they also get the groups' roles)
+    
+    Email and username are unique across all tenants, because they
+    are what people log in with. Case doesn't count: "Bob@example.com"
+    and "bob@example.com" are the same person (see the indexes below).
     """
     
     __tablename__ = "users"
+    __table_args__ = (
+        # Tenant-scoped listings walk this index instead of the whole table
+        Index("ix_users_tenant_id_id", "tenant_id", "id"),
+    )
     
-    email = Column(String(255), unique=True, index=True, nullable=False)
-    username = Column(String(100), unique=True, index=True, nullable=False)
+    tenant_id = Column(Integer, nullable=False, default=settings.DEFAULT_TENANT_ID)
+    email = Column(String(255), nullable=False)
+    username = Column(String(100), nullable=False)
     hashed_password = Column(String(255), nullable=False)
     is_active = Column(Boolean, default=True)
     is_superuser = Column(Boolean, default=False)
     
     # Connect users to their roles
     roles = relationship("Role", secondary=user_roles, back_populates="users")
+    # Connect users to their groups
+    groups = relationship("Group", secondary=group_members)
     
     def __repr__(self):
         return f"<User(id={self.id}, email='{self.email}', username='{self.username}')>"
     
+    def _load_group_access(self):
+        """
+        Find the user's groups, every group above them, and the roles they give.
+        
+        Nothing is loaded until someone asks for permissions or roles, and
+        then it's one query through the precomputed group_closure table.
+        The answer is kept on this object for the rest of the request.
+        
+        Returns:
+            (set of group IDs, list of roles from those groups)
+        """
+        cached = self.__dict__.get("_group_access")
+        if cached is not None:
+            return cached
+        
+        session = object_session(self)
+        if session is None or self.id is None:
+            # Not saved yet, so walk the groups we have in memory
+            group_ids = set()
+            roles = []
+            for group in self.groups:
+                while group is not None:
+                    group_ids.add(group.id)
+                    roles.extend(group.roles)
+                    group = group.parent
+        else:
+            rows = session.execute(
+                select(group_closure.c.ancestor_id, group_roles.c.role_id)
+                .select_from(group_members)
+                .join(group_closure, group_closure.c.descendant_id == group_members.c.group_id)
+                .outerjoin(group_roles, group_roles.c.group_id == group_closure.c.ancestor_id)
+                .where(group_members.c.user_id == self.id)
+            ).all()
+            group_ids = {group_id for group_id, _ in rows}
+            role_ids = {role_id for _, role_id in rows if role_id is not None}
+            roles = session.query(Role).filter(Role.id.in_(role_ids)).all() if role_ids else []
+        
+        self._group_access = (frozenset(group_ids), roles)
+        return self._group_access
+    
+    @property
+    def group_ids(self):
+        """IDs of the user's groups and every group above them."""
+        return self._load_group_access()[0]
+    
+    @property
+    def all_roles(self):
+        """
+        Get every role this user has, given directly or through a group.
+        
+        Only roles from the user's own tenant count.
+        """
+        roles = []
+        seen = set()
+        for role in list(self.roles) + self._load_group_access()[1]:
+            if role.tenant_id == self.tenant_id and id(role) not in seen:
+                seen.add(id(role))
+                roles.append(role)
+        return roles
+    
     @property
     def permissions(self):
         """
@@ -51,9 +127,11 @@ class User(BaseModel):
         
         For example, if a user has the "admin" role, and that role
         has "manage_users" permission, then this user can manage users.
+        
+        Roles given through groups count too.
         """
         permissions = set()
-        for role in self.roles:
+        for role in self.all_roles:
             for permission in role.permissions:
                 permissions.add(permission.name)
         return permissions
@@ -80,4 +158,9 @@ class User(BaseModel):
         Returns:
             True if the user has this role, False otherwise
         """
-        return any(role.name == role_name for role in self.roles) 
\ No newline at end of file
+        return any(role.name == role_name for role in self.all_roles) 
+
+
+# Case-insensitive uniqueness. Lookups must compare lower(column) to use these
+Index("ix_users_email_lower", func.lower(User.email), unique=True)
+Index("ix_users_username_lower", func.lower(User.username), unique=True)
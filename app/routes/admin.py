@@ -2,152 +2,446 @@
 Admin routes for managing users, roles, and permissions.
 """
 
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from contextlib import contextmanager
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy import and_, delete, func, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from app.db.base import get_db
-from app.models.user import User
-from app.models.role import Role
+from app.db.replicas import get_read_db
+from app.models.user import User, user_roles as user_roles_table
+from app.models.role import Role, role_permissions as role_permissions_table
 from app.models.permission import Permission
+from app.models.group import Group, group_members, group_roles as group_roles_table
+from app.models.resource_grant import ResourceGrant, PRINCIPAL_USER, PRINCIPAL_ROLE
 from app.schemas.user import UserResponse, UserUpdate, UserWithRoles
 from app.schemas.role import RoleCreate, RoleUpdate, RoleResponse, RoleWithPermissions
 from app.schemas.permission import PermissionCreate, PermissionUpdate, PermissionResponse
-from app.core.auth import get_current_superuser
-from app.core.rbac import require_admin
+from app.schemas.grant import ResourceGrantCreate, ResourceGrantResponse
+from app.schemas.group import GroupCreate, GroupUpdate, GroupResponse, GroupWithRoles, GroupMembers
+from app.core.rbac import require_admin, authorized_filter
+from app.core.tenancy import get_platform_admin, get_tenant_admin, get_tenant_reader
+from app.core.middleware import query_budget
+from app.core.conditional import authz_etag, cache_headers
+from app.core.fieldsets import Fieldset, fieldset_dependency, parse_fieldset
+from app.core.serialization import JSONStreamingResponse, dumps, encoded_list, stream_array, with_field
+from app.core.cache import SCOPE_GLOBAL, SCOPE_TENANT, SCOPE_USER, SCOPE_GROUP
+from app.core.changelog import record_change
+from app.core.groups import add_group_to_closure, move_group, remove_group
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
 
+# Columns each admin listing can return with fields=, in response order
+USER_COLUMNS = {
+    "email": User.email,
+    "username": User.username,
+    "id": User.id,
+    "is_active": User.is_active,
+    "is_superuser": User.is_superuser,
+}
+ROLE_COLUMNS = {"name": Role.name, "description": Role.description, "id": Role.id}
+PERMISSION_COLUMNS = {"name": Permission.name, "description": Permission.description, "id": Permission.id}
+GROUP_COLUMNS = {
+    "name": Group.name,
+    "description": Group.description,
+    "parent_id": Group.parent_id,
+    "id": Group.id,
+}
+ROLE_INCLUDES = ("roles", "roles.permissions")
+GRANT_COLUMNS = {
+    "principal_type": ResourceGrant.principal_type,
+    "principal_id": ResourceGrant.principal_id,
+    "permission_id": ResourceGrant.permission_id,
+    "resource_type": ResourceGrant.resource_type,
+    "resource_id": ResourceGrant.resource_id,
+    "id": ResourceGrant.id,
+    "tenant_id": ResourceGrant.tenant_id,
+}
+
+
+def _select_page(db: Session, columns: dict, fieldset: Fieldset, condition, skip: int, limit: int) -> List[dict]:
+    """Read one page of objects as dicts holding only the requested columns."""
+    names = fieldset.fields
+    id_column = columns["id"]
+    rows = db.execute(
+        select(*(columns[name] for name in names))
+        .where(condition)
+        .order_by(id_column)
+        .offset(skip)
+        .limit(limit)
+    ).all()
+    return [dict(zip(names, row)) for row in rows]
+
+
+def _page_ids(id_column, condition, skip: int, limit: int):
+    """The IDs on one page, as a subquery for loading related rows."""
+    page = select(id_column.label("id")).where(condition).order_by(id_column).offset(skip).limit(limit).subquery()
+    return select(page.c.id)
+
+
+def _load_permissions(db: Session, role_ids):
+    """
+    Read the permissions of some roles as plain tuples.
+    
+    Returns:
+        (permissions by id, permission ids by role id)
+    """
+    permissions = {}
+    role_permission_ids = {}
+    for role_id, permission_id, name, description in db.execute(
+        select(role_permissions_table.c.role_id, Permission.id, Permission.name, Permission.description)
+        .join(Permission, Permission.id == role_permissions_table.c.permission_id)
+        .where(role_permissions_table.c.role_id.in_(role_ids))
+        .order_by(role_permissions_table.c.role_id, Permission.id)
+    ):
+        permissions[permission_id] = {"name": name, "description": description, "id": permission_id}
+        role_permission_ids.setdefault(role_id, []).append(permission_id)
+    return permissions, role_permission_ids
+
+
+def _load_roles(db: Session, owner_column, role_column, owner_ids, with_permissions: bool):
+    """
+    Read the roles of some users or groups, through their link table.
+    
+    Returns:
+        (roles by id, role ids by owner id, permissions by id, permission ids by role id)
+    """
+    roles = {}
+    owner_role_ids = {}
+    for owner_id, role_id, name, description in db.execute(
+        select(owner_column, Role.id, Role.name, Role.description)
+        .join(Role, Role.id == role_column)
+        .where(owner_column.in_(owner_ids))
+        .order_by(owner_column, Role.id)
+    ):
+        roles[role_id] = {"name": name, "description": description, "id": role_id}
+        owner_role_ids.setdefault(owner_id, []).append(role_id)
+    
+    permissions, role_permission_ids = {}, {}
+    if with_permissions and roles:
+        permissions, role_permission_ids = _load_permissions(db, list(roles))
+    return roles, owner_role_ids, permissions, role_permission_ids
+
+
+def _encode_related(objects: dict, relation: Optional[str], related_ids: dict, encoded_related: dict) -> dict:
+    """Encode each object once, with its related objects embedded if `relation` is set."""
+    encoded = {}
+    for object_id, data in objects.items():
+        body = dumps(data)
+        if relation:
+            body = with_field(body, relation, encoded_list(encoded_related[i] for i in related_ids.get(object_id, ())))
+        encoded[object_id] = body
+    return encoded
+
+
+def _encode_with_roles(objects: List[dict], fieldset: Fieldset, roles, owner_role_ids, permissions, role_permission_ids):
+    """
+    Encode objects with their roles embedded (if included).
+    
+    Every role and permission is encoded once, however many objects share it.
+    """
+    if "roles" not in fieldset.include:
+        return (dumps(data) for data in objects)
+    with_permissions = "roles.permissions" in fieldset.include
+    encoded_roles = _encode_related(
+        roles,
+        "permissions" if with_permissions else None,
+        role_permission_ids,
+        {permission_id: dumps(data) for permission_id, data in permissions.items()}
+    )
+    return (
+        with_field(dumps(data), "roles", encoded_list(encoded_roles[r] for r in owner_role_ids.get(data["id"], ())))
+        for data in objects
+    )
+
+
 # User Management
-@router.get("/users", response_model=List[UserResponse])
+def _load_users(db: Session, condition, fieldset: Fieldset, skip: int, limit: int):
+    """
+    Read one page of users, and their roles and permissions if included.
+    
+    Everything is read as plain tuples, at most three queries: the users,
+    their roles, those roles' permissions.
+    
+    Returns:
+        (users, roles by id, role ids by user id, permissions by id, permission ids by role id)
+    """
+    users = _select_page(db, USER_COLUMNS, fieldset, condition, skip, limit)
+    related = ({}, {}, {}, {})
+    if users and "roles" in fieldset.include:
+        related = _load_roles(
+            db,
+            user_roles_table.c.user_id,
+            user_roles_table.c.role_id,
+            _page_ids(User.id, condition, skip, limit),
+            "roles.permissions" in fieldset.include
+        )
+    return (users,) + related
+
+
+# Writes: one statement per change, answered from what it returns
+@contextmanager
+def _unique_or_400(db: Session, detail: str):
+    """
+    Let the database's unique constraints catch duplicates.
+
+    A violation inside the block rolls back and answers 400 with `detail`,
+    so routes don't have to SELECT first to see if a name is taken.
+    """
+    try:
+        yield
+    except IntegrityError as e:
+        db.rollback()
+        # SQLite says "UNIQUE constraint failed", PostgreSQL "violates unique constraint"
+        if "unique" not in str(e.orig).lower():
+            raise
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+
+def _insert_returning(db: Session, model, columns: dict, values: dict) -> dict:
+    """INSERT a row and return the response columns the database sent back."""
+    row = db.execute(insert(model).values(**values).returning(*columns.values())).one()
+    return dict(zip(columns, row))
+
+
+def _update_returning(db: Session, model, columns: dict, condition, values: dict) -> Optional[dict]:
+    """UPDATE the row matching `condition`, returning its response columns, or None if there is none."""
+    row = db.execute(
+        update(model)
+        .where(condition)
+        .values(updated_at=func.now(), **values)
+        .returning(*columns.values())
+        .execution_options(synchronize_session=False)
+    ).first()
+    return dict(zip(columns, row)) if row else None
+
+
+def _delete_returning(db: Session, model, condition, *columns):
+    """DELETE the row matching `condition`, returning the given columns, or None if there is none."""
+    return db.execute(
+        delete(model).where(condition).returning(*columns).execution_options(synchronize_session=False)
+    ).first()
+
+
+def _with_roles_response(db: Session, data: dict, columns: dict, owner_column, role_column) -> Response:
+    """Answer with a user or group and its roles and their permissions, the full response."""
+    fieldset = parse_fieldset(None, None, columns, ROLE_INCLUDES)
+    related = _load_roles(db, owner_column, role_column, [data["id"]], True)
+    return Response(content=next(_encode_with_roles([data], fieldset, *related)), media_type="application/json")
+
+
+def _role_response(db: Session, role: dict) -> Response:
+    """Answer with a role and its permissions."""
+    permissions, role_permission_ids = _load_permissions(db, [role["id"]])
+    role["permissions"] = [permissions[i] for i in role_permission_ids.get(role["id"], ())]
+    return Response(content=dumps(role), media_type="application/json")
+
+
+@router.get("/users", response_model=List[UserResponse], dependencies=[Depends(query_budget(5))])
 async def get_users(
     skip: int = 0,
     limit: int = 100,
-    current_user: User = Depends(get_current_superuser),
-    db: Session = Depends(get_db)
+    shape: Literal["nested", "normalized"] = "nested",
+    fieldset: Fieldset = Depends(fieldset_dependency(USER_COLUMNS, ROLE_INCLUDES)),
+    current_user: User = Depends(get_tenant_reader),
+    db: Session = Depends(get_read_db)
 ):
-    """Get all users (admin only)."""
-    users = db.query(User).offset(skip).limit(limit).all()
-    return users
+    """
+    Get the users the caller is allowed to read, in their tenant.
+    
+    - fields= / include= pick the columns and related objects to return
+      (see app/core/fieldsets.py); e.g. fields=email,is_active is one
+      narrow query with no role loading at all
+    - shape=nested (default): a list of users, each with their roles and
+      the roles' permissions, streamed as it's encoded
+    - shape=normalized: {"users", "roles", "permissions"}, where users list
+      role_ids and roles list permission_ids, so nothing is repeated
+    
+    Rows are read as plain tuples and each role and permission is encoded
+    only once, however many users share it (see app/core/serialization.py).
+    """
+    users, roles, user_role_ids, permissions, role_permission_ids = _load_users(
+        db, authorized_filter(current_user, User), fieldset, skip, limit
+    )
+    
+    if shape == "normalized":
+        body = {"users": users}
+        if "roles" in fieldset.include:
+            body["users"] = [dict(user, role_ids=user_role_ids.get(user["id"], [])) for user in users]
+            body["roles"] = list(roles.values())
+        if "roles.permissions" in fieldset.include:
+            body["roles"] = [
+                dict(role, permission_ids=role_permission_ids.get(role_id, []))
+                for role_id, role in roles.items()
+            ]
+            body["permissions"] = list(permissions.values())
+        return Response(content=dumps(body), media_type="application/json")
+    
+    # The rows are already read, so the session can close while this streams
+    return JSONStreamingResponse(stream_array(
+        _encode_with_roles(users, fieldset, roles, user_role_ids, permissions, role_permission_ids)
+    ))
 
 
 @router.get("/users/{user_id}", response_model=UserResponse)
 async def get_user(
     user_id: int,
-    current_user: User = Depends(get_current_superuser),
-    db: Session = Depends(get_db)
+    fieldset: Fieldset = Depends(fieldset_dependency(USER_COLUMNS, ROLE_INCLUDES)),
+    current_user: User = Depends(get_tenant_reader),
+    db: Session = Depends(get_read_db)
 ):
-    """Get a specific user by ID (admin only)."""
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
+    """Get a specific user by ID, if the caller is allowed to read it. Takes fields= and include=."""
+    users, *related = _load_users(
+        db, and_(authorized_filter(current_user, User), User.id == user_id), fieldset, 0, 1
+    )
+    if not users:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    return Response(content=next(_encode_with_roles(users, fieldset, *related)), media_type="application/json")
 
 
 @router.put("/users/{user_id}", response_model=UserResponse)
 async def update_user(
     user_id: int,
     user_update: UserUpdate,
-    current_user: User = Depends(get_current_superuser),
+    current_user: User = Depends(get_tenant_admin),
     db: Session = Depends(get_db)
 ):
     """Update a user (admin only)."""
-    user = db.query(User).filter(User.id == user_id).first()
+    with _unique_or_400(db, "Email or username already registered"):
+        user = _update_returning(
+            db, User, USER_COLUMNS,
+            and_(User.tenant_id == current_user.tenant_id, User.id == user_id),
+            user_update.dict(exclude_unset=True)
+        )
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    update_data = user_update.dict(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(user, field, value)
-    
+    record_change(db, SCOPE_USER, [user_id], "user", user_id, "updated", current_user.tenant_id, current_user.id)
+    response = _with_roles_response(db, user, USER_COLUMNS, user_roles_table.c.user_id, user_roles_table.c.role_id)
     db.commit()
-    db.refresh(user)
-    return user
+    return response
 
 
 @router.post("/users/{user_id}/roles")
 async def assign_roles_to_user(
     user_id: int,
     user_roles: UserWithRoles,
-    current_user: User = Depends(get_current_superuser),
+    current_user: User = Depends(get_tenant_admin),
     db: Session = Depends(get_db)
 ):
     """Assign roles to a user (admin only)."""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = db.query(User).filter(
+        User.tenant_id == current_user.tenant_id,
+        User.id == user_id
+    ).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    roles = db.query(Role).filter(Role.id.in_(user_roles.role_ids)).all()
+    # Only roles from the same tenant can be assigned
+    roles = db.query(Role).filter(
+        Role.tenant_id == current_user.tenant_id,
+        Role.id.in_(user_roles.role_ids)
+    ).all()
     user.roles = roles
+    record_change(db, SCOPE_USER, [user.id], "user", user.id, "roles_assigned", current_user.tenant_id, current_user.id)
     db.commit()
     
     return {"message": "Roles assigned successfully"}
 
 
 # Role Management
-@router.get("/roles", response_model=List[RoleResponse])
+@router.get("/roles", response_model=List[RoleResponse], dependencies=[Depends(query_budget(4))])
 async def get_roles(
     skip: int = 0,
     limit: int = 100,
-    current_user: User = Depends(get_current_superuser),
-    db: Session = Depends(get_db)
+    fieldset: Fieldset = Depends(fieldset_dependency(ROLE_COLUMNS, ("permissions",))),
+    etag: Optional[str] = Depends(authz_etag),
+    current_user: User = Depends(get_tenant_reader),
+    db: Session = Depends(get_read_db)
 ):
-    """Get all roles (admin only)."""
-    roles = db.query(Role).offset(skip).limit(limit).all()
-    return roles
+    """
+    Get the roles the caller is allowed to read, in their tenant. Takes fields= and include=.
+    
+    Send back the ETag in If-None-Match to get a 304 while nothing changed.
+    """
+    condition = authorized_filter(current_user, Role)
+    roles = _select_page(db, ROLE_COLUMNS, fieldset, condition, skip, limit)
+    if not roles or "permissions" not in fieldset.include:
+        return Response(content=dumps(roles), media_type="application/json", headers=cache_headers(etag))
+    
+    permissions, role_permission_ids = _load_permissions(db, _page_ids(Role.id, condition, skip, limit))
+    encoded_permissions = {permission_id: dumps(data) for permission_id, data in permissions.items()}
+    return JSONStreamingResponse(stream_array(
+        with_field(dumps(role), "permissions", encoded_list(
+            encoded_permissions[p] for p in role_permission_ids.get(role["id"], ())
+        ))
+        for role in roles
+    ), headers=cache_headers(etag))
 
 
 @router.post("/roles", response_model=RoleResponse)
 async def create_role(
     role_data: RoleCreate,
-    current_user: User = Depends(get_current_superuser),
+    current_user: User = Depends(get_tenant_admin),
     db: Session = Depends(get_db)
 ):
     """Create a new role (admin only)."""
-    existing_role = db.query(Role).filter(Role.name == role_data.name).first()
-    if existing_role:
-        raise HTTPException(status_code=400, detail="Role name already exists")
-    
-    db_role = Role(**role_data.dict())
-    db.add(db_role)
+    with _unique_or_400(db, "Role name already exists"):
+        role = _insert_returning(db, Role, ROLE_COLUMNS, dict(tenant_id=current_user.tenant_id, **role_data.dict()))
+    record_change(db, SCOPE_TENANT, [current_user.tenant_id], "role", role["id"], "created", current_user.tenant_id, current_user.id)
     db.commit()
-    db.refresh(db_role)
-    return db_role
+    role["permissions"] = []
+    return Response(content=dumps(role), media_type="application/json")
 
 
 @router.put("/roles/{role_id}", response_model=RoleResponse)
 async def update_role(
     role_id: int,
     role_update: RoleUpdate,
-    current_user: User = Depends(get_current_superuser),
+    current_user: User = Depends(get_tenant_admin),
     db: Session = Depends(get_db)
 ):
     """Update a role (admin only)."""
-    role = db.query(Role).filter(Role.id == role_id).first()
+    with _unique_or_400(db, "Role name already exists"):
+        role = _update_returning(
+            db, Role, ROLE_COLUMNS,
+            and_(Role.tenant_id == current_user.tenant_id, Role.id == role_id),
+            role_update.dict(exclude_unset=True)
+        )
     if not role:
         raise HTTPException(status_code=404, detail="Role not found")
     
-    update_data = role_update.dict(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(role, field, value)
-    
+    record_change(db, SCOPE_TENANT, [current_user.tenant_id], "role", role_id, "updated", current_user.tenant_id, current_user.id)
+    response = _role_response(db, role)
     db.commit()
-    db.refresh(role)
-    return role
+    return response
 
 
 @router.delete("/roles/{role_id}")
 async def delete_role(
     role_id: int,
-    current_user: User = Depends(get_current_superuser),
+    current_user: User = Depends(get_tenant_admin),
     db: Session = Depends(get_db)
 ):
     """Delete a role (admin only)."""
-    role = db.query(Role).filter(Role.id == role_id).first()
-    if not role:
+    # The rows pointing at the role go first; they only match a role of this tenant
+    tenant_role = select(Role.id).where(Role.tenant_id == current_user.tenant_id, Role.id == role_id)
+    # Groups stop giving this role, users stop having it
+    db.execute(group_roles_table.delete().where(group_roles_table.c.role_id.in_(tenant_role)))
+    db.execute(user_roles_table.delete().where(user_roles_table.c.role_id.in_(tenant_role)))
+    db.execute(role_permissions_table.delete().where(role_permissions_table.c.role_id.in_(tenant_role)))
+    # Grants given to this role go with it
+    db.execute(delete(ResourceGrant).where(
+        ResourceGrant.principal_type == PRINCIPAL_ROLE,
+        ResourceGrant.principal_id.in_(tenant_role)
+    ).execution_options(synchronize_session=False))
+    if _delete_returning(db, Role, and_(Role.tenant_id == current_user.tenant_id, Role.id == role_id), Role.id) is None:
+        db.rollback()
         raise HTTPException(status_code=404, detail="Role not found")
     
-    db.delete(role)
+    record_change(db, SCOPE_TENANT, [current_user.tenant_id], "role", role_id, "deleted", current_user.tenant_id, current_user.id)
     db.commit()
     return {"message": "Role deleted successfully"}
 
@@ -156,84 +450,363 @@ async def delete_role(
 async def assign_permissions_to_role(
     role_id: int,
     role_permissions: RoleWithPermissions,
-    current_user: User = Depends(get_current_superuser),
+    current_user: User = Depends(get_tenant_admin),
     db: Session = Depends(get_db)
 ):
     """Assign permissions to a role (admin only)."""
-    role = db.query(Role).filter(Role.id == role_id).first()
+    role = db.query(Role).filter(
+        Role.tenant_id == current_user.tenant_id,
+        Role.id == role_id
+    ).first()
     if not role:
         raise HTTPException(status_code=404, detail="Role not found")
     
     permissions = db.query(Permission).filter(Permission.id.in_(role_permissions.permission_ids)).all()
     role.permissions = permissions
+    record_change(db, SCOPE_TENANT, [current_user.tenant_id], "role", role.id, "permissions_assigned", current_user.tenant_id, current_user.id)
     db.commit()
     
     return {"message": "Permissions assigned successfully"}
 
 
 # Permission Management
-@router.get("/permissions", response_model=List[PermissionResponse])
+@router.get("/permissions", response_model=List[PermissionResponse], dependencies=[Depends(query_budget(3))])
 async def get_permissions(
     skip: int = 0,
     limit: int = 100,
-    current_user: User = Depends(get_current_superuser),
-    db: Session = Depends(get_db)
+    fieldset: Fieldset = Depends(fieldset_dependency(PERMISSION_COLUMNS)),
+    etag: Optional[str] = Depends(authz_etag),
+    current_user: User = Depends(get_tenant_reader),
+    db: Session = Depends(get_read_db)
 ):
-    """Get all permissions (admin only)."""
-    permissions = db.query(Permission).offset(skip).limit(limit).all()
-    return permissions
+    """
+    Get the permissions the caller is allowed to read. Takes fields=.
+    
+    Send back the ETag in If-None-Match to get a 304 while nothing changed.
+    """
+    permissions = _select_page(
+        db, PERMISSION_COLUMNS, fieldset, authorized_filter(current_user, Permission), skip, limit
+    )
+    return Response(content=dumps(permissions), media_type="application/json", headers=cache_headers(etag))
 
 
 @router.post("/permissions", response_model=PermissionResponse)
 async def create_permission(
     permission_data: PermissionCreate,
-    current_user: User = Depends(get_current_superuser),
+    current_user: User = Depends(get_platform_admin),
     db: Session = Depends(get_db)
 ):
-    """Create a new permission (admin only)."""
-    existing_permission = db.query(Permission).filter(Permission.name == permission_data.name).first()
-    if existing_permission:
-        raise HTTPException(status_code=400, detail="Permission name already exists")
-    
-    db_permission = Permission(**permission_data.dict())
-    db.add(db_permission)
+    """Create a new permission (platform admins only)."""
+    with _unique_or_400(db, "Permission name already exists"):
+        permission = _insert_returning(db, Permission, PERMISSION_COLUMNS, permission_data.dict())
+    record_change(db, SCOPE_GLOBAL, [], "permission", permission["id"], "created", actor_id=current_user.id)
     db.commit()
-    db.refresh(db_permission)
-    return db_permission
+    return Response(content=dumps(permission), media_type="application/json")
 
 
 @router.put("/permissions/{permission_id}", response_model=PermissionResponse)
 async def update_permission(
     permission_id: int,
     permission_update: PermissionUpdate,
-    current_user: User = Depends(get_current_superuser),
+    current_user: User = Depends(get_platform_admin),
     db: Session = Depends(get_db)
 ):
-    """Update a permission (admin only)."""
-    permission = db.query(Permission).filter(Permission.id == permission_id).first()
+    """Update a permission (platform admins only)."""
+    with _unique_or_400(db, "Permission name already exists"):
+        permission = _update_returning(
+            db, Permission, PERMISSION_COLUMNS, Permission.id == permission_id, permission_update.dict(exclude_unset=True)
+        )
     if not permission:
         raise HTTPException(status_code=404, detail="Permission not found")
     
-    update_data = permission_update.dict(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(permission, field, value)
-    
+    record_change(db, SCOPE_GLOBAL, [], "permission", permission_id, "updated", actor_id=current_user.id)
     db.commit()
-    db.refresh(permission)
-    return permission
+    return Response(content=dumps(permission), media_type="application/json")
 
 
 @router.delete("/permissions/{permission_id}")
 async def delete_permission(
     permission_id: int,
-    current_user: User = Depends(get_current_superuser),
+    current_user: User = Depends(get_platform_admin),
     db: Session = Depends(get_db)
 ):
-    """Delete a permission (admin only)."""
-    permission = db.query(Permission).filter(Permission.id == permission_id).first()
-    if not permission:
+    """Delete a permission from every tenant (platform admins only)."""
+    # Roles stop having it, and grants of it go with it
+    db.execute(role_permissions_table.delete().where(role_permissions_table.c.permission_id == permission_id))
+    db.execute(delete(ResourceGrant).where(
+        ResourceGrant.permission_id == permission_id
+    ).execution_options(synchronize_session=False))
+    if _delete_returning(db, Permission, Permission.id == permission_id, Permission.id) is None:
+        db.rollback()
         raise HTTPException(status_code=404, detail="Permission not found")
     
-    db.delete(permission)
+    record_change(db, SCOPE_GLOBAL, [], "permission", permission_id, "deleted", actor_id=current_user.id)
     db.commit()
-    return {"message": "Permission deleted successfully"} 
\ No newline at end of file
+    return {"message": "Permission deleted successfully"} 
+
+
+# Resource Grant Management
+@router.get("/grants", response_model=List[ResourceGrantResponse])
+async def get_grants(
+    resource_type: Optional[str] = None,
+    resource_id: Optional[int] = None,
+    skip: int = 0,
+    limit: int = 100,
+    current_user: User = Depends(get_tenant_admin),
+    db: Session = Depends(get_read_db)
+):
+    """Get resource grants in the admin's tenant, optionally for one resource (admin only)."""
+    query = db.query(ResourceGrant).filter(ResourceGrant.tenant_id == current_user.tenant_id)
+    if resource_type is not None:
+        query = query.filter(ResourceGrant.resource_type == resource_type)
+        if resource_id is not None:
+            query = query.filter(ResourceGrant.resource_id == resource_id)
+    return query.order_by(ResourceGrant.id).offset(skip).limit(limit).all()
+
+
+@router.post("/grants", response_model=ResourceGrantResponse)
+async def create_grant(
+    grant_data: ResourceGrantCreate,
+    current_user: User = Depends(get_tenant_admin),
+    db: Session = Depends(get_db)
+):
+    """Give a user or role a permission on one resource (admin only)."""
+    # The user or role must be in the admin's tenant, and the permission must
+    # exist: checked by the INSERT itself, so a good grant is one statement
+    principal_model = User if grant_data.principal_type == PRINCIPAL_USER else Role
+    principal_exists = select(principal_model.id).where(
+        principal_model.tenant_id == current_user.tenant_id,
+        principal_model.id == grant_data.principal_id
+    ).exists()
+    permission_exists = select(Permission.id).where(Permission.id == grant_data.permission_id).exists()
+    values = dict(tenant_id=current_user.tenant_id, **grant_data.dict())
+    
+    with _unique_or_400(db, "Grant already exists"):
+        row = db.execute(
+            insert(ResourceGrant)
+            .from_select(
+                list(values),
+                select(*(literal(value) for value in values.values())).where(principal_exists, permission_exists)
+            )
+            .returning(*GRANT_COLUMNS.values())
+        ).first()
+    if row is None:
+        # Nothing was inserted; find out which one is missing
+        if not db.execute(select(principal_exists)).scalar():
+            raise HTTPException(status_code=404, detail=f"{grant_data.principal_type.capitalize()} not found")
+        raise HTTPException(status_code=404, detail="Permission not found")
+    
+    _record_grant_change(db, row, "created", current_user)
+    db.commit()
+    return Response(content=dumps(dict(zip(GRANT_COLUMNS, row))), media_type="application/json")
+
+
+@router.delete("/grants/{grant_id}")
+async def delete_grant(
+    grant_id: int,
+    current_user: User = Depends(get_tenant_admin),
+    db: Session = Depends(get_db)
+):
+    """Remove a resource grant (admin only)."""
+    grant = _delete_returning(
+        db, ResourceGrant,
+        and_(ResourceGrant.tenant_id == current_user.tenant_id, ResourceGrant.id == grant_id),
+        *GRANT_COLUMNS.values()
+    )
+    if grant is None:
+        raise HTTPException(status_code=404, detail="Grant not found")
+    
+    _record_grant_change(db, grant, "deleted", current_user)
+    db.commit()
+    return {"message": "Grant deleted successfully"}
+
+
+
+# Group Management
+def _get_tenant_group(db: Session, tenant_id: int, group_id: int) -> Group:
+    """Get a group from the admin's tenant or raise 404."""
+    group = db.query(Group).filter(Group.tenant_id == tenant_id, Group.id == group_id).first()
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return group
+
+
+@router.get("/groups", response_model=List[GroupResponse], dependencies=[Depends(query_budget(5))])
+async def get_groups(
+    skip: int = 0,
+    limit: int = 100,
+    fieldset: Fieldset = Depends(fieldset_dependency(GROUP_COLUMNS, ROLE_INCLUDES)),
+    current_user: User = Depends(get_tenant_admin),
+    db: Session = Depends(get_read_db)
+):
+    """Get all groups in the admin's tenant (admin only). Takes fields= and include=."""
+    condition = Group.tenant_id == current_user.tenant_id
+    groups = _select_page(db, GROUP_COLUMNS, fieldset, condition, skip, limit)
+    related = ({}, {}, {}, {})
+    if groups and "roles" in fieldset.include:
+        related = _load_roles(
+            db,
+            group_roles_table.c.group_id,
+            group_roles_table.c.role_id,
+            _page_ids(Group.id, condition, skip, limit),
+            "roles.permissions" in fieldset.include
+        )
+    return JSONStreamingResponse(stream_array(_encode_with_roles(groups, fieldset, *related)))
+
+
+@router.post("/groups", response_model=GroupResponse)
+async def create_group(
+    group_data: GroupCreate,
+    current_user: User = Depends(get_tenant_admin),
+    db: Session = Depends(get_db)
+):
+    """Create a new group, optionally inside another group (admin only)."""
+    if group_data.parent_id is not None:
+        _get_tenant_group(db, current_user.tenant_id, group_data.parent_id)
+    
+    with _unique_or_400(db, "Group name already exists"):
+        row = db.execute(
+            insert(Group)
+            .values(tenant_id=current_user.tenant_id, **group_data.dict())
+            .returning(*GROUP_COLUMNS.values())
+        ).one()
+    add_group_to_closure(db, row)
+    record_change(db, SCOPE_GROUP, [row.id], "group", row.id, "created", current_user.tenant_id, current_user.id)
+    db.commit()
+    group = dict(zip(GROUP_COLUMNS, row))
+    group["roles"] = []
+    return Response(content=dumps(group), media_type="application/json")
+
+
+@router.put("/groups/{group_id}", response_model=GroupResponse)
+async def update_group(
+    group_id: int,
+    group_update: GroupUpdate,
+    current_user: User = Depends(get_tenant_admin),
+    db: Session = Depends(get_db)
+):
+    """Update a group, or move it under another parent (admin only)."""
+    update_data = group_update.dict(exclude_unset=True)
+    moving = "parent_id" in update_data
+    new_parent_id = update_data.pop("parent_id", None)
+    with _unique_or_400(db, "Group name already exists"):
+        group = _update_returning(
+            db, Group, GROUP_COLUMNS,
+            and_(Group.tenant_id == current_user.tenant_id, Group.id == group_id),
+            update_data
+        )
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    
+    moved_group_ids = []
+    if moving and new_parent_id != group["parent_id"]:
+        if new_parent_id is not None:
+            _get_tenant_group(db, current_user.tenant_id, new_parent_id)
+        try:
+            moved_group_ids = move_group(db, _get_tenant_group(db, current_user.tenant_id, group_id), new_parent_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        group["parent_id"] = new_parent_id
+    
+    # Only a move changes anyone's access; a rename just needs logging
+    action = "moved" if moved_group_ids else "updated"
+    record_change(db, SCOPE_GROUP, moved_group_ids or [group_id], "group", group_id, action, current_user.tenant_id, current_user.id)
+    response = _with_roles_response(db, group, GROUP_COLUMNS, group_roles_table.c.group_id, group_roles_table.c.role_id)
+    db.commit()
+    return response
+
+
+@router.delete("/groups/{group_id}")
+async def delete_group(
+    group_id: int,
+    current_user: User = Depends(get_tenant_admin),
+    db: Session = Depends(get_db)
+):
+    """Delete a group that has no child groups (admin only)."""
+    group = _get_tenant_group(db, current_user.tenant_id, group_id)
+    
+    try:
+        remove_group(db, group)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    record_change(db, SCOPE_GROUP, [group_id], "group", group_id, "deleted", current_user.tenant_id, current_user.id)
+    db.commit()
+    return {"message": "Group deleted successfully"}
+
+
+@router.post("/groups/{group_id}/roles")
+async def assign_roles_to_group(
+    group_id: int,
+    group_roles: GroupWithRoles,
+    current_user: User = Depends(get_tenant_admin),
+    db: Session = Depends(get_db)
+):
+    """Set the roles a group gives its members (admin only)."""
+    group = _get_tenant_group(db, current_user.tenant_id, group_id)
+    
+    roles = db.query(Role).filter(
+        Role.tenant_id == current_user.tenant_id,
+        Role.id.in_(group_roles.role_ids)
+    ).all()
+    group.roles = roles
+    # Only this group's members lose their cached decisions
+    record_change(db, SCOPE_GROUP, [group.id], "group", group.id, "roles_assigned", current_user.tenant_id, current_user.id)
+    db.commit()
+    
+    return {"message": "Roles assigned successfully"}
+
+
+@router.post("/groups/{group_id}/members")
+async def add_group_members(
+    group_id: int,
+    members: GroupMembers,
+    current_user: User = Depends(get_tenant_admin),
+    db: Session = Depends(get_db)
+):
+    """Add users to a group (admin only)."""
+    group = _get_tenant_group(db, current_user.tenant_id, group_id)
+    
+    # Users from the tenant that aren't members yet
+    already_members = select(group_members.c.user_id).where(group_members.c.group_id == group.id)
+    user_ids = [
+        user_id for (user_id,) in db.query(User.id).filter(
+            User.tenant_id == current_user.tenant_id,
+            User.id.in_(members.user_ids),
+            User.id.notin_(already_members)
+        )
+    ]
+    if user_ids:
+        db.execute(group_members.insert(), [{"group_id": group.id, "user_id": user_id} for user_id in user_ids])
+        record_change(db, SCOPE_USER, user_ids, "group", group.id, "members_added", current_user.tenant_id, current_user.id)
+        db.commit()
+    
+    return {"message": "Members added successfully", "added": len(user_ids)}
+
+
+@router.delete("/groups/{group_id}/members")
+async def remove_group_members(
+    group_id: int,
+    members: GroupMembers,
+    current_user: User = Depends(get_tenant_admin),
+    db: Session = Depends(get_db)
+):
+    """Remove users from a group (admin only)."""
+    group = _get_tenant_group(db, current_user.tenant_id, group_id)
+    
+    result = db.execute(group_members.delete().where(
+        group_members.c.group_id == group.id,
+        group_members.c.user_id.in_(members.user_ids)
+    ))
+    record_change(db, SCOPE_USER, members.user_ids, "group", group.id, "members_removed", current_user.tenant_id, current_user.id)
+    db.commit()
+    
+    return {"message": "Members removed successfully", "removed": result.rowcount}
+
+
+def _record_grant_change(db: Session, grant: ResourceGrant, action: str, current_user: User):
+    """Log a grant change, staling only the caches of whoever it affects."""
+    if grant.principal_type == PRINCIPAL_USER:
+        scope, subject_id = SCOPE_USER, grant.principal_id
+    else:
+        scope, subject_id = SCOPE_TENANT, grant.tenant_id
+    record_change(db, scope, [subject_id], "grant", grant.id, action, grant.tenant_id, current_user.id)
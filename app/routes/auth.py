@@ -2,18 +2,55 @@
 Authentication routes - handle user login, logout, and registration.
 """
 
+import time
 from datetime import timedelta
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Dict, List, Optional
+from fastapi import APIRouter, Depends, Form, HTTPException, Response, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import func, insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from app.db.base import get_db
+from app.db.replicas import open_read_session
 from app.models.user import User
-from app.core.security import verify_password, get_password_hash, create_access_token, create_refresh_token, verify_token
-from app.schemas.auth import UserRegister, UserLogin, Token, RefreshToken, UserResponse
+from app.core.auth import TokenSubject, get_token_claims
+from app.core.cache import SCOPE_USER, Principal
+from app.core.changelog import record_change
+from app.core.rbac import load_principal, require_cached_permission_dependency
+from app.core.security import verify_password_async, get_password_hash_async, create_access_token, create_refresh_token, verify_token
+from app.schemas.auth import (
+    UserRegister,
+    UserLogin,
+    Token,
+    RefreshToken,
+    UserResponse,
+    IntrospectionResponse,
+    IntrospectionBatchRequest,
+    IntrospectionBatchResponse
+)
 from app.core.config import settings
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
+# The unique indexes on users (app/models/user.py), and what to say when one is hit
+TAKEN_MESSAGES = {
+    "ix_users_email_lower": "This email is already registered",
+    "ix_users_username_lower": "This username is already taken",
+}
+
+
+def _violated_index(error: IntegrityError) -> Optional[str]:
+    """The name of the constraint or index a write broke, if we can tell."""
+    # psycopg2 and psycopg report it directly
+    name = getattr(getattr(error.orig, "diag", None), "constraint_name", None)
+    if name:
+        return name
+    # Others end the message with it, e.g. SQLite's
+    # "UNIQUE constraint failed: index 'ix_users_email_lower'"
+    message = str(error.orig).rstrip("'\"` ")
+    return next((index for index in TAKEN_MESSAGES if message.endswith(index)), None)
+
 
 @router.post("/register", response_model=UserResponse)
 async def register(user_data: UserRegister, db: Session = Depends(get_db)):
@@ -23,35 +60,29 @@ async def register(user_data: UserRegister, db: Session = Depends(get_db)):
     This endpoint lets someone create a new account with an email,
     username, and password.
     """
-    # Check if someone already has this email
-    existing_user = db.query(User).filter(User.email == user_data.email).first()
-    if existing_user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="This email is already registered"
-        )
-    
-    # Check if someone already has this username
-    existing_username = db.query(User).filter(User.username == user_data.username).first()
-    if existing_username:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="This username is already taken"
-        )
+    hashed_password = await get_password_hash_async(user_data.password)
     
-    # Create the new user
-    hashed_password = get_password_hash(user_data.password)
-    db_user = User(
-        email=user_data.email,
-        username=user_data.username,
-        hashed_password=hashed_password
-    )
-    
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    # Just try to create the user: the unique indexes on lower(email) and
+    # lower(username) catch duplicates, even two registrations at once
+    try:
+        new_user = db.execute(
+            insert(User)
+            .values(email=user_data.email, username=user_data.username, hashed_password=hashed_password)
+            .returning(User.id, User.tenant_id, User.email, User.username, User.is_active, User.is_superuser)
+        ).one()
+        # The change row gives the response an X-Authz-Version, so the new
+        # user's next requests aren't read from a replica that lacks them
+        record_change(db, SCOPE_USER, [new_user.id], "user", new_user.id, "created", new_user.tenant_id, new_user.id)
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        # The index name says which one is taken; anything else is a real error
+        detail = TAKEN_MESSAGES.get(_violated_index(e))
+        if detail is None:
+            raise
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
     
-    return db_user
+    return new_user._asdict()
 
 
 @router.post("/login", response_model=Token)
@@ -63,8 +94,8 @@ async def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
     returns access and refresh tokens that the user can use to access
     protected parts of the system.
     """
-    # Find the user by their email
-    user = db.query(User).filter(User.email == user_credentials.email).first()
+    # Find the user by their email, ignoring case (this uses ix_users_email_lower)
+    user = db.query(User).filter(func.lower(User.email) == func.lower(user_credentials.email)).first()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -72,7 +103,7 @@ async def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
         )
     
     # Check if the password is correct
-    if not verify_password(user_credentials.password, user.hashed_password):
+    if not await verify_password_async(user_credentials.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Wrong email or password"
@@ -90,12 +121,12 @@ async def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
     refresh_token_expires = timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
     
     access_token = create_access_token(
-        data={"sub": str(user.id), "email": user.email},
+        data={"sub": str(user.id), "email": user.email, "tenant_id": user.tenant_id},
         expires_delta=access_token_expires
     )
     
     refresh_token = create_refresh_token(
-        data={"sub": str(user.id), "email": user.email},
+        data={"sub": str(user.id), "email": user.email, "tenant_id": user.tenant_id},
         expires_delta=refresh_token_expires
     )
     
@@ -130,8 +161,12 @@ async def refresh_token(refresh_data: RefreshToken, db: Session = Depends(get_db
             detail="Invalid refresh token"
         )
     
-    # Get the user
-    user = db.query(User).filter(User.id == int(user_id)).first()
+    # Get the user, only from the tenant the token was issued for
+    tenant_id = payload.get("tenant_id", settings.DEFAULT_TENANT_ID)
+    user = db.query(User).filter(
+        User.tenant_id == tenant_id,
+        User.id == int(user_id)
+    ).first()
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -150,12 +185,12 @@ async def refresh_token(refresh_data: RefreshToken, db: Session = Depends(get_db
     refresh_token_expires = timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
     
     access_token = create_access_token(
-        data={"sub": str(user.id), "email": user.email},
+        data={"sub": str(user.id), "email": user.email, "tenant_id": user.tenant_id},
         expires_delta=access_token_expires
     )
     
     refresh_token = create_refresh_token(
-        data={"sub": str(user.id), "email": user.email},
+        data={"sub": str(user.id), "email": user.email, "tenant_id": user.tenant_id},
         expires_delta=refresh_token_expires
     )
     
@@ -175,4 +210,113 @@ async def logout():
     on the server side. For now, we just return a success message
     and let the client delete the tokens.
     """
-    return {"message": "Successfully logged out"} 
\ No newline at end of file
+    return {"message": "Successfully logged out"}
+
+
+def _load_principals(subjects: List[TokenSubject]) -> Dict[TokenSubject, Principal]:
+    db = open_read_session()
+    try:
+        return {subject: load_principal(subject, db) for subject in subjects}
+    finally:
+        db.close()
+
+
+async def _introspect(tokens: List[str], caller: TokenSubject) -> List[dict]:
+    """
+    Check tokens and describe the ones that are active.
+    
+    Callers only learn about their own tenant: tokens from other tenants
+    are answered as inactive, without loading their users.
+    
+    Signatures and users are both cached, so known tokens are answered
+    without the database. Users that aren't cached are loaded together
+    on a worker thread.
+    """
+    claims = [get_token_claims(token) for token in tokens]
+    claims = [
+        claim if claim is not None and claim.subject.tenant_id == caller.tenant_id else None
+        for claim in claims
+    ]
+    principals: Dict[TokenSubject, Optional[Principal]] = {}
+    for claim in claims:
+        if claim is not None and claim.subject not in principals:
+            principals[claim.subject] = load_principal(claim.subject, None)
+    missing = [subject for subject, principal in principals.items() if principal is None]
+    if missing:
+        principals.update(await run_in_threadpool(_load_principals, missing))
+    
+    results = []
+    for claim in claims:
+        principal = principals[claim.subject] if claim is not None else None
+        if principal is None or not principal.is_active:
+            results.append({"active": False})
+            continue
+        results.append({
+            "active": True,
+            "sub": str(claim.subject.user_id),
+            "username": principal.username,
+            "tenant_id": claim.subject.tenant_id,
+            "exp": int(claim.expires_at) if claim.expires_at is not None else None,
+            "scope": " ".join(sorted(principal.permissions)),
+            "token_type": f"{claim.token_type}_token",
+        })
+    return results
+
+
+def _cache_control(results: List[dict]) -> str:
+    """
+    How long the answer may be cached: until the first token expires, and
+    never longer than INTROSPECTION_CACHE_MAX_SECONDS.
+    
+    Inactive tokens could become active again (a user is re-enabled), so
+    answers with any of them aren't cached at all.
+    """
+    now = time.time()
+    max_age = settings.INTROSPECTION_CACHE_MAX_SECONDS
+    for result in results:
+        if not result["active"] or result["exp"] is None:
+            return "no-store"
+        max_age = min(max_age, int(result["exp"] - now))
+    if max_age <= 0:
+        return "no-store"
+    return f"private, max-age={max_age}"
+
+
+@router.post("/introspect", response_model=IntrospectionResponse, response_model_exclude_none=True)
+async def introspect(
+    response: Response,
+    token: str = Form(...),
+    token_type_hint: Optional[str] = Form(None),
+    caller: TokenSubject = Depends(require_cached_permission_dependency("introspect_tokens"))
+):
+    """
+    Check a token for a resource server (RFC 7662).
+    
+    Send the token as a form field; authenticate with your own bearer token,
+    which needs the introspect_tokens permission. Active tokens come back
+    with who they belong to, when they expire and their permissions as
+    `scope`. Anything else, including tokens from other tenants, is just
+    {"active": false}.
+    
+    token_type_hint is accepted but not needed: both access and refresh
+    tokens are recognised.
+    """
+    results = await _introspect([token], caller)
+    response.headers["Cache-Control"] = _cache_control(results)
+    return results[0]
+
+
+@router.post("/introspect/batch", response_model=IntrospectionBatchResponse, response_model_exclude_none=True)
+async def introspect_batch(
+    batch: IntrospectionBatchRequest,
+    response: Response,
+    caller: TokenSubject = Depends(require_cached_permission_dependency("introspect_tokens"))
+):
+    """
+    Check up to INTROSPECTION_BATCH_MAX tokens in one call.
+    
+    Results are in the same order as the tokens, each like /auth/introspect.
+    """
+    results = await _introspect(batch.tokens, caller)
+    response.headers["Cache-Control"] = _cache_control(results)
+    return {"results": results}
@@ -0,0 +1,111 @@
+"""
+Routes for keeping caches and other services in sync with RBAC changes.
+"""
+
+import logging
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from app.db.replicas import get_read_db
+from app.models.user import User
+from app.core.auth import get_current_superuser, get_token_subject
+from app.core.changelog import get_changes
+from app.core.rbac import decide_custom_permission_async
+from app.core.snapshot import export_snapshot
+from app.schemas.authz import AuthzChangesResponse
+
+router = APIRouter(prefix="/authz", tags=["authz"])
+logger = logging.getLogger(__name__)
+
+# Header the proxy puts the permission it needs in, for /authz/check
+REQUIRED_PERMISSION_HEADER = "x-required-permission"
+
+
+@router.get("/changes", response_model=AuthzChangesResponse)
+async def list_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=10000),
+    current_user: User = Depends(get_current_superuser),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Get changes to roles, permissions and assignments after version `since` (admin only).
+    
+    Start with since=0, then keep passing back the `version` from the last
+    answer to get only what changed since.
+    """
+    changes = get_changes(db, since, current_user.tenant_id, limit + 1)
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    return {
+        "version": changes[-1].version if changes else since,
+        "has_more": has_more,
+        "changes": changes
+    }
+
+
+@router.get("/snapshot")
+def get_snapshot(
+    format: Literal["binary", "ndjson"] = "binary",
+    current_user: User = Depends(get_current_superuser)
+):
+    """
+    Download the tenant's whole RBAC graph in one response (admin only).
+    
+    The response is streamed as it's read from the database. It starts with
+    the change log version it matches; use that as `since` for /authz/changes.
+    The format is described in app/core/snapshot.py.
+    """
+    media_type = "application/octet-stream" if format == "binary" else "application/x-ndjson"
+    return StreamingResponse(
+        export_snapshot(current_user.tenant_id, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="rbac-snapshot-{current_user.tenant_id}.{format}"'}
+    )
+
+
+@router.api_route("/check", methods=["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"])
+async def forward_auth(request: Request):
+    """
+    Forward-auth check for reverse proxies (nginx auth_request, Envoy ext_authz, Traefik).
+    
+    Send the user's `Authorization: Bearer <token>` header and the permission
+    the upstream route needs in `X-Required-Permission`. The answer has no body:
+    - 200: allowed, with X-Auth-User-Id, X-Auth-Tenant-Id and X-Auth-Username
+    - 401: no token, a bad or expired one, or the user is gone
+    - 403: the user doesn't have the permission (or isn't active), or the
+      proxy sent no X-Required-Permission header. nginx turns anything but
+      2xx, 401 and 403 into a 500, so a misconfigured proxy just denies.
+    
+    Checked tokens and decisions are cached, so a repeat check never
+    touches the database; only misses do, on a worker thread.
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return Response(status_code=status.HTTP_401_UNAUTHORIZED, headers={"WWW-Authenticate": "Bearer"})
+    permission_name = request.headers.get(REQUIRED_PERMISSION_HEADER)
+    if not permission_name:
+        logger.warning(
+            "Forward auth check without %s, denying; the proxy must set it (from %s)",
+            REQUIRED_PERMISSION_HEADER, request.client.host if request.client else "unknown"
+        )
+        return Response(status_code=status.HTTP_403_FORBIDDEN)
+    
+    subject = get_token_subject(token)
+    if subject is None:
+        return Response(status_code=status.HTTP_401_UNAUTHORIZED, headers={"WWW-Authenticate": "Bearer"})
+    
+    try:
+        decision = await decide_custom_permission_async(subject, permission_name)
+    except HTTPException as e:
+        # Proxies only understand 401 and 403; anything else counts as an error
+        if e.status_code == status.HTTP_401_UNAUTHORIZED:
+            return Response(status_code=e.status_code, headers=e.headers)
+        return Response(status_code=status.HTTP_403_FORBIDDEN)
+    
+    return Response(status_code=status.HTTP_200_OK, headers={
+        "X-Auth-User-Id": str(subject.user_id),
+        "X-Auth-Tenant-Id": str(subject.tenant_id),
+        "X-Auth-Username": decision.username,
+    })
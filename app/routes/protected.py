@@ -2,12 +2,21 @@
 Protected resource routes demonstrating RBAC permission checking.
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy.orm import Session
+from app.db.replicas import get_read_db
 from app.models.user import User
+from app.models.resource_grant import ResourceGrant
 from app.core.auth import get_current_active_user
+from app.core.cache import Decision
+from app.core.conditional import authz_etag, cache_headers
 from app.core.rbac import (
     require_permission_dependency,
     require_role_dependency,
+    require_custom_permission,
+    check_resource_permission,
+    authorized_resource_ids,
     get_user_permissions
 )
 
@@ -128,16 +137,25 @@ async def moderator_only(current_user: User = Depends(require_role_dependency("m
 
 
 @router.get("/my-permissions")
-async def get_my_permissions(permissions: list = Depends(get_user_permissions)):
+async def get_my_permissions(
+    response: Response,
+    etag: Optional[str] = Depends(authz_etag),
+    permissions: list = Depends(get_user_permissions)
+):
     """
     Get current user's permissions.
     
+    Send back the ETag in If-None-Match to get a 304 while nothing changed.
+    
     Args:
+        response: Response to add the ETag to
+        etag: ETag for the current authz version
         permissions: List of user permissions
         
     Returns:
         dict: User permissions data
     """
+    response.headers.update(cache_headers(etag))
     return {
         "message": "Your permissions",
         "permissions": permissions,
@@ -148,28 +166,89 @@ async def get_my_permissions(permissions: list = Depends(get_user_permissions)):
 @router.get("/custom-permission/{permission_name}")
 async def custom_permission_endpoint(
     permission_name: str,
-    current_user: User = Depends(get_current_active_user)
+    decision: Decision = Depends(require_custom_permission)
 ):
     """
     Custom permission endpoint - requires the specified permission.
     
     Args:
         permission_name: Name of the permission required
-        current_user: Current authenticated user with the required permission
+        decision: Cached permission decision for the current user
         
     Returns:
         dict: Custom permission data
     """
-    # Check if user has the required permission
-    if not current_user.has_permission(permission_name):
+    return {
+        "message": f"Access granted for permission: {permission_name}",
+        "permission": permission_name,
+        "user": decision.username,
+        "data": f"Data specific to {permission_name} permission"
+    } 
+
+
+@router.get("/resource-permission/{permission_name}/{resource_type}/{resource_id}")
+async def resource_permission_endpoint(
+    permission_name: str,
+    resource_type: str,
+    resource_id: int,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Resource permission endpoint - requires the permission on one resource.
+    
+    Args:
+        permission_name: Name of the permission required
+        resource_type: Kind of resource (e.g., 'user')
+        resource_id: ID of the resource
+        current_user: Current authenticated user
+        db: Database session
+        
+    Returns:
+        dict: Resource permission data
+    """
+    if not check_resource_permission(db, current_user, permission_name, resource_type, resource_id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
-            detail=f"Permission '{permission_name}' required"
+            detail=f"Permission '{permission_name}' on {resource_type} {resource_id} required"
         )
     
     return {
         "message": f"Access granted for permission: {permission_name}",
         "permission": permission_name,
-        "user": current_user.username,
-        "data": f"Data specific to {permission_name} permission"
-    } 
\ No newline at end of file
+        "resource_type": resource_type,
+        "resource_id": resource_id,
+        "user": current_user.username
+    }
+
+
+@router.get("/my-resources/{resource_type}")
+async def get_my_resources(
+    resource_type: str,
+    permission: str,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_read_db)
+):
+    """
+    List the resources the current user was granted a permission on.
+    
+    Args:
+        resource_type: Kind of resource (e.g., 'user')
+        permission: Name of the permission
+        current_user: Current authenticated user
+        db: Database session
+        
+    Returns:
+        dict: Resource IDs, or everything if the user has the permission through a role
+    """
+    if current_user.has_permission(permission):
+        return {"resource_type": resource_type, "permission": permission, "all": True, "resource_ids": []}
+    
+    # A resource granted both to the user and to one of their roles or groups comes back once
+    query = (
+        authorized_resource_ids(current_user, permission, resource_type)
+        .distinct()
+        .order_by(ResourceGrant.resource_id)
+    )
+    resource_ids = list(db.execute(query).scalars())
+    return {"resource_type": resource_type, "permission": permission, "all": False, "resource_ids": resource_ids}
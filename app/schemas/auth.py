@@ -2,8 +2,9 @@
 Authentication schemas for request and response models.
 """
 
-from pydantic import BaseModel, EmailStr, ConfigDict
-from typing import Optional
+from pydantic import BaseModel, EmailStr, ConfigDict, Field
+from typing import List, Optional
+from app.core.config import settings
 
 
 class UserRegister(BaseModel):
@@ -51,4 +52,30 @@ class UserResponse(BaseModel):
     is_active: bool
     is_superuser: bool
     
-    model_config = ConfigDict(from_attributes=True) 
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+
+
+class IntrospectionResponse(BaseModel):
+    """Schema for token introspection (RFC 7662). Inactive tokens only have `active`."""
+    
+    active: bool
+    sub: Optional[str] = None
+    username: Optional[str] = None
+    tenant_id: Optional[int] = None
+    exp: Optional[int] = None
+    # Space-separated permission names
+    scope: Optional[str] = None
+    token_type: Optional[str] = None
+
+
+class IntrospectionBatchRequest(BaseModel):
+    """Schema for introspecting many tokens in one call."""
+    
+    tokens: List[str] = Field(..., min_length=1, max_length=settings.INTROSPECTION_BATCH_MAX)
+
+
+class IntrospectionBatchResponse(BaseModel):
+    """Schema for batch introspection, one result per token in the same order."""
+    
+    results: List[IntrospectionResponse]
+
@@ -0,0 +1,32 @@
+"""
+Authz change log schemas for response models.
+"""
+
+from datetime import datetime
+from pydantic import BaseModel, ConfigDict
+from typing import List, Optional
+
+
+class AuthzChangeResponse(BaseModel):
+    """Schema for one entry in the change log."""
+
+    version: int
+    scope: str
+    subject_id: Optional[int] = None
+    tenant_id: Optional[int] = None
+    entity_type: Optional[str] = None
+    entity_id: Optional[int] = None
+    action: Optional[str] = None
+    actor_id: Optional[int] = None
+    created_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class AuthzChangesResponse(BaseModel):
+    """Schema for a page of changes after some version."""
+
+    # Pass this back as `since` to get the next page
+    version: int
+    has_more: bool
+    changes: List[AuthzChangeResponse]
@@ -0,0 +1,25 @@
+"""
+Resource grant schemas for request and response models.
+"""
+
+from pydantic import BaseModel, ConfigDict
+from typing import Literal
+
+
+class ResourceGrantCreate(BaseModel):
+    """Schema for giving a permission on one resource."""
+
+    principal_type: Literal["user", "role"]
+    principal_id: int
+    permission_id: int
+    resource_type: str
+    resource_id: int
+
+
+class ResourceGrantResponse(ResourceGrantCreate):
+    """Schema for resource grant response."""
+
+    id: int
+    tenant_id: int
+
+    model_config = ConfigDict(from_attributes=True)
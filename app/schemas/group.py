@@ -0,0 +1,49 @@
+"""
+Group schemas for request and response models.
+"""
+
+from pydantic import BaseModel, ConfigDict
+from typing import Optional, List
+from .role import RoleResponse
+
+
+class GroupBase(BaseModel):
+    """Base group schema."""
+
+    name: str
+    description: Optional[str] = None
+    parent_id: Optional[int] = None
+
+
+class GroupCreate(GroupBase):
+    """Schema for creating a group."""
+    pass
+
+
+class GroupUpdate(BaseModel):
+    """Schema for updating a group. Setting parent_id moves the group."""
+
+    name: Optional[str] = None
+    description: Optional[str] = None
+    parent_id: Optional[int] = None
+
+
+class GroupResponse(GroupBase):
+    """Schema for group response."""
+
+    id: int
+    roles: List[RoleResponse] = []
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class GroupWithRoles(BaseModel):
+    """Schema for group with role assignments."""
+
+    role_ids: List[int]
+
+
+class GroupMembers(BaseModel):
+    """Schema for adding or removing group members."""
+
+    user_ids: List[int]
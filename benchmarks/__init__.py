@@ -0,0 +1 @@
+# Load tests and latency benchmarks for the auth and RBAC hot paths
@@ -0,0 +1,415 @@
+"""
+Benchmark the login, token refresh, protected and admin endpoints.
+
+Examples:
+    python -m benchmarks.run --users 1000 --output bench_results.json
+    python -m benchmarks.run --mode uvicorn --workers 4 --users 100000
+    python -m benchmarks.run compare old_results.json new_results.json
+
+Each run seeds its own database (bench.db by default), sends requests
+to every scenario and saves p50/p95/p99 latency, throughput, queries
+per request and peak memory as JSON, so two releases can be compared.
+
+The "asgi" mode calls the app in this process and counts SQL queries
+on the engine. The "uvicorn" mode starts serve.py, the production
+launcher, with several workers and DEBUG on, and reads the query counts
+from each response's X-DB-Query-Count header.
+
+The admin_users scenario never runs more requests at once than one
+tenant may (TENANT_MAX_CONCURRENT_ADMIN_REQUESTS), so it measures the
+route instead of the 429s from the tenant limit.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+SCENARIOS = [
+    "login",
+    "refresh",
+    "user_dashboard",
+    "my_permissions",
+    "custom_permission",
+    "admin_users",
+]
+
+# Scenarios limited by the per-tenant admin concurrency limit (app/core/tenancy.py)
+ADMIN_SCENARIOS = {"admin_users"}
+
+QUERY_COUNT_HEADER = "X-DB-Query-Count"
+
+SERVE_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "serve.py")
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], statuses: Dict[int, int], wall_time: float, queries: Optional[int]) -> dict:
+    """Turn raw timings into the numbers we save."""
+    latencies = sorted(latencies)
+    count = len(latencies)
+    to_ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        "requests": count,
+        "statuses": {str(code): seen for code, seen in sorted(statuses.items())},
+        "errors": sum(seen for code, seen in statuses.items() if code >= 400),
+        "p50_ms": to_ms(percentile(latencies, 50)),
+        "p95_ms": to_ms(percentile(latencies, 95)),
+        "p99_ms": to_ms(percentile(latencies, 99)),
+        "mean_ms": to_ms(sum(latencies) / count) if count else None,
+        "throughput_rps": round(count / wall_time, 1) if wall_time > 0 else None,
+        "queries_per_request": round(queries / count, 2) if queries is not None and count else None,
+    }
+
+
+async def run_scenario(client, send: Callable, total: int, concurrency: int):
+    """
+    Send `total` requests with `concurrency` of them in flight at once.
+
+    Returns:
+        (latencies in seconds, count per status code, wall time in seconds,
+        queries from the X-DB-Query-Count headers or None if any response had none)
+    """
+    latencies = []
+    statuses: Dict[int, int] = {}
+    queries = [0]
+    next_index = iter(range(total))
+
+    async def worker():
+        for index in next_index:
+            started = time.perf_counter()
+            response = await send(client, index)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            counted = response.headers.get(QUERY_COUNT_HEADER)
+            if counted is None or queries[0] is None:
+                queries[0] = None
+            else:
+                queries[0] += int(counted)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - started, queries[0]
+
+
+def scenario_concurrency(name: str, requested: int) -> int:
+    """How many requests a scenario keeps in flight: admin ones stay within the tenant limit."""
+    if name in ADMIN_SCENARIOS:
+        from app.core.config import settings
+        return max(1, min(requested, settings.TENANT_MAX_CONCURRENT_ADMIN_REQUESTS))
+    return requested
+
+
+def build_scenarios(api: str, sample: List[dict], admin: dict, permission_names: List[str]) -> Dict[str, Callable]:
+    """Build one request function per scenario."""
+    from app.core.security import create_access_token, create_refresh_token
+    from benchmarks.seed import BENCH_PASSWORD
+
+    def claims(user):
+        return {"sub": str(user["id"]), "email": user["email"], "tenant_id": user["tenant_id"]}
+
+    access = [create_access_token(claims(user)) for user in sample]
+    refresh = [create_refresh_token(claims(user)) for user in sample]
+    admin_headers = {"Authorization": f"Bearer {create_access_token(claims(admin))}"}
+
+    def headers(index):
+        return {"Authorization": f"Bearer {access[index % len(access)]}"}
+
+    return {
+        "login": lambda client, i: client.post(
+            f"{api}/auth/login",
+            json={"email": sample[i % len(sample)]["email"], "password": BENCH_PASSWORD}
+        ),
+        "refresh": lambda client, i: client.post(
+            f"{api}/auth/refresh", json={"refresh_token": refresh[i % len(refresh)]}
+        ),
+        "user_dashboard": lambda client, i: client.get(f"{api}/protected/user-dashboard", headers=headers(i)),
+        "my_permissions": lambda client, i: client.get(f"{api}/protected/my-permissions", headers=headers(i)),
+        "custom_permission": lambda client, i: client.get(
+            f"{api}/protected/custom-permission/{permission_names[i % len(permission_names)]}",
+            headers=headers(i)
+        ),
+        "admin_users": lambda client, i: client.get(
+            f"{api}/admin/users?skip={(i * 100) % max(1, len(sample))}&limit=100", headers=admin_headers
+        ),
+    }
+
+
+def load_fixtures(sample_size: int):
+    """Pick the users and permissions the requests will use."""
+    from sqlalchemy import select
+    from app.db.base import engine
+    from app.models.user import User
+    from app.models.permission import Permission
+    from app.core.config import settings
+
+    with engine.connect() as conn:
+        columns = (User.id, User.email, User.tenant_id)
+        sample = [
+            dict(row._mapping) for row in conn.execute(
+                select(*columns).where(User.email.like("bench%@example.com")).order_by(User.id).limit(sample_size)
+            )
+        ]
+        admin = dict(conn.execute(select(*columns).where(User.email == settings.FIRST_ADMIN_EMAIL)).one()._mapping)
+        permission_names = list(conn.execute(select(Permission.name).order_by(Permission.id).limit(50)).scalars())
+
+    # Some probes for permissions that don't exist, like a scanner would send
+    permission_names += [f"missing_permission_{i}" for i in range(10)]
+    return sample, admin, permission_names
+
+
+async def run_all(client, args, count_queries: Callable[[], Optional[int]]) -> dict:
+    """
+    Run every selected scenario against a client and collect the results.
+
+    count_queries returns the queries run so far, or None to use the
+    X-DB-Query-Count response headers instead.
+    """
+    sample, admin, permission_names = load_fixtures(args.sample_users)
+    if not sample:
+        raise SystemExit("No benchmark users found, seeding must have failed")
+    scenarios = build_scenarios(args.api_prefix, sample, admin, permission_names)
+
+    results = {}
+    for name in args.scenarios:
+        total = min(args.requests, args.login_requests) if name == "login" else args.requests
+        concurrency = scenario_concurrency(name, args.concurrency)
+
+        # Warm up caches and connections before measuring
+        await run_scenario(client, scenarios[name], min(args.warmup, total), concurrency)
+
+        queries_before = count_queries()
+        latencies, statuses, wall_time, header_queries = await run_scenario(
+            client, scenarios[name], total, concurrency
+        )
+        queries_after = count_queries()
+        queries = queries_after - queries_before if queries_before is not None else header_queries
+
+        results[name] = summarize(latencies, statuses, wall_time, queries)
+        results[name]["concurrency"] = concurrency
+        print(
+            f"{name:18} p50={results[name]['p50_ms']}ms p95={results[name]['p95_ms']}ms "
+            f"p99={results[name]['p99_ms']}ms {results[name]['throughput_rps']} req/s "
+            f"errors={results[name]['errors']} concurrency={concurrency}"
+        )
+    return results
+
+
+def _peak_rss_mb_of_tree(pid: int) -> Optional[float]:
+    """Add up the peak memory of a process and its children (Linux only)."""
+    def children(parent):
+        found = []
+        task_dir = f"/proc/{parent}/task"
+        if not os.path.isdir(task_dir):
+            return found
+        for task in os.listdir(task_dir):
+            try:
+                with open(f"{task_dir}/{task}/children") as f:
+                    found.extend(int(child) for child in f.read().split())
+            except OSError:
+                pass
+        return found
+
+    total_kb = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            return None
+        pending.extend(children(current))
+    return round(total_kb / 1024, 1)
+
+
+def _peak_rss_mb_of_self() -> float:
+    """Peak memory of this process."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+async def run_asgi(args) -> dict:
+    """Run the benchmarks against the app in this process."""
+    import httpx
+    from sqlalchemy import event
+    from app.db.base import engine
+    from app.main import app
+
+    query_count = [0]
+
+    def count(*_):
+        query_count[0] += 1
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            results = await run_all(client, args, lambda: query_count[0])
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    return {"scenarios": results, "peak_rss_mb": _peak_rss_mb_of_self()}
+
+
+async def run_uvicorn(args) -> dict:
+    """Start serve.py with several workers and run the benchmarks against it."""
+    import httpx
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    # seed() already ran the migrations and init_db. DEBUG adds the query count headers.
+    server = subprocess.Popen(
+        [
+            sys.executable, SERVE_SCRIPT,
+            "--host", "127.0.0.1", "--port", str(args.port),
+            "--workers", str(args.workers), "--no-seed", "--log-level", "warning",
+        ],
+        env=dict(os.environ, DEBUG="1"),
+    )
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+            # Wait for the workers to come up
+            deadline = time.monotonic() + 60
+            while True:
+                try:
+                    if (await client.get("/health")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise SystemExit("serve.py did not start")
+                await asyncio.sleep(0.2)
+
+            results = await run_all(client, args, lambda: None)
+        peak_rss = _peak_rss_mb_of_tree(server.pid)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    return {"scenarios": results, "peak_rss_mb": peak_rss}
+
+
+def _git_commit() -> Optional[str]:
+    """Current git commit, if we're in a git checkout."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    """Seed the database, run the benchmarks and save the results."""
+    # Settings are read when the app is imported, so point it at the bench database first
+    os.environ["DATABASE_URL"] = args.database_url
+
+    from benchmarks.seed import seed
+
+    print(f"Seeding {args.users} users, {args.roles} roles, {args.permissions} permissions...")
+    started = time.perf_counter()
+    counts = seed(args.users, args.roles, args.permissions, args.roles_per_user)
+    seed_seconds = round(time.perf_counter() - started, 2)
+    print(f"Seeded in {seed_seconds}s: {counts}")
+
+    runner = run_asgi if args.mode == "asgi" else run_uvicorn
+    measured = asyncio.run(runner(args))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mode": args.mode,
+            "workers": args.workers if args.mode == "uvicorn" else 1,
+            "concurrency": args.concurrency,
+            "requests_per_scenario": args.requests,
+            "seed_seconds": seed_seconds,
+            "rows": counts,
+        },
+        "peak_rss_mb": measured["peak_rss_mb"],
+        "scenarios": measured["scenarios"],
+    }
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+
+def compare(old_path: str, new_path: str):
+    """Print how each scenario changed between two result files."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    def change(before, after):
+        if before in (None, 0) or after is None:
+            return "n/a"
+        return f"{(after - before) / before * 100:+.1f}%"
+
+    metrics = ["p50_ms", "p95_ms", "p99_ms", "throughput_rps", "queries_per_request"]
+    print(f"{'scenario':18} " + " ".join(f"{metric:>22}" for metric in metrics))
+    for name, after in new["scenarios"].items():
+        before = old["scenarios"].get(name)
+        if before is None:
+            continue
+        cells = [
+            f"{before[metric]}->{after[metric]} ({change(before[metric], after[metric])})"
+            for metric in metrics
+        ]
+        print(f"{name:18} " + " ".join(f"{cell:>22}" for cell in cells))
+    print(f"peak_rss_mb: {old.get('peak_rss_mb')} -> {new.get('peak_rss_mb')}")
+
+
+def main():
+    """Parse the command line and run or compare benchmarks."""
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        parser = argparse.ArgumentParser(prog="python -m benchmarks.run compare")
+        parser.add_argument("old")
+        parser.add_argument("new")
+        args = parser.parse_args(sys.argv[2:])
+        compare(args.old, args.new)
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark the auth and RBAC hot paths")
+    parser.add_argument("--mode", choices=["asgi", "uvicorn"], default="asgi")
+    parser.add_argument("--workers", type=int, default=4, help="serve.py workers (uvicorn mode)")
+    parser.add_argument("--port", type=int, default=8765, help="serve.py port (uvicorn mode)")
+    parser.add_argument("--database-url", default="sqlite:///./bench.db")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--roles", type=int, default=50)
+    parser.add_argument("--permissions", type=int, default=200)
+    parser.add_argument("--roles-per-user", type=int, default=3)
+    parser.add_argument("--sample-users", type=int, default=200, help="how many users send requests")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--login-requests", type=int, default=50, help="login is slow on purpose (bcrypt)")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument(
+        "--concurrency", type=int, default=8,
+        help="requests in flight; admin scenarios use at most TENANT_MAX_CONCURRENT_ADMIN_REQUESTS"
+    )
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--api-prefix", default="/api/v1")
+    parser.add_argument("--output", default="bench_results.json")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Fill a benchmark database with lots of users, roles and permissions.
+
+It starts with the normal default data from init_db, then bulk inserts
+generated rows in chunks, so a million users takes minutes instead of hours.
+
+Every generated user has the same password (BENCH_PASSWORD), so we
+only pay for one bcrypt hash.
+"""
+
+import random
+from sqlalchemy import func, insert, select
+from app.db.base import engine
+from app.db.migrations import upgrade_database
+from app.models.user import User, user_roles
+from app.models.role import Role, role_permissions
+from app.models.permission import Permission
+from app.core.security import get_password_hash
+from app.core.config import settings
+from app.init_db import init_db
+
+BENCH_PASSWORD = "bench-password"
+CHUNK_SIZE = 10000
+
+
+def bench_email(index: int) -> str:
+    """Email of the generated user with this index."""
+    return f"bench{index}@example.com"
+
+
+def _insert_chunks(conn, table, rows):
+    """Insert rows in chunks so memory stays flat."""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            conn.execute(insert(table), chunk)
+            chunk = []
+    if chunk:
+        conn.execute(insert(table), chunk)
+
+
+def seed(users: int, roles: int, permissions: int, roles_per_user: int, seed_value: int = 42) -> dict:
+    """
+    Fill the database at settings.DATABASE_URL with generated data.
+
+    Running it again on a seeded database does nothing.
+
+    Args:
+        users: how many generated users to add
+        roles: how many generated roles to add
+        permissions: how many generated permissions to add
+        roles_per_user: how many generated roles each user gets
+        seed_value: seed for picking roles, so runs are reproducible
+
+    Returns:
+        dict: How many rows of each kind the database has
+    """
+    upgrade_database()
+    init_db()
+
+    rng = random.Random(seed_value)
+    tenant_id = settings.DEFAULT_TENANT_ID
+
+    with engine.begin() as conn:
+        already_seeded = conn.execute(
+            select(func.count()).select_from(User.__table__).where(User.email.like("bench%@example.com"))
+        ).scalar()
+
+        if not already_seeded:
+            _insert_chunks(conn, Permission.__table__, (
+                {"name": f"bench_permission_{i}", "description": "Generated for benchmarks"}
+                for i in range(permissions)
+            ))
+            _insert_chunks(conn, Role.__table__, (
+                {"tenant_id": tenant_id, "name": f"bench_role_{i}", "description": "Generated for benchmarks"}
+                for i in range(roles)
+            ))
+
+            permission_ids = list(conn.execute(
+                select(Permission.id).where(Permission.name.like("bench_permission_%"))
+            ).scalars())
+            role_ids = list(conn.execute(
+                select(Role.id).where(Role.name.like("bench_role_%"))
+            ).scalars())
+
+            # Each role gets a handful of permissions
+            per_role = min(10, len(permission_ids))
+            _insert_chunks(conn, role_permissions, (
+                {"role_id": role_id, "permission_id": permission_id}
+                for role_id in role_ids
+                for permission_id in rng.sample(permission_ids, per_role)
+            ))
+
+            hashed_password = get_password_hash(BENCH_PASSWORD)
+            _insert_chunks(conn, User.__table__, (
+                {
+                    "tenant_id": tenant_id,
+                    "email": bench_email(i),
+                    "username": f"bench{i}",
+                    "hashed_password": hashed_password,
+                    "is_active": True,
+                    "is_superuser": False,
+                }
+                for i in range(users)
+            ))
+
+            user_ids = list(conn.execute(
+                select(User.id).where(User.email.like("bench%@example.com"))
+            ).scalars())
+            per_user = min(roles_per_user, len(role_ids))
+            _insert_chunks(conn, user_roles, (
+                {"user_id": user_id, "role_id": role_id}
+                for user_id in user_ids
+                for role_id in rng.sample(role_ids, per_user)
+            ))
+
+        counts = {
+            "users": conn.execute(select(func.count()).select_from(User.__table__)).scalar(),
+            "roles": conn.execute(select(func.count()).select_from(Role.__table__)).scalar(),
+            "permissions": conn.execute(select(func.count()).select_from(Permission.__table__)).scalar(),
+            "user_roles": conn.execute(select(func.count()).select_from(user_roles)).scalar(),
+            "role_permissions": conn.execute(select(func.count()).select_from(role_permissions)).scalar(),
+        }
+
+    return counts
@@ -0,0 +1,51 @@
+"""tenants
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 08:37:20.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.core.config import settings
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Users and roles from before tenants belong to the default tenant
+    default_tenant = sa.text(str(int(settings.DEFAULT_TENANT_ID)))
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('tenant_id', sa.Integer(), nullable=False, server_default=default_tenant))
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.alter_column('tenant_id', server_default=None)
+        batch_op.create_index('ix_users_tenant_id_id', ['tenant_id', 'id'])
+
+    op.drop_index('ix_roles_name', table_name='roles')
+    with op.batch_alter_table('roles', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('tenant_id', sa.Integer(), nullable=False, server_default=default_tenant))
+    with op.batch_alter_table('roles', schema=None) as batch_op:
+        batch_op.alter_column('tenant_id', server_default=None)
+        batch_op.create_unique_constraint('uq_roles_tenant_id_name', ['tenant_id', 'name'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Fails if two tenants have a role with the same name
+    with op.batch_alter_table('roles', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_roles_tenant_id_name', type_='unique')
+        batch_op.drop_column('tenant_id')
+    op.create_index('ix_roles_name', 'roles', ['name'], unique=True)
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index('ix_users_tenant_id_id')
+        batch_op.drop_column('tenant_id')
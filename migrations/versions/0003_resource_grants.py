@@ -0,0 +1,46 @@
+"""resource grants
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 08:37:30.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('resource_grants',
+        sa.Column('tenant_id', sa.Integer(), nullable=False),
+        sa.Column('principal_type', sa.String(length=20), nullable=False),
+        sa.Column('principal_id', sa.Integer(), nullable=False),
+        sa.Column('permission_id', sa.Integer(), nullable=False),
+        sa.Column('resource_type', sa.String(length=50), nullable=False),
+        sa.Column('resource_id', sa.Integer(), nullable=False),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['permission_id'], ['permissions.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint(
+            'tenant_id', 'permission_id', 'resource_type', 'principal_type', 'principal_id', 'resource_id',
+            name='uq_resource_grants_lookup'
+        )
+    )
+    op.create_index('ix_resource_grants_id', 'resource_grants', ['id'])
+    op.create_index('ix_resource_grants_resource', 'resource_grants', ['tenant_id', 'resource_type', 'resource_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('resource_grants')
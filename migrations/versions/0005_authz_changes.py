@@ -0,0 +1,36 @@
+"""authz changes
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 09:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, Sequence[str], None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('authz_changes',
+        sa.Column('version', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('scope', sa.String(length=20), nullable=False),
+        sa.Column('subject_id', sa.Integer(), nullable=True),
+        sa.Column('origin', sa.String(length=100), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint('version'),
+        sqlite_autoincrement=True
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('authz_changes')
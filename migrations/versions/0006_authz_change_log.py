@@ -0,0 +1,38 @@
+"""authz change log
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 09:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, Sequence[str], None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('authz_changes', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('tenant_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('entity_type', sa.String(length=30), nullable=True))
+        batch_op.add_column(sa.Column('entity_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('action', sa.String(length=50), nullable=True))
+        batch_op.add_column(sa.Column('actor_id', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('authz_changes', schema=None) as batch_op:
+        batch_op.drop_column('actor_id')
+        batch_op.drop_column('action')
+        batch_op.drop_column('entity_id')
+        batch_op.drop_column('entity_type')
+        batch_op.drop_column('tenant_id')
@@ -0,0 +1,49 @@
+"""case-insensitive unique email and username
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19 10:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, Sequence[str], None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _case_duplicates(column: str):
+    return op.get_bind().execute(sa.text(
+        f"SELECT lower({column}) FROM users GROUP BY lower({column}) HAVING count(*) > 1"
+    )).scalars().all()
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # The new indexes can't be built while two users differ only in case
+    for column in ('email', 'username'):
+        duplicates = _case_duplicates(column)
+        if duplicates:
+            raise RuntimeError(
+                f"These {column}s are used by more than one user (ignoring case), "
+                f"merge or rename them first: {', '.join(duplicates[:20])}"
+            )
+
+    op.drop_index('ix_users_email', table_name='users')
+    op.drop_index('ix_users_username', table_name='users')
+    op.create_index('ix_users_email_lower', 'users', [sa.text('lower(email)')], unique=True)
+    op.create_index('ix_users_username_lower', 'users', [sa.text('lower(username)')], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_users_username_lower', table_name='users')
+    op.drop_index('ix_users_email_lower', table_name='users')
+    op.create_index('ix_users_username', 'users', ['username'], unique=True)
+    op.create_index('ix_users_email', 'users', ['email'], unique=True)
@@ -0,0 +1,28 @@
+"""authz changes tenant index
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19 14:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0009'
+down_revision: Union[str, Sequence[str], None] = '0008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_authz_changes_tenant_id_version', 'authz_changes', ['tenant_id', 'version'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_authz_changes_tenant_id_version', table_name='authz_changes')
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Production launcher for the RBAC system.
+
+Unlike start.py (which is for development and reloads on file changes),
+this:
+- runs migrations and seeding once, in the parent process
+- imports the app once, before forking, so workers start instantly
+- forks one worker per CPU core, all sharing one listening socket
+- uses uvloop and httptools
+- on SIGTERM/SIGINT lets workers finish their requests before exiting,
+  and restarts any worker that dies unexpectedly, waiting longer after
+  each crash; if workers keep dying (MAX_RESTARTS in RESTART_WINDOW_SECONDS)
+  it stops and exits with status 1, so a supervisor can take over
+- has workers tell each other about role and permission changes over
+  unix sockets, unless INVALIDATION_BACKEND says otherwise
+
+Each worker warms its own caches when it starts (see the lifespan in
+app/main.py).
+
+Usage:
+    python serve.py --workers 4 --port 8000
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from collections import deque
+from typing import Deque, List
+import uvicorn
+from app.core.config import settings
+
+logger = logging.getLogger("rbac.serve")
+
+# Wait before restarting a crashed worker, doubled for each recent crash
+RESTART_DELAY_SECONDS = 1.0
+RESTART_DELAY_MAX_SECONDS = 30.0
+# Give up when workers crash this often
+MAX_RESTARTS = 10
+RESTART_WINDOW_SECONDS = 60.0
+
+
+def _run_worker(config: uvicorn.Config, sock):
+    """Body of one worker process. Never returns."""
+    from app.db.base import engine
+
+    # Connections opened before the fork belong to the parent
+    engine.dispose(close=False)
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, signal.SIG_DFL)
+
+    server = uvicorn.Server(config)
+    try:
+        server.run(sockets=[sock])
+    finally:
+        os._exit(0)
+
+
+def _describe_exit(status: int) -> str:
+    code = os.waitstatus_to_exitcode(status)
+    if code < 0:
+        return f"signal {signal.Signals(-code).name}"
+    return f"exit code {code}"
+
+
+def _spawn(config: uvicorn.Config, sock) -> int:
+    pid = os.fork()
+    if pid == 0:
+        _run_worker(config, sock)
+    logger.info("Started worker %d", pid)
+    return pid
+
+
+def serve(host: str, port: int, workers: int, seed: bool, graceful_timeout: int, log_level: str):
+    """
+    Prepare the database, then run the app on `workers` processes.
+
+    Args:
+        host: address to listen on
+        port: port to listen on
+        workers: how many worker processes to fork
+        seed: run migrations and init_db before starting
+        graceful_timeout: seconds workers get to finish requests on shutdown
+        log_level: uvicorn log level
+    """
+    logging.basicConfig(level=log_level.upper(), format="%(asctime)s %(name)s %(message)s")
+
+    if seed:
+        from app.db.migrations import upgrade_database
+        from app.init_db import init_db
+        upgrade_database()
+        if init_db() is None:
+            sys.exit(1)
+
+    # Import the app here so every worker gets it already loaded
+    from app.main import app
+    from app.db.base import engine
+    engine.dispose()
+
+    config = uvicorn.Config(
+        app,
+        host=host,
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        lifespan="on",
+        log_level=log_level,
+        timeout_graceful_shutdown=graceful_timeout,
+        proxy_headers=True,
+    )
+
+    if workers <= 1:
+        uvicorn.Server(config).run()
+        return
+
+    # Workers must hear about changes made by the others
+    socket_dir = None
+    if settings.INVALIDATION_BACKEND == "none":
+        socket_dir = tempfile.mkdtemp(prefix="rbac-invalidation-")
+        logger.info(
+            "INVALIDATION_BACKEND is \"none\" but there are %d workers, using \"unix\" sockets in %s",
+            workers, socket_dir
+        )
+        settings.INVALIDATION_BACKEND = "unix"
+        settings.INVALIDATION_SOCKET_DIR = socket_dir
+
+    sock = config.bind_socket()
+    children = {_spawn(config, sock) for _ in range(workers)}
+    stopping = False
+    gave_up = False
+    # When workers were restarted lately, and when the next replacements are due
+    restarts: Deque[float] = deque()
+    pending: List[float] = []
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    deadline = None
+    while children or (pending and not stopping):
+        if not stopping:
+            now = time.monotonic()
+            for due in [due for due in pending if due <= now]:
+                pending.remove(due)
+                children.add(_spawn(config, sock))
+        if stopping and deadline is None:
+            deadline = time.monotonic() + graceful_timeout + 5
+        if deadline is not None and time.monotonic() > deadline:
+            logger.warning("Workers didn't stop in time, killing them")
+            for pid in children:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            deadline = float("inf")
+
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG) if children else (0, 0)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(0.2)
+            continue
+
+        children.discard(pid)
+        if stopping:
+            continue
+        now = time.monotonic()
+        while restarts and now - restarts[0] > RESTART_WINDOW_SECONDS:
+            restarts.popleft()
+        if len(restarts) >= MAX_RESTARTS:
+            logger.error(
+                "Worker %d exited with %s, and workers were already restarted %d times in %d seconds; giving up",
+                pid, _describe_exit(status), len(restarts), RESTART_WINDOW_SECONDS
+            )
+            gave_up = True
+            stop(None, None)
+            continue
+        restarts.append(now)
+        delay = min(RESTART_DELAY_SECONDS * 2 ** (len(restarts) - 1), RESTART_DELAY_MAX_SECONDS)
+        logger.warning("Worker %d exited with %s, starting a new one in %.1fs", pid, _describe_exit(status), delay)
+        pending.append(now + delay)
+
+    sock.close()
+    if socket_dir:
+        shutil.rmtree(socket_dir, ignore_errors=True)
+    logger.info("All workers stopped")
+    if gave_up:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the RBAC system in production")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.WEB_WORKERS or os.cpu_count() or 1)
+    parser.add_argument("--no-seed", action="store_true", help="skip migrations and init_db")
+    parser.add_argument("--graceful-timeout", type=int, default=30)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.workers, not args.no_seed, args.graceful_timeout, args.log_level)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,9 @@
 """
 Startup script for the RBAC system.
 This script sets up the database and starts the web server.
+
+This is for development: it runs one process and restarts it when files
+change. Use serve.py in production.
 """
 
 import os
@@ -11,8 +14,8 @@ from pathlib import Path
 # Add the app directory to Python path so we can import our modules
 sys.path.insert(0, str(Path(__file__).parent / "app"))
 
+from app.db.migrations import upgrade_database
 from app.init_db import init_db
-from app.main import app
 import uvicorn
 
 
@@ -20,14 +23,17 @@ def main():
     """Main function that starts everything up."""
     print("Starting RBAC System...")
     
-    # Set up the database with initial data
+    # Bring the tables up to date, then add the default data
     print("Setting up database...")
     try:
-        init_db()
+        upgrade_database()
+        # init_db prints what went wrong and returns None
+        if init_db() is None:
+            sys.exit(1)
         print("Database is ready!")
     except Exception as e:
         print(f"Error setting up database: {e}")
-        return
+        sys.exit(1)
     
     # Start the web server
     print("Starting web server...")
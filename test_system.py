@@ -6,11 +6,70 @@ This script tests the main components to make sure everything is set up correctl
 
 import sys
 import os
+import tempfile
 from pathlib import Path
 
 # Add the app directory to the Python path
 sys.path.insert(0, str(Path(__file__).parent / "app"))
 
+# The tests get a database of their own, built by the migrations
+os.environ["DATABASE_URL"] = f"sqlite:///{Path(tempfile.mkdtemp()) / 'test.db'}"
+
+
+def _test_client():
+    """A TestClient for the app, on the migrated and seeded test database."""
+    from fastapi.testclient import TestClient
+    from app.db.migrations import upgrade_database
+    from app.init_db import init_db
+    from app.main import app
+    
+    upgrade_database()
+    init_db()
+    return TestClient(app)
+
+
+def _add_user(tenant_id, username, is_active=True, is_superuser=False, role_names=()):
+    """Add a user straight to the test database and return their id."""
+    from app.db.base import SessionLocal
+    from app.models.role import Role
+    from app.models.user import User
+    
+    db = SessionLocal()
+    try:
+        user = User(
+            tenant_id=tenant_id, email=f"{username}@example.com", username=username,
+            hashed_password="not a real hash", is_active=is_active, is_superuser=is_superuser
+        )
+        if role_names:
+            user.roles = db.query(Role).filter(Role.tenant_id == tenant_id, Role.name.in_(role_names)).all()
+        db.add(user)
+        db.commit()
+        return user.id
+    finally:
+        db.close()
+
+
+def _auth_headers(user_id, tenant_id=1, expires_delta=None):
+    """A bearer token for a user, as login would give them."""
+    from app.core.security import create_access_token
+    
+    token = create_access_token({"sub": str(user_id), "tenant_id": tenant_id}, expires_delta)
+    return {"Authorization": f"Bearer {token}"}
+
+
+def _admin_headers():
+    """A bearer token for the default admin."""
+    from app.core.config import settings
+    from app.db.base import SessionLocal
+    from app.models.user import User
+    
+    db = SessionLocal()
+    try:
+        admin = db.query(User).filter(User.email == settings.FIRST_ADMIN_EMAIL).one()
+        return _auth_headers(admin.id, admin.tenant_id)
+    finally:
+        db.close()
+
 
 def test_imports():
     """Test if we can import all the modules we need."""
@@ -131,11 +190,11 @@ def test_database_connection():
     print("\nTesting database connection...")
     
     try:
-        from app.db.base import engine, SessionLocal
-        from app.models.base import Base
+        from app.db.base import SessionLocal
+        from app.db.migrations import upgrade_database
         
         # Test if we can create tables
-        Base.metadata.create_all(bind=engine)
+        upgrade_database()
         print("Database tables created")
         
         # Test if we can create a session
@@ -150,17 +209,171 @@ def test_database_connection():
         return False
 
 
+def test_migrations():
+    """Test if migrations build a database from scratch and adopt ones made without them."""
+    print("\nTesting migrations...")
+    
+    try:
+        from alembic import command
+        from sqlalchemy import create_engine, text
+        from app.core.config import settings
+        from app.db.base import Base
+        from app.db.migrations import (
+            SchemaVersionError, _alembic_config, check_schema_version, upgrade_database
+        )
+        
+        directory = Path(tempfile.mkdtemp())
+        
+        # A database from the first release: tables, data, no version
+        old = create_engine(f"sqlite:///{directory / 'old.db'}")
+        config = _alembic_config()
+        with old.begin() as conn:
+            config.attributes["connection"] = conn
+            command.upgrade(config, "0001")
+            conn.execute(text("DROP TABLE alembic_version"))
+            conn.execute(text("INSERT INTO roles (name) VALUES ('old_role')"))
+        try:
+            check_schema_version(old)
+            print("Unversioned database passed the version check")
+            return False
+        except SchemaVersionError:
+            pass
+        upgrade_database(old)
+        check_schema_version(old)
+        with old.connect() as conn:
+            tenant_id = conn.execute(text("SELECT tenant_id FROM roles WHERE name = 'old_role'")).scalar()
+        if tenant_id != settings.DEFAULT_TENANT_ID:
+            print(f"Old role was not moved to the default tenant: {tenant_id}")
+            return False
+        
+        # A database made by create_all from the current models
+        current = create_engine(f"sqlite:///{directory / 'current.db'}")
+        Base.metadata.create_all(bind=current)
+        upgrade_database(current)
+        check_schema_version(current)
+        
+        # Going back a migration is noticed
+        with current.begin() as conn:
+            config.attributes["connection"] = conn
+            command.downgrade(config, "-1")
+        try:
+            check_schema_version(current)
+            print("Old schema passed the version check")
+            return False
+        except SchemaVersionError:
+            pass
+        
+        print("Migrations work")
+        return True
+        
+    except Exception as e:
+        print(f"Migrations test failed: {e}")
+        return False
+
+
+def test_seeding():
+    """Test if seed files are read, checked and applied only where something changed."""
+    print("\nTesting seeding...")
+    
+    try:
+        import json
+        from types import SimpleNamespace
+        from sqlalchemy import create_engine, select
+        from app.db.migrations import upgrade_database
+        from app.init_db import SeedReport, _upsert, apply_seed, load_seed_file
+        from app.models.permission import Permission
+        
+        directory = Path(tempfile.mkdtemp())
+        if "admin" not in {role["name"] for role in load_seed_file()["roles"]}:
+            print("Default seed file has no admin role")
+            return False
+        
+        seed = {
+            "permissions": [{"name": "seed_read", "description": "Read"}, {"name": "seed_write"}],
+            "roles": [{"name": "seed_editor", "permissions": ["seed_read", "seed_write"]}],
+        }
+        (directory / "seed.json").write_text(json.dumps(seed))
+        (directory / "seed.yaml").write_text(
+            "permissions:\n  - name: seed_read\n    description: Read\n  - name: seed_write\n"
+            "roles:\n  - name: seed_editor\n    permissions: [seed_read, seed_write]\n"
+        )
+        for name in ("seed.json", "seed.yaml"):
+            loaded = load_seed_file(str(directory / name))
+            if loaded != seed:
+                print(f"{name} was read wrong: {loaded}")
+                return False
+        for name, content in [("nameless.json", {"permissions": [{"description": "x"}]}),
+                              ("twice.json", {"roles": [{"name": "a"}, {"name": "a"}]})]:
+            (directory / name).write_text(json.dumps(content))
+            try:
+                load_seed_file(str(directory / name))
+                print(f"{name} was accepted")
+                return False
+            except ValueError:
+                pass
+        
+        # A database of its own, so the catalog the other tests use stays as it is
+        seed_engine = create_engine(f"sqlite:///{directory / 'seed.db'}")
+        upgrade_database(seed_engine)
+        with seed_engine.begin() as conn:
+            first = apply_seed(conn, seed, tenant_id=9)
+            again = apply_seed(conn, seed, tenant_id=9)
+            seed["permissions"][1]["description"] = "Write"
+            updated = apply_seed(conn, seed, tenant_id=9)
+        if (first.permissions_created, first.roles_created, sorted(first.role_permissions_added)) != (
+                ["seed_read", "seed_write"], ["seed_editor"], ["seed_editor:seed_read", "seed_editor:seed_write"]):
+            print(f"Wrong first seeding: {first.summary()}")
+            return False
+        if again.changed or updated.permissions_updated != ["seed_write"] or updated.permissions_created:
+            print(f"Seeding again changed the wrong things: {again.summary()} / {updated.summary()}")
+            return False
+        if "Permissions: 2 created, 0 updated" not in first.summary() or SeedReport().changed:
+            print(f"Wrong report: {first.summary()}")
+            return False
+        try:
+            with seed_engine.begin() as conn:
+                apply_seed(conn, {"permissions": [], "roles": [{"name": "broken", "permissions": ["nope"]}]}, tenant_id=9)
+            print("Role with an unknown permission was seeded")
+            return False
+        except ValueError:
+            pass
+        
+        # The upsert, with ON CONFLICT and without it
+        permissions = Permission.__table__
+        rows = [{"name": "upsert_a", "description": "one"}, {"name": "upsert_b", "description": "two"}]
+        with seed_engine.begin() as conn:
+            no_upsert = SimpleNamespace(dialect=SimpleNamespace(name="other"), execute=conn.execute)
+            for target in (conn, no_upsert, conn):
+                _upsert(target, permissions, rows, ["name"], ["description"])
+            _upsert(no_upsert, permissions, [dict(rows[0], description="new")], ["name"], ["description"])
+            found = dict(conn.execute(
+                select(permissions.c.name, permissions.c.description).where(permissions.c.name.like("upsert_%"))
+            ).all())
+        if found != {"upsert_a": "new", "upsert_b": "two"}:
+            print(f"Upsert was not idempotent: {found}")
+            return False
+        
+        print("Seeding works")
+        return True
+        
+    except Exception as e:
+        print(f"Seeding test failed: {e}")
+        return False
+
+
 def test_rbac_logic():
     """Test if the RBAC logic works correctly."""
     print("\nTesting RBAC logic...")
     
     try:
         from app.db.base import SessionLocal
+        from app.db.migrations import upgrade_database
         from app.models.user import User
         from app.models.role import Role
         from app.models.permission import Permission
         from app.core.security import get_password_hash
         
+        upgrade_database()
         db = SessionLocal()
         
         # Clean up any existing test data first
@@ -232,6 +445,1591 @@ def test_rbac_logic():
         return False
 
 
+def test_tenant_isolation():
+    """Test if roles from another tenant never grant anything."""
+    print("\nTesting tenant isolation...")
+    
+    try:
+        from app.models.user import User
+        from app.models.role import Role
+        from app.models.permission import Permission
+        from app.core.tenancy import TenantLimiter
+        
+        # Build the objects in memory, no database needed
+        permission = Permission(name="tenant_test_permission")
+        other_role = Role(tenant_id=2, name="tenant_test_role")
+        other_role.permissions.append(permission)
+        user = User(tenant_id=1, email="tenant@example.com", username="tenant_user")
+        user.roles.append(other_role)
+        
+        if not user.has_permission("tenant_test_permission") and not user.has_role("tenant_test_role"):
+            print("Other tenant's roles are ignored")
+        else:
+            print("Other tenant's roles were used")
+            return False
+        
+        # One tenant running out of slots doesn't affect another
+        limiter = TenantLimiter(max_concurrent=1)
+        if limiter.acquire(1) and not limiter.acquire(1) and limiter.acquire(2):
+            print("Tenant limits work")
+        else:
+            print("Tenant limits failed")
+            return False
+        
+        return True
+        
+    except Exception as e:
+        print(f"Tenant isolation test failed: {e}")
+        return False
+
+
+def test_permission_catalog():
+    """Test if only platform admins can change the permission catalog every tenant shares."""
+    print("\nTesting the shared permission catalog...")
+    
+    try:
+        with _test_client() as client:
+            platform_admin = _admin_headers()
+            tenant_admin = _auth_headers(_add_user(2, "catalog_tenant2_admin", is_superuser=True), tenant_id=2)
+            
+            response = client.post(
+                "/api/v1/admin/permissions", json={"name": "catalog_test"}, headers=platform_admin
+            )
+            if response.status_code != 200:
+                print(f"Platform admin could not create a permission: {response.status_code}")
+                return False
+            permission_id = response.json()["id"]
+            
+            attempts = [
+                client.post("/api/v1/admin/permissions", json={"name": "catalog_test2"}, headers=tenant_admin),
+                client.put(f"/api/v1/admin/permissions/{permission_id}", json={"name": "renamed"}, headers=tenant_admin),
+                client.delete(f"/api/v1/admin/permissions/{permission_id}", headers=tenant_admin),
+            ]
+            if [response.status_code for response in attempts] != [403, 403, 403]:
+                print(f"Tenant admin changed the catalog: {[r.status_code for r in attempts]}")
+                return False
+            
+            # Tenant admins still manage their own roles
+            response = client.post("/api/v1/admin/roles", json={"name": "catalog_role"}, headers=tenant_admin)
+            if response.status_code != 200:
+                print(f"Tenant admin could not create a role: {response.status_code}")
+                return False
+            
+            if client.delete(f"/api/v1/admin/permissions/{permission_id}", headers=platform_admin).status_code != 200:
+                print("Platform admin could not delete the permission")
+                return False
+        
+        print("Permission catalog is protected")
+        return True
+        
+    except Exception as e:
+        print(f"Permission catalog test failed: {e}")
+        return False
+
+
+def test_resource_grants():
+    """Test if permissions granted on single resources are checked, listed and removed."""
+    print("\nTesting resource grants...")
+    
+    try:
+        from fastapi import Depends, FastAPI
+        from fastapi.testclient import TestClient
+        from app.core.rbac import (
+            authorized_resource_ids, check_resource_permission,
+            require_resource_permission_dependency, resource_filter
+        )
+        from app.db.base import SessionLocal
+        from app.models.user import User
+        
+        with _test_client() as client:
+            admin = _admin_headers()
+            permission = client.post(
+                "/api/v1/admin/permissions", json={"name": "edit_posts_grant_test"}, headers=admin
+            ).json()
+            role = client.post("/api/v1/admin/roles", json={"name": "grant_test_editors"}, headers=admin).json()
+            alice_id = _add_user(1, "grant_alice")
+            bob_id = _add_user(1, "grant_bob", role_names=["grant_test_editors"])
+            carol_id = _add_user(2, "grant_carol")
+            tenant2_admin = _auth_headers(_add_user(2, "grant_tenant2_admin", is_superuser=True), tenant_id=2)
+            
+            def grant(principal_type, principal_id, resource_type, resource_id, headers=admin):
+                return client.post("/api/v1/admin/grants", headers=headers, json={
+                    "principal_type": principal_type, "principal_id": principal_id,
+                    "permission_id": permission["id"], "resource_type": resource_type, "resource_id": resource_id,
+                })
+            
+            user_grant = grant("user", alice_id, "post", 10)
+            role_grant = grant("role", role["id"], "post", 20)
+            if user_grant.status_code != 200 or role_grant.status_code != 200:
+                print(f"Grants were not created: {user_grant.status_code} {role_grant.status_code}")
+                return False
+            if grant("user", alice_id, "post", 10).status_code != 400:
+                print("Duplicate grant was accepted")
+                return False
+            # The tenant-1 admin can't grant to a tenant-2 user
+            if grant("user", carol_id, "post", 10).status_code != 404:
+                print("Grant to another tenant's user was accepted")
+                return False
+            grant("user", alice_id, "user", bob_id)
+            
+            def can(user_id, resource_id, tenant_id=1):
+                path = f"/api/v1/protected/resource-permission/edit_posts_grant_test/post/{resource_id}"
+                return client.get(path, headers=_auth_headers(user_id, tenant_id)).status_code
+            
+            checks = [can(alice_id, 10), can(alice_id, 20), can(bob_id, 20), can(bob_id, 10), can(carol_id, 10, 2)]
+            if checks != [200, 403, 200, 403, 403]:
+                print(f"Wrong resource decisions: {checks}")
+                return False
+            
+            # Granted both directly and through the role: still listed once
+            grant("user", bob_id, "post", 20)
+            mine = client.get(
+                "/api/v1/protected/my-resources/post?permission=edit_posts_grant_test", headers=_auth_headers(bob_id)
+            ).json()
+            if mine["resource_ids"] != [20] or mine["all"]:
+                print(f"Wrong granted resources: {mine}")
+                return False
+            
+            # Other tenants' admins neither see nor delete the grant
+            tenant2_grants = client.get("/api/v1/admin/grants", headers=tenant2_admin).json()
+            user_grant_id = user_grant.json()["id"]
+            if any(g["id"] == user_grant_id for g in tenant2_grants):
+                print("Another tenant's admin sees the grant")
+                return False
+            if client.delete(f"/api/v1/admin/grants/{user_grant_id}", headers=tenant2_admin).status_code != 404:
+                print("Another tenant's admin deleted the grant")
+                return False
+            
+            # The same checks straight against the database, and as a route dependency
+            db = SessionLocal()
+            try:
+                alice = db.get(User, alice_id)
+                if not check_resource_permission(db, alice, "edit_posts_grant_test", "post", 10):
+                    print("check_resource_permission missed a user grant")
+                    return False
+                granted = list(db.execute(authorized_resource_ids(alice, "edit_posts_grant_test", "post")).scalars())
+                visible = db.query(User.id).filter(
+                    User.tenant_id == 1, resource_filter(alice, "edit_posts_grant_test", "user", User.id)
+                ).all()
+                if granted != [10] or visible != [(bob_id,)]:
+                    print(f"Wrong granted ids: {granted} {visible}")
+                    return False
+            finally:
+                db.close()
+            
+            posts = FastAPI()
+            
+            @posts.put("/posts/{resource_id}")
+            def edit_post(current_user=Depends(require_resource_permission_dependency("edit_posts_grant_test", "post"))):
+                return {"user": current_user.username}
+            
+            with TestClient(posts) as posts_client:
+                allowed = posts_client.put("/posts/10", headers=_auth_headers(alice_id))
+                denied = posts_client.put("/posts/20", headers=_auth_headers(alice_id))
+            if allowed.status_code != 200 or denied.status_code != 403:
+                print(f"Resource dependency answered {allowed.status_code} and {denied.status_code}")
+                return False
+            
+            # Deleting the grant takes the access away
+            if client.delete(f"/api/v1/admin/grants/{user_grant_id}", headers=admin).status_code != 200:
+                print("Grant was not deleted")
+                return False
+            if can(alice_id, 10) != 403:
+                print("Deleted grant still gives access")
+                return False
+        
+        print("Resource grants work")
+        return True
+        
+    except Exception as e:
+        print(f"Resource grants test failed: {e}")
+        return False
+
+
+def test_delegated_readers():
+    """Test if admin list routes only show what a non-admin caller may read."""
+    print("\nTesting delegated readers...")
+    
+    try:
+        from app.core.rbac import authorized_filter
+        from app.db.base import SessionLocal
+        from app.models.user import User
+        
+        with _test_client() as client:
+            admin = _admin_headers()
+            moderator_id = _add_user(1, "reader_moderator", role_names=["moderator"])
+            granted_id = _add_user(1, "reader_granted")
+            target_id = _add_user(1, "reader_target")
+            other_tenant_id = _add_user(2, "reader_tenant2")
+            tenant2_admin_id = _add_user(2, "reader_tenant2_admin", is_superuser=True)
+            
+            permissions = client.get("/api/v1/admin/permissions?limit=1000", headers=admin).json()
+            read_users = next(p["id"] for p in permissions if p["name"] == "read_users")
+            response = client.post("/api/v1/admin/grants", headers=admin, json={
+                "principal_type": "user", "principal_id": granted_id, "permission_id": read_users,
+                "resource_type": "user", "resource_id": target_id,
+            })
+            if response.status_code != 200:
+                print(f"Grant was not created: {response.status_code}")
+                return False
+            
+            def user_ids(user_id, path="/api/v1/admin/users?fields=username&limit=1000"):
+                response = client.get(path, headers=_auth_headers(user_id))
+                return {user["id"] for user in response.json()}
+            
+            # read_users through a role: every user of their own tenant, nobody else's
+            seen = user_ids(moderator_id)
+            if not {moderator_id, granted_id, target_id} <= seen or other_tenant_id in seen:
+                print(f"Role reader saw the wrong users: {sorted(seen)}")
+                return False
+            
+            # read_users on one user: just that user
+            if user_ids(granted_id) != {target_id}:
+                print(f"Granted reader saw {sorted(user_ids(granted_id))}")
+                return False
+            headers = _auth_headers(granted_id)
+            if client.get(f"/api/v1/admin/users/{target_id}", headers=headers).status_code != 200:
+                print("Granted reader could not read the granted user")
+                return False
+            if client.get(f"/api/v1/admin/users/{moderator_id}", headers=headers).status_code != 404:
+                print("Granted reader read a user they weren't granted")
+                return False
+            if client.get("/api/v1/admin/roles", headers=headers).json() != []:
+                print("Granted reader saw roles")
+                return False
+            
+            # Nothing granted at all: nothing to see, but no error either
+            if user_ids(_add_user(1, "reader_nobody")) != set():
+                print("User without read_users saw users")
+                return False
+        
+        # The filter itself keeps superusers inside their tenant
+        db = SessionLocal()
+        try:
+            tenant2_admin = db.get(User, tenant2_admin_id)
+            tenants = {tenant_id for (tenant_id,) in db.query(User.tenant_id).filter(authorized_filter(tenant2_admin, User))}
+            if tenants != {2}:
+                print(f"Superuser filter crossed tenants: {tenants}")
+                return False
+        finally:
+            db.close()
+        
+        print("Delegated readers work")
+        return True
+        
+    except Exception as e:
+        print(f"Delegated readers test failed: {e}")
+        return False
+
+
+def test_group_roles():
+    """Test if users get the roles of their groups and the groups above them."""
+    print("\nTesting group roles...")
+    
+    try:
+        from app.models.user import User
+        from app.models.role import Role
+        from app.models.group import Group
+        from app.models.permission import Permission
+        
+        # Build the objects in memory, no database needed
+        permission = Permission(name="group_test_permission")
+        role = Role(tenant_id=1, name="group_test_role")
+        role.permissions.append(permission)
+        department = Group(tenant_id=1, name="department")
+        department.roles.append(role)
+        team = Group(tenant_id=1, name="team", parent=department)
+        user = User(tenant_id=1, email="group@example.com", username="group_user")
+        user.groups.append(team)
+        
+        if user.has_role("group_test_role") and user.has_permission("group_test_permission"):
+            print("Roles from parent groups are inherited")
+        else:
+            print("Group roles were not inherited")
+            return False
+        
+        return True
+        
+    except Exception as e:
+        print(f"Group roles test failed: {e}")
+        return False
+
+
+def test_group_closure():
+    """Test if the group closure table follows creates, moves and deletes, and is read in one query."""
+    print("\nTesting the group closure table...")
+    
+    try:
+        from sqlalchemy import select
+        from app.core.groups import add_group_to_closure, move_group, remove_group
+        from app.db.base import SessionLocal, track_queries
+        from app.db.migrations import upgrade_database
+        from app.models.group import Group, group_closure, group_members
+        from app.models.permission import Permission
+        from app.models.role import Role
+        from app.models.user import User
+        
+        upgrade_database()
+        user_id = _add_user(1, "closure_user")
+        db = SessionLocal()
+        try:
+            role = Role(tenant_id=1, name="closure_role")
+            role.permissions.append(Permission(name="closure_permission"))
+            department = Group(tenant_id=1, name="closure_department")
+            department.roles.append(role)
+            db.add_all([role, department])
+            db.flush()
+            add_group_to_closure(db, department)
+            groups = {"department": department}
+            for name, parent in (("team", "department"), ("squad", "team"), ("elsewhere", None)):
+                group = Group(tenant_id=1, name=f"closure_{name}", parent_id=parent and groups[parent].id)
+                db.add(group)
+                db.flush()
+                add_group_to_closure(db, group)
+                groups[name] = group
+            db.execute(group_members.insert().values(group_id=groups["squad"].id, user_id=user_id))
+            db.commit()
+            ids = {name: group.id for name, group in groups.items()}
+        finally:
+            db.close()
+        
+        def ancestors(group_id):
+            db = SessionLocal()
+            try:
+                rows = db.execute(
+                    select(group_closure.c.ancestor_id, group_closure.c.depth)
+                    .where(group_closure.c.descendant_id == group_id)
+                ).all()
+                return set(rows)
+            finally:
+                db.close()
+        
+        def access():
+            db = SessionLocal()
+            try:
+                user = db.get(User, user_id)
+                with track_queries() as stats:
+                    group_ids = user.group_ids
+                return set(group_ids), stats, user.has_permission("closure_permission")
+            finally:
+                db.close()
+        
+        if ancestors(ids["squad"]) != {(ids["squad"], 0), (ids["team"], 1), (ids["department"], 2)}:
+            print(f"Wrong ancestors after create: {ancestors(ids['squad'])}")
+            return False
+        group_ids, stats, allowed = access()
+        if group_ids != {ids["squad"], ids["team"], ids["department"]} or not allowed:
+            print(f"Wrong group access: {group_ids}, allowed={allowed}")
+            return False
+        # One join through the closure table, then one query for the roles it found
+        closure_queries = [statement for statement in stats.shapes if "group_closure" in statement]
+        if stats.count != 2 or len(closure_queries) != 1:
+            print(f"Group access took {stats.count} queries")
+            return False
+        
+        db = SessionLocal()
+        try:
+            team = db.get(Group, ids["team"])
+            moved = move_group(db, team, ids["elsewhere"])
+            for child, parent in ((ids["elsewhere"], ids["squad"]), (ids["team"], ids["team"])):
+                try:
+                    move_group(db, db.get(Group, child), parent)
+                    print("A group was moved inside itself")
+                    return False
+                except ValueError:
+                    pass
+            try:
+                remove_group(db, team)
+                print("A group with children was deleted")
+                return False
+            except ValueError:
+                pass
+            db.commit()
+        finally:
+            db.close()
+        if set(moved) != {ids["team"], ids["squad"]}:
+            print(f"Wrong groups moved: {moved}")
+            return False
+        if ancestors(ids["squad"]) != {(ids["squad"], 0), (ids["team"], 1), (ids["elsewhere"], 2)}:
+            print(f"Wrong ancestors after move: {ancestors(ids['squad'])}")
+            return False
+        group_ids, _, allowed = access()
+        if ids["department"] in group_ids or allowed:
+            print("User kept the role of the group they moved away from")
+            return False
+        
+        db = SessionLocal()
+        try:
+            remove_group(db, db.get(Group, ids["squad"]))
+            db.commit()
+        finally:
+            db.close()
+        if ancestors(ids["squad"]) or access()[0]:
+            print("Deleted group left closure or member rows")
+            return False
+        
+        print("Group closure works")
+        return True
+        
+    except Exception as e:
+        print(f"Group closure test failed: {e}")
+        return False
+
+
+def test_decision_cache():
+    """Test if cached permission decisions go stale when access changes."""
+    print("\nTesting decision cache...")
+    
+    try:
+        from app.core.cache import (
+            Decision, DecisionCache, PermissionRegistry,
+            bump_user_authz_version, bump_authz_version
+        )
+        
+        cache = DecisionCache(tenant_id=1, max_entries=3, max_entries_per_user=2)
+        
+        # Both allows and denies should be remembered
+        cache.set(1, "read_users", Decision(True, "alice"), cache.stamp())
+        cache.set(1, "no_such_thing", Decision(False, "alice"), cache.stamp())
+        if cache.get(1, "read_users") == Decision(True, "alice") and cache.get(1, "no_such_thing") == Decision(False, "alice"):
+            print("Allows and denies are cached")
+        else:
+            print("Decisions were not cached")
+            return False
+        
+        # One user can't hold more than their share
+        cache.set(1, "update_users", Decision(False, "alice"), cache.stamp())
+        if len(cache) == 2 and cache.get(1, "read_users") is None:
+            print("Per-user limit works")
+        else:
+            print("Per-user limit failed")
+            return False
+        
+        # Changing a user's access makes their old answers stale
+        bump_user_authz_version(1)
+        if cache.get(1, "update_users") is None:
+            print("User changes invalidate decisions")
+        else:
+            print("Stale decision was returned")
+            return False
+        
+        # Unknown permissions are answered from the registry
+        registry = PermissionRegistry()
+        loads = []
+        load_names = lambda: loads.append(1) or ["read_users"]
+        known = registry.contains("read_users", load_names)
+        unknown = registry.contains("made_up", load_names)
+        if known and not unknown and len(loads) == 1:
+            print("Permission registry works")
+        else:
+            print("Permission registry failed")
+            return False
+        
+        bump_authz_version()
+        registry.contains("read_users", load_names)
+        if len(loads) == 2:
+            print("Permission registry reloads after changes")
+        else:
+            print("Permission registry did not reload")
+            return False
+        
+        return True
+        
+    except Exception as e:
+        print(f"Decision cache test failed: {e}")
+        return False
+
+
+def test_query_tracking():
+    """Test if SQL statements are counted and repeats are spotted."""
+    print("\nTesting query tracking...")
+    
+    try:
+        from sqlalchemy import text
+        from app.db.base import SessionLocal, track_queries
+        
+        db = SessionLocal()
+        with track_queries() as stats:
+            for _ in range(3):
+                db.execute(text("SELECT 1"))
+        db.close()
+        
+        if stats.count == 3 and stats.duplicates == {"SELECT 1": 3}:
+            print("Query counting works")
+        else:
+            print(f"Query counting failed: {stats.count} queries, {stats.duplicates}")
+            return False
+        
+        stats.budget = 2
+        if stats.over_budget:
+            print("Query budgets work")
+        else:
+            print("Query budget was not enforced")
+            return False
+        
+        return True
+        
+    except Exception as e:
+        print(f"Query tracking test failed: {e}")
+        return False
+
+
+def test_invalidation():
+    """Test if workers hear about permission changes made by other workers."""
+    print("\nTesting cache invalidation between workers...")
+    
+    try:
+        import tempfile
+        import time
+        from sqlalchemy import func
+        from app.core.cache import SCOPE_USER
+        from app.core.changelog import record_change
+        from app.core.invalidation import DatabasePollingBackend, UnixSocketBackend
+        from app.db.base import SessionLocal
+        from app.db.migrations import upgrade_database
+        from app.models.authz_change import AuthzChange
+        
+        received = []
+        directory = tempfile.mkdtemp()
+        first = UnixSocketBackend(directory)
+        second = UnixSocketBackend(directory)
+        second.path = second.directory / "second.sock"
+        first.start(lambda scope, ids: received.append(("first", scope, ids)))
+        second.start(lambda scope, ids: received.append(("second", scope, ids)))
+        
+        try:
+            first.publish("user", (5,))
+            for _ in range(20):
+                if received:
+                    break
+                time.sleep(0.05)
+        finally:
+            first.stop()
+            second.stop()
+        
+        if received != [("second", "user", (5,))]:
+            print(f"Invalidation failed: {received}")
+            return False
+        
+        # Through the database: a change recorded here is applied by pollers with another origin only
+        upgrade_database()
+        here = DatabasePollingBackend(interval=60, gap_seconds=30)
+        elsewhere = DatabasePollingBackend(interval=60, gap_seconds=30)
+        elsewhere.origin = "elsewhere:1"
+        db = SessionLocal()
+        try:
+            start = db.query(func.max(AuthzChange.version)).scalar() or 0
+            here.last_version = elsewhere.last_version = start
+            record_change(db, SCOPE_USER, [515151], "user", 515151, "updated", 1)
+            db.commit()
+        finally:
+            db.close()
+        polled = []
+        here.poll(lambda scope, ids: polled.append(("here", scope, ids)))
+        elsewhere.poll(lambda scope, ids: polled.append(("elsewhere", scope, ids)))
+        if polled != [("elsewhere", SCOPE_USER, (515151,))] or here.last_version != elsewhere.last_version:
+            print(f"Database invalidation failed: {polled}")
+            return False
+        
+        print("Changes reach the other worker only")
+        return True
+        
+    except Exception as e:
+        print(f"Invalidation test failed: {e}")
+        return False
+
+
+def test_change_log():
+    """Test if changes are logged with their transaction and bump the caches after commit."""
+    print("\nTesting the authz change log...")
+    
+    try:
+        from app.db.base import SessionLocal
+        from app.db.migrations import upgrade_database
+        from app.core.cache import SCOPE_USER, get_version_stamp, is_fresh
+        from datetime import datetime, timedelta, timezone
+        from app.core.changelog import record_change, get_changes
+        from app.core.invalidation import DatabasePollingBackend
+        from app.models.authz_change import AuthzChange
+        from sqlalchemy import func
+        
+        upgrade_database()
+        db = SessionLocal()
+        try:
+            # Newer than every change so far, whichever tenant made it
+            start = db.query(func.max(AuthzChange.version)).scalar() or 0
+            stamp = get_version_stamp()
+            
+            # A rolled back change leaves no row and no bump
+            record_change(db, SCOPE_USER, [424242], "user", 424242, "updated", 1)
+            db.rollback()
+            if get_changes(db, start, 1, 10) or not is_fresh(stamp, 1, 424242):
+                print("Rolled back change was kept")
+                return False
+            
+            record_change(db, SCOPE_USER, [424242], "user", 424242, "updated", 1)
+            db.commit()
+            changes = get_changes(db, start, 1, 10)
+            if len(changes) != 1 or changes[0].version <= start or is_fresh(stamp, 1, 424242):
+                print(f"Committed change was not logged: {changes}")
+                return False
+            
+            # Other tenants don't see it
+            if get_changes(db, start, 2, 10):
+                print("Change leaked to another tenant")
+                return False
+            
+            # A change that commits after a newer one is still picked up
+            start = changes[0].version
+            poller = DatabasePollingBackend(interval=60, gap_seconds=30)
+            poller.last_version = start
+            applied = []
+            
+            def add_change(version, **values):
+                db.add(AuthzChange(version=version, scope=SCOPE_USER, subject_id=version, tenant_id=1, origin="elsewhere", **values))
+                db.commit()
+            
+            add_change(start + 2)
+            poller.poll(lambda scope, ids: applied.append(ids))
+            if get_changes(db, start, 1, 10) or applied != [(start + 2,)] or set(poller.gaps) != {start + 1}:
+                print(f"Change after a missing version handed out early: {applied}, gaps {poller.gaps}")
+                return False
+            add_change(start + 1)
+            poller.poll(lambda scope, ids: applied.append(ids))
+            versions = [change.version for change in get_changes(db, start, 1, 10)]
+            if versions != [start + 1, start + 2] or applied[1:] != [(start + 1,)] or poller.gaps:
+                print(f"Late change was missed: {versions}, {applied}")
+                return False
+            
+            # A version missing for longer than the wait was rolled back
+            add_change(start + 4, created_at=datetime.now(timezone.utc) - timedelta(hours=1))
+            if [change.version for change in get_changes(db, start + 2, 1, 10)] != [start + 4]:
+                print("Change held back by a version that will never come")
+                return False
+            poller.poll(lambda scope, ids: applied.append(ids))
+            poller.gap_seconds = 0
+            poller.poll(lambda scope, ids: applied.append(ids))
+            if poller.gaps or applied[-1] != (start + 4,):
+                print(f"Poller kept waiting for a rolled back version: {poller.gaps}")
+                return False
+        finally:
+            db.close()
+        
+        print("Change log works")
+        return True
+        
+    except Exception as e:
+        print(f"Change log test failed: {e}")
+        return False
+
+
+def test_snapshot():
+    """Test if the RBAC graph can be exported and read back."""
+    print("\nTesting snapshot export...")
+    
+    try:
+        import io
+        from app.db.base import SessionLocal
+        from app.db.migrations import upgrade_database
+        from app.core.groups import add_group_to_closure
+        from app.models.group import Group, group_members
+        from app.models.permission import Permission
+        from app.models.role import Role
+        from app.core.snapshot import export_snapshot, read_snapshot
+        
+        def snapshot_roles(tenant_id):
+            return read_snapshot(io.BytesIO(b"".join(export_snapshot(tenant_id))))["roles"]
+        
+        upgrade_database()
+        user_id = _add_user(1, "snapshot_user", role_names=("moderator",))
+        db = SessionLocal()
+        try:
+            role = db.query(Role).filter(Role.tenant_id == 1, Role.name == "moderator").one()
+            group = Group(tenant_id=1, name="snapshot_group")
+            group.roles.append(role)
+            db.add(group)
+            db.flush()
+            add_group_to_closure(db, group)
+            db.execute(group_members.insert().values(group_id=group.id, user_id=user_id))
+            db.commit()
+            group_id, role_id = group.id, role.id
+            permission_count = db.query(Permission).count()
+            roles = {(role.id, role.name) for role in db.query(Role).filter(Role.tenant_id == 1)}
+        finally:
+            db.close()
+        
+        snapshot = read_snapshot(io.BytesIO(b"".join(export_snapshot(1))))
+        if len(snapshot["permissions"]) != permission_count or "version" not in snapshot:
+            print(f"Binary snapshot is wrong: {len(snapshot.get('permissions', []))} permissions")
+            return False
+        if set(snapshot["roles"]) != roles or (user_id, role_id) not in snapshot["user_roles"]:
+            print(f"Snapshot roles are wrong: {snapshot['roles']}, {snapshot['user_roles']}")
+            return False
+        if ((group_id, role_id) not in snapshot["group_roles"]
+                or (group_id, user_id) not in snapshot["group_members"]
+                or (group_id, group_id) not in snapshot["group_closure"]):
+            print("Snapshot group sections are wrong")
+            return False
+        if any(other_tenant_role in snapshot["roles"] for other_tenant_role in snapshot_roles(2)):
+            print("Snapshot has another tenant's roles")
+            return False
+        
+        lines = b"".join(export_snapshot(1, "ndjson")).splitlines()
+        if b'"section":"user_roles"' not in b"".join(lines):
+            print("NDJSON snapshot is missing sections")
+            return False
+        
+        print("Snapshot export works")
+        return True
+        
+    except Exception as e:
+        print(f"Snapshot test failed: {e}")
+        return False
+
+
+def test_token_cache():
+    """Test if checked tokens are remembered until they expire."""
+    print("\nTesting token cache...")
+    
+    try:
+        import time
+        from app.core.cache import TokenCache, token_cache
+        from app.core.auth import get_token_subject
+        from app.core.security import create_access_token
+    
+        cache = TokenCache(max_entries=2)
+        cache.set("old", "expired", time.time() - 1)
+        if cache.get("old") is not None:
+            print("Expired token was returned")
+            return False
+        cache.set("a", "subject a", time.time() + 60)
+        cache.set("b", "subject b", time.time() + 60)
+        cache.set("c", "subject c", time.time() + 60)
+        if cache.get("a") is not None or cache.get("c") != "subject c" or len(cache) != 2:
+            print("Token cache kept the wrong tokens")
+            return False
+    
+        token = create_access_token({"sub": "7", "tenant_id": 3})
+        first = get_token_subject(token)
+        if token_cache.get(token).subject != first or get_token_subject(token) != (7, 3):
+            print("Checked token was not cached")
+            return False
+        if get_token_subject(token + "x") is not None:
+            print("Bad token was accepted")
+            return False
+    
+        print("Token cache works")
+        return True
+    
+    except Exception as e:
+        print(f"Token cache test failed: {e}")
+        return False
+
+
+def test_introspection():
+    """Test if token introspection answers for the caller's tenant only, and how long it may be cached."""
+    print("\nTesting token introspection...")
+    
+    try:
+        import re
+        from datetime import timedelta
+        from app.core.cache import Principal, PrincipalCache, bump_user_authz_version, get_version_stamp
+        from app.core.config import settings
+        
+        with _test_client() as client:
+            admin = _admin_headers()
+            active_id = _add_user(1, "introspect_active")
+            inactive_id = _add_user(1, "introspect_inactive", is_active=False)
+            other_tenant_id = _add_user(2, "introspect_tenant2")
+            
+            def token(headers):
+                return headers["Authorization"].split(" ", 1)[1]
+            
+            active = token(_auth_headers(active_id))
+            short_lived = token(_auth_headers(active_id, expires_delta=timedelta(seconds=20)))
+            inactive = token(_auth_headers(inactive_id))
+            other_tenant = token(_auth_headers(other_tenant_id, tenant_id=2))
+            expired = token(_auth_headers(active_id, expires_delta=timedelta(seconds=-10)))
+            
+            response = client.post("/api/v1/auth/introspect", data={"token": active}, headers=admin)
+            body = response.json()
+            if not body["active"] or body["username"] != "introspect_active" or body["tenant_id"] != 1:
+                print(f"Active token was not described: {body}")
+                return False
+            max_age = int(re.search(r"max-age=(\d+)", response.headers["cache-control"]).group(1))
+            if not 0 < max_age <= settings.INTROSPECTION_CACHE_MAX_SECONDS:
+                print(f"Wrong Cache-Control: {response.headers['cache-control']}")
+                return False
+            
+            for name, other in (("inactive", inactive), ("other tenant's", other_tenant), ("expired", expired)):
+                response = client.post("/api/v1/auth/introspect", data={"token": other}, headers=admin)
+                if response.json() != {"active": False} or response.headers["cache-control"] != "no-store":
+                    print(f"The {name} token was answered: {response.json()}")
+                    return False
+            
+            if client.post("/api/v1/auth/introspect", data={"token": active}).status_code not in (401, 403):
+                print("Introspection worked without a caller token")
+                return False
+            
+            tokens = [active, other_tenant, "not a token", short_lived]
+            response = client.post("/api/v1/auth/introspect/batch", json={"tokens": tokens}, headers=admin)
+            results = response.json()["results"]
+            if [result["active"] for result in results] != [True, False, False, True]:
+                print(f"Batch results are out of order: {results}")
+                return False
+            response = client.post("/api/v1/auth/introspect/batch", json={"tokens": [active, short_lived]}, headers=admin)
+            max_age = int(re.search(r"max-age=(\d+)", response.headers["cache-control"]).group(1))
+            if not 0 < max_age <= 20:
+                print(f"Cache-Control outlives the shortest token: {response.headers['cache-control']}")
+                return False
+        
+        # Cached users go stale with their authz version and are evicted oldest first
+        cache = PrincipalCache(max_entries=2)
+        principal = Principal("someone", True, frozenset({"read_users"}))
+        for user_id in (424201, 424202, 424203):
+            cache.set(9, user_id, principal, get_version_stamp())
+        if cache.get(9, 424201) is not None or cache.get(9, 424203) != principal or len(cache) != 2:
+            print("Principal cache kept the wrong users")
+            return False
+        bump_user_authz_version(424203)
+        if cache.get(9, 424203) is not None or cache.get(9, 424202) != principal:
+            print("Stale principal was returned")
+            return False
+        
+        print("Token introspection works")
+        return True
+        
+    except Exception as e:
+        print(f"Token introspection test failed: {e}")
+        return False
+
+
+def test_forward_auth():
+    """Test if /authz/check answers proxies with an empty body, and from memory when warm."""
+    print("\nTesting forward auth...")
+    
+    try:
+        import asyncio
+        from starlette.requests import Request
+        from app.db.base import track_queries
+        from app.routes.authz import forward_auth
+        
+        with _test_client() as client:
+            moderator_id = _add_user(1, "forward_moderator", role_names=("moderator",))
+            inactive_id = _add_user(1, "forward_inactive", is_active=False, role_names=("moderator",))
+            
+            def check(headers, permission="read_users"):
+                if permission:
+                    headers = dict(headers, **{"X-Required-Permission": permission})
+                return client.get("/api/v1/authz/check", headers=headers)
+            
+            allowed = check(_auth_headers(moderator_id))
+            expected = {"x-auth-user-id": str(moderator_id), "x-auth-tenant-id": "1", "x-auth-username": "forward_moderator"}
+            if allowed.status_code != 200 or allowed.content or any(allowed.headers.get(k) != v for k, v in expected.items()):
+                print(f"Allowed check is wrong: {allowed.status_code} {dict(allowed.headers)} {allowed.content!r}")
+                return False
+            
+            answers = {
+                "no token": check({}).status_code,
+                "bad token": check({"Authorization": "Bearer not-a-token"}).status_code,
+                "unknown user": check(_auth_headers(987654)).status_code,
+                "missing permission": check(_auth_headers(moderator_id), "delete_users").status_code,
+                "inactive user": check(_auth_headers(inactive_id)).status_code,
+                "no permission header": check(_auth_headers(moderator_id), None).status_code,
+            }
+            expected_answers = {
+                "no token": 401, "bad token": 401, "unknown user": 401,
+                "missing permission": 403, "inactive user": 403, "no permission header": 403,
+            }
+            if answers != expected_answers:
+                print(f"Wrong answers: {answers}")
+                return False
+            if check({}).content or check(_auth_headers(moderator_id), "delete_users").content:
+                print("Denied checks have a body")
+                return False
+        
+        # The check above warmed the token and decision caches
+        headers = [
+            (b"authorization", _auth_headers(moderator_id)["Authorization"].encode()),
+            (b"x-required-permission", b"read_users"),
+        ]
+        request = Request({"type": "http", "method": "GET", "path": "/api/v1/authz/check", "headers": headers})
+        with track_queries() as stats:
+            response = asyncio.run(forward_auth(request))
+        if response.status_code != 200 or stats.count != 0:
+            print(f"Warm check ran {stats.count} queries (status {response.status_code})")
+            return False
+        
+        print("Forward auth works")
+        return True
+        
+    except Exception as e:
+        print(f"Forward auth test failed: {e}")
+        return False
+
+
+def test_health_checks():
+    """Test if readiness answers from the last report, refreshes it when stale, and counts bcrypt jobs."""
+    print("\nTesting health checks...")
+    
+    try:
+        import asyncio
+        import threading
+        from app.core.config import settings
+        from app.core.health import HealthChecker
+        from app.core.security import _run_in_hash_pool, hash_queue_depth
+        
+        with _test_client() as client:
+            if client.get("/health/ready").status_code != 200:
+                print("Worker is not ready after startup")
+                return False
+        
+        checker = HealthChecker(interval=0.1)
+        first = checker.report()
+        if not first.ready or set(first.checks) != {"pool", "database", "hash_pool", "caches", "replicas", "audit"}:
+            print(f"Wrong first report: {first.to_dict()}")
+            return False
+        if checker.report() is not first:
+            print("Fresh report was not reused")
+            return False
+        
+        # Older than three intervals: whoever asks runs the checks again...
+        first.checked_at -= 1
+        second = checker.report()
+        if second is first or second.age > 0.1:
+            print("Stale report was not refreshed")
+            return False
+        # ...unless someone else is already at it, then the old one will do
+        second.checked_at -= 1
+        with checker._lock:
+            if checker.report() is not second:
+                print("Caller waited for a refresh already running")
+                return False
+        
+        async def fill_hash_pool(extra):
+            release = threading.Event()
+            jobs = [
+                asyncio.ensure_future(_run_in_hash_pool(release.wait, 5))
+                for _ in range(settings.HASH_POOL_WORKERS + extra)
+            ]
+            await asyncio.sleep(0.1)
+            waiting = hash_queue_depth()
+            release.set()
+            await asyncio.gather(*jobs)
+            return waiting
+        
+        waiting = asyncio.run(fill_hash_pool(3))
+        if waiting != 3 or hash_queue_depth() != 0:
+            print(f"Wrong bcrypt queue depth: {waiting} waiting, {hash_queue_depth()} after")
+            return False
+        
+        print("Health checks work")
+        return True
+        
+    except Exception as e:
+        print(f"Health checks test failed: {e}")
+        return False
+
+
+def test_fast_json():
+    """Test if pre-encoded JSON pieces are put together correctly."""
+    print("\nTesting fast JSON...")
+    
+    try:
+        import json
+        from app.core.serialization import dumps, encoded_list, stream_array, with_field
+        
+        role = with_field(dumps({"id": 1, "name": "admin"}), "permissions", encoded_list([dumps({"id": 2})]))
+        users = [with_field(dumps({"id": i}), "roles", encoded_list([role])) for i in range(5)]
+        body = b"".join(stream_array(iter(users), batch_size=2))
+        expected = [{"id": i, "roles": [{"id": 1, "name": "admin", "permissions": [{"id": 2}]}]} for i in range(5)]
+        if json.loads(body) != expected:
+            print(f"Wrong JSON: {body[:200]}")
+            return False
+        if b"".join(stream_array(iter([]))) != b"[]" or with_field(b"{}", "a", b"1") != b'{"a":1}':
+            print("Empty JSON values are wrong")
+            return False
+        
+        print("Fast JSON works")
+        return True
+        
+    except Exception as e:
+        print(f"Fast JSON test failed: {e}")
+        return False
+
+
+def test_fieldsets():
+    """Test if fields= and include= are checked and normalized."""
+    print("\nTesting fieldsets...")
+    
+    try:
+        from fastapi import HTTPException
+        from app.core.fieldsets import parse_fieldset
+        
+        columns = {"email": None, "username": None, "id": None, "is_active": None}
+        includes = ("roles", "roles.permissions")
+        
+        everything = parse_fieldset(None, None, columns, includes)
+        narrow = parse_fieldset("is_active, email", None, columns, includes)
+        nested = parse_fieldset("username", "roles.permissions", columns, includes)
+        if everything.fields != tuple(columns) or everything.include != set(includes):
+            print(f"Default fieldset is wrong: {everything}")
+            return False
+        if narrow.fields != ("email", "id", "is_active") or narrow.include:
+            print(f"Narrow fieldset is wrong: {narrow}")
+            return False
+        if nested.include != {"roles", "roles.permissions"}:
+            print(f"Nested include is wrong: {nested}")
+            return False
+        
+        for fields, include in (("password", None), (None, "groups")):
+            try:
+                parse_fieldset(fields, include, columns, includes)
+                print(f"Unknown name was accepted: {fields or include}")
+                return False
+            except HTTPException as e:
+                if e.status_code != 400:
+                    return False
+        
+        print("Fieldsets work")
+        return True
+        
+    except Exception as e:
+        print(f"Fieldsets test failed: {e}")
+        return False
+
+
+def test_conditional_get():
+    """Test if ETags follow the tenant's change version and If-None-Match is matched."""
+    print("\nTesting conditional GET...")
+    
+    try:
+        from fastapi import HTTPException
+        from starlette.requests import Request
+        from sqlalchemy import insert
+        from app.core import conditional
+        from app.core.cache import SCOPE_TENANT, apply_change
+        from app.core.changelog import record_change
+        from app.core.conditional import authz_etag, etag_matches
+        from app.core.security import create_access_token
+        from app.db.base import SessionLocal, engine
+        from app.db.migrations import upgrade_database
+        from app.models.authz_change import AuthzChange
+        
+        upgrade_database()
+        token = create_access_token({"sub": "42", "tenant_id": 1})
+        
+        def request(if_none_match=None, path="/", query=b""):
+            headers = [(b"authorization", f"Bearer {token}".encode())]
+            if if_none_match:
+                headers.append((b"if-none-match", if_none_match.encode()))
+            return Request({"type": "http", "method": "GET", "path": path, "query_string": query, "headers": headers})
+        
+        etag = authz_etag(request())
+        try:
+            authz_etag(request(f'W/{etag}, "other"'))
+            print("Matching ETag did not give a 304")
+            return False
+        except HTTPException as e:
+            if e.status_code != 304 or e.headers["ETag"] != etag:
+                return False
+        
+        # Another page or another query is another answer, whatever the parameter order
+        listing = authz_etag(request(path="/roles", query=b"fields=id&limit=10"))
+        if authz_etag(request(path="/roles", query=b"limit=10&fields=id")) != listing:
+            print("Reordered query string changed the ETag")
+            return False
+        if len({etag, listing, authz_etag(request(path="/roles", query=b"fields=id"))}) != 3:
+            print("ETag did not follow the path and query string")
+            return False
+        
+        # A change in another tenant leaves the tag alone, one in ours moves it
+        with SessionLocal() as db:
+            record_change(db, SCOPE_TENANT, [2], "role", None, "updated", 2)
+            db.commit()
+        if authz_etag(request()) != etag:
+            print("Another tenant's change moved the ETag")
+            return False
+        with SessionLocal() as db:
+            record_change(db, SCOPE_TENANT, [1], "role", None, "updated", 1)
+            db.commit()
+        changed = authz_etag(request(etag))
+        if changed == etag:
+            print("ETag did not change after an authz change")
+            return False
+        
+        # Another worker (or a restart) with nothing looked up yet hands out the same tag
+        conditional._tenant_versions.clear()
+        if authz_etag(request()) != changed:
+            print("ETag differs between workers")
+            return False
+        
+        # A change made by another worker moves the tag once it arrives on the bus
+        with engine.begin() as conn:
+            conn.execute(insert(AuthzChange).values(
+                scope=SCOPE_TENANT, subject_id=1, tenant_id=1, entity_type="role", action="updated"
+            ))
+        apply_change(SCOPE_TENANT, [1])
+        if authz_etag(request()) == changed:
+            print("ETag did not change after another worker's change")
+            return False
+        if etag_matches(None, etag) or etag_matches('"nope"', etag):
+            print("Wrong ETag matched")
+            return False
+        
+        print("Conditional GET works")
+        return True
+        
+    except Exception as e:
+        print(f"Conditional GET test failed: {e}")
+        return False
+
+
+def test_read_replicas():
+    """Test if reads only go to replicas that have caught up."""
+    print("\nTesting read replicas...")
+    
+    try:
+        from app.core.config import settings
+        from app.db.migrations import upgrade_database
+        from sqlalchemy import create_engine
+        from app.db.replicas import ReplicaRouter
+        
+        upgrade_database()
+        # The primary itself stands in for a replica that is never behind
+        router = ReplicaRouter([settings.DATABASE_URL])
+        if router.pick() is not None:
+            print("Replica used before it was checked")
+            return False
+        router.check()
+        replica = router.pick()
+        if replica is None or not replica.healthy:
+            print("Caught up replica not used")
+            return False
+        
+        router.note_write(replica.version + 1)
+        if router.pick() is not None:
+            print("Replica used before it had our write")
+            return False
+        router = ReplicaRouter([settings.DATABASE_URL])
+        router.check()
+        if router.pick(min_version=replica.version + 1) is not None:
+            print("Replica used before it had the client's write")
+            return False
+        router.note_remote_change()
+        if router.pick() is not None:
+            print("Replica used right after another worker's change")
+            return False
+        router.check()
+        if router.pick() is None:
+            print("Replica not used again after the check")
+            return False
+        
+        # A replica far behind the primary isn't trusted on the first check either
+        lagging_url = f"sqlite:///{Path(tempfile.mkdtemp()) / 'replica.db'}"
+        upgrade_database(create_engine(lagging_url))
+        with _test_client() as client:
+            response = client.post("/api/v1/auth/register", json={
+                "email": "replica_user@example.com", "username": "replica_user", "password": "replica-password-1"
+            })
+        version = response.headers.get("x-authz-version", "")
+        if response.status_code != 200 or not version.isdigit():
+            print(f"Registering did not return a change version: {response.status_code} {version!r}")
+            return False
+        lagging = ReplicaRouter([lagging_url])
+        lagging.check()
+        if lagging.pick() is not None:
+            print("Replica missing the primary's changes used after the first check")
+            return False
+        
+        broken = ReplicaRouter(["sqlite:////nonexistent-dir/replica.db"])
+        report = broken.check()
+        if broken.pick() is not None or not report["ok"]:
+            print("Unreachable replica was used or failed readiness")
+            return False
+        
+        print("Read replicas work")
+        return True
+        
+    except Exception as e:
+        print(f"Read replicas test failed: {e}")
+        return False
+
+
+def test_returning_writes():
+    """Test if admin writes answer from RETURNING and duplicates become 400s."""
+    print("\nTesting RETURNING writes...")
+    
+    try:
+        from fastapi import HTTPException
+        from app.db.base import SessionLocal
+        from app.db.migrations import upgrade_database
+        from app.models.role import Role
+        from app.routes.admin import (
+            ROLE_COLUMNS, _delete_returning, _insert_returning, _unique_or_400, _update_returning
+        )
+        
+        upgrade_database()
+        db = SessionLocal()
+        try:
+            role = _insert_returning(db, Role, ROLE_COLUMNS, {"tenant_id": 77, "name": "returning_test"})
+            if role["name"] != "returning_test" or not role["id"]:
+                print(f"INSERT did not return the row: {role}")
+                return False
+            
+            try:
+                with _unique_or_400(db, "Role name already exists"):
+                    _insert_returning(db, Role, ROLE_COLUMNS, {"tenant_id": 77, "name": "returning_test"})
+                print("Duplicate name was inserted")
+                return False
+            except HTTPException as e:
+                if e.status_code != 400:
+                    return False
+            
+            # The duplicate rolled back the first insert too
+            role = _insert_returning(db, Role, ROLE_COLUMNS, {"tenant_id": 77, "name": "returning_test"})
+            updated = _update_returning(db, Role, ROLE_COLUMNS, Role.id == role["id"], {"description": "new"})
+            if updated != dict(role, description="new"):
+                print(f"UPDATE did not return the row: {updated}")
+                return False
+            if _update_returning(db, Role, ROLE_COLUMNS, Role.id == -1, {"description": "new"}) is not None:
+                print("UPDATE of a missing row returned something")
+                return False
+            if _delete_returning(db, Role, Role.id == role["id"], Role.id) != (role["id"],):
+                print("DELETE did not return the row")
+                return False
+        finally:
+            db.rollback()
+            db.close()
+        
+        print("RETURNING writes work")
+        return True
+        
+    except Exception as e:
+        print(f"RETURNING writes test failed: {e}")
+        return False
+
+
+def test_case_insensitive_users():
+    """Test if emails and usernames are unique ignoring case, and login lookups use the index."""
+    print("\nTesting case-insensitive emails and usernames...")
+    
+    try:
+        from sqlalchemy import func, insert, select, text
+        from sqlalchemy.exc import IntegrityError
+        from app.db.base import engine
+        from app.db.migrations import upgrade_database
+        from app.models.user import User
+        from app.routes.auth import _violated_index
+        
+        upgrade_database()
+        with engine.connect() as conn:
+            transaction = conn.begin()
+            try:
+                conn.execute(insert(User).values(email="Case@Example.com", username="CaseUser", hashed_password="x"))
+                for email, username in [("case@example.com", "other"), ("other@example.com", "caseuser")]:
+                    try:
+                        with conn.begin_nested():
+                            conn.execute(insert(User).values(email=email, username=username, hashed_password="x"))
+                        print(f"Duplicate was accepted: {email} {username}")
+                        return False
+                    except IntegrityError:
+                        pass
+                
+                found = conn.execute(
+                    select(User.username).where(func.lower(User.email) == func.lower("CASE@example.COM"))
+                ).scalar()
+                if found != "CaseUser":
+                    print("Email lookup is case-sensitive")
+                    return False
+                
+                if engine.dialect.name == "sqlite":
+                    plan = conn.execute(text(
+                        "EXPLAIN QUERY PLAN SELECT id FROM users WHERE lower(email) = lower('a@b.c')"
+                    )).all()
+                    if "ix_users_email_lower" not in str(plan):
+                        print(f"Email lookup doesn't use the index: {plan}")
+                        return False
+            finally:
+                transaction.rollback()
+        
+        # Registering tells which one is taken, by the name of the index that was hit
+        with _test_client() as client:
+            register = lambda email, username: client.post("/api/v1/auth/register", json={
+                "email": email, "username": username, "password": "case-password-1"
+            })
+            register("Taken@Example.com", "TakenName")
+            answers = [
+                register("taken@example.com", "username_with_email_in_it"),
+                register("email_in_username@example.com", "takenname"),
+            ]
+        details = [(answer.status_code, answer.json()["detail"]) for answer in answers]
+        if details != [(400, "This email is already registered"), (400, "This username is already taken")]:
+            print(f"Wrong duplicate answers: {details}")
+            return False
+        
+        class Diag:
+            constraint_name = "ix_users_username_lower"
+        
+        class DriverError(Exception):
+            diag = Diag()
+        
+        postgres_error = IntegrityError("INSERT", {}, DriverError("duplicate key value violates unique constraint"))
+        if _violated_index(postgres_error) != "ix_users_username_lower":
+            print("Constraint name from the driver was not used")
+            return False
+        if _violated_index(IntegrityError("INSERT", {}, Exception("NOT NULL constraint failed: users.email"))) is not None:
+            print("Unrelated error was taken for a duplicate")
+            return False
+        
+        print("Case-insensitive emails and usernames work")
+        return True
+        
+    except Exception as e:
+        print(f"Case-insensitive users test failed: {e}")
+        return False
+
+
+def test_audit_log():
+    """Test if audit records are buffered, sampled, shed when full and written in batches."""
+    print("\nTesting audit log...")
+    
+    try:
+        import json
+        import tempfile
+        from pathlib import Path
+        from app.core.audit import AuditLog, AuditRecord, AuditSink, FileAuditSink
+        
+        class ListSink(AuditSink):
+            def __init__(self):
+                self.batches = []
+            
+            def write(self, records):
+                self.batches.append(list(records))
+        
+        # Nothing is kept before start()
+        log = AuditLog(capacity=8, batch_size=3, interval=60, allow_sample_rate=1.0)
+        log.decision("permission", False, 1, 1, "read_users")
+        if log.depth() != 0:
+            print("Audit log buffered records without a sink")
+            return False
+        
+        sink = ListSink()
+        log.sink = sink  # no writer thread, we flush by hand
+        for i in range(6):
+            log.decision("permission", True, 1, i, "read_users")
+        log.decision("permission", True, 1, 99, "read_users")  # 3/4 full: allows are shed
+        log.decision("role", False, 1, 99, "admin")
+        log.admin_change(1, 99, "role", 5, "deleted")
+        log.decision("role", False, 1, 100, "admin")  # full: dropped
+        if (log.depth(), log.shed, log.dropped) != (8, 1, 1):
+            print(f"Wrong back-pressure: depth {log.depth()}, shed {log.shed}, dropped {log.dropped}")
+            return False
+        
+        if log.flush() != 8 or [len(batch) for batch in sink.batches] != [3, 3, 2]:
+            print(f"Wrong batches: {[len(batch) for batch in sink.batches]}")
+            return False
+        last = sink.batches[-1]
+        if [(r.kind, r.outcome) for r in last] != [("role", "deny"), ("admin", "deleted")]:
+            print(f"Wrong records: {last}")
+            return False
+        
+        # Denies are always kept, allows follow the sample rate
+        log.allow_sample_rate = 0
+        log.decision("permission", True, 1, 1, "read_users")
+        log.decision("permission", False, 1, 1, "read_users")
+        if log.depth() != 1:
+            print("Sampling dropped a deny or kept an allow")
+            return False
+        
+        # Names are cut to fit the column, and one bad record doesn't lose its batch
+        class PickySink(ListSink):
+            def write(self, records):
+                if any(record.user_id is None for record in records):
+                    raise ValueError("no user")
+                super().write(records)
+        
+        log = AuditLog(capacity=8, batch_size=4, interval=60, allow_sample_rate=1.0)
+        log.sink = PickySink()
+        log.decision("custom", False, 1, 1, "x" * 300)
+        log.decision("permission", False, 1, None, "read_users")
+        log.decision("permission", False, 1, 2, "read_users")
+        if log.flush() != 2 or log.failed != 1:
+            print(f"Failed batch not retried one by one: {log.sink.batches}, {log.failed} failed")
+            return False
+        if [len(batch[0].name) for batch in log.sink.batches] != [100, 10]:
+            print("Long name was not cut to fit")
+            return False
+        
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "audit.ndjson"
+            file_sink = FileAuditSink(str(path), max_bytes=200, backups=2)
+            record = AuditRecord(0.0, "permission", "allow", 1, 1, "read_users", None)
+            for _ in range(4):
+                file_sink.write([record, record])
+            file_sink.close()
+            names = sorted(p.name for p in Path(directory).iterdir())
+            if names != ["audit.ndjson.1", "audit.ndjson.2"]:
+                print(f"Files weren't rotated: {names}")
+                return False
+            line = json.loads((Path(directory) / "audit.ndjson.1").read_text().splitlines()[0])
+            if line["name"] != "read_users" or not line["at"].startswith("1970-01-01"):
+                print(f"Wrong NDJSON line: {line}")
+                return False
+        
+        print("Audit log works")
+        return True
+        
+    except Exception as e:
+        print(f"Audit log test failed: {e}")
+        return False
+
+
+def test_policy_engine():
+    """Test if the in-process policy engine answers from a snapshot."""
+    print("\nTesting policy engine...")
+    
+    try:
+        from app.core.policy import PolicyEngine, PolicyIndex
+    
+        snapshot = {
+            "version": 5, "tenant_id": 1,
+            "permissions": [(1, "read_users"), (2, "delete_users")],
+            "roles": [(10, "viewer"), (11, "admin")],
+            "users": [(100, True, False), (101, True, False), (102, False, False)],
+            "role_permissions": [(10, 1), (11, 1), (11, 2)],
+            "user_roles": [(100, 10), (102, 11)],
+            # User 101 gets admin from the parent of their group
+            "group_roles": [(20, 11)],
+            "group_members": [(21, 101)],
+            "group_closure": [(20, 20), (21, 21), (20, 21)],
+            "resource_grants": [],
+        }
+        engine = PolicyEngine(PolicyIndex(snapshot))
+    
+        checks = [
+            engine.allowed(100, "read_users"),
+            not engine.allowed(100, "delete_users"),
+            engine.allowed(101, "delete_users"),
+            engine.has_role(101, "admin"),
+            not engine.allowed(102, "read_users"),  # inactive
+            not engine.allowed(999, "read_users"),  # unknown user
+            not engine.allowed(100, "no_such_permission"),
+        ]
+        if not all(checks):
+            print(f"Wrong decisions: {checks}")
+            return False
+    
+        # Older snapshots don't replace newer ones
+        if engine.swap(PolicyIndex(dict(snapshot, version=4))) or engine.version != 5:
+            print("An older snapshot replaced a newer one")
+            return False
+    
+        # Loading from the database goes through the binary snapshot
+        from app.db.migrations import upgrade_database
+        upgrade_database()
+        loaded = PolicyEngine.from_database(1)
+        if loaded.version < 0 or loaded.refresh():
+            print("Loading from the database failed")
+            return False
+    
+        # Another tenant's change doesn't reload this tenant's policy; its own does
+        from app.core.cache import SCOPE_TENANT
+        from app.core.changelog import record_change
+        from app.db.base import SessionLocal
+        db = SessionLocal()
+        try:
+            record_change(db, SCOPE_TENANT, [2], "role", None, "updated", 2)
+            db.commit()
+            other_tenant_reloaded = loaded.refresh()
+            record_change(db, SCOPE_TENANT, [1], "role", None, "updated", 1)
+            db.commit()
+            own_tenant_reloaded = loaded.refresh()
+        finally:
+            db.close()
+        if other_tenant_reloaded or not own_tenant_reloaded:
+            print(f"Wrong reloads: other tenant {other_tenant_reloaded}, own tenant {own_tenant_reloaded}")
+            return False
+    
+        # Nothing loaded yet: every check says no
+        empty = PolicyEngine()
+        if empty.allowed(100, "read_users") or empty.has_role(100, "admin") or empty.permissions(100):
+            print("Engine with nothing loaded allowed something")
+            return False
+    
+        print("Policy engine works")
+        return True
+    
+    except Exception as e:
+        print(f"Policy engine test failed: {e}")
+        return False
+
+
+def test_metrics():
+    """Test if metrics are recorded and rendered for /metrics."""
+    print("\nTesting metrics...")
+    
+    try:
+        import threading
+        from app.core.metrics import Counter, Histogram, render_metrics
+        
+        counter = Counter("test_things_total", "Things counted in tests", ("kind",))
+        histogram = Histogram("test_wait_seconds", "Waits in tests", buckets=(0.1, 1.0))
+        try:
+            # Each thread counts into its own copy, the totals add them up
+            workers = [threading.Thread(target=lambda: [counter.inc("a") for _ in range(100)]) for _ in range(4)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            histogram.observe(0.05)
+            histogram.observe(0.5)
+            histogram.observe(5)
+            
+            output = render_metrics()
+            
+            # Short-lived threads (like a thread pool's) leave their counts but not their copies
+            for _ in range(20):
+                worker = threading.Thread(target=lambda: (counter.inc("b"), histogram.observe(0.5)))
+                worker.start()
+                worker.join()
+            totals = counter.collect()
+            series = histogram.collect()[()]
+            # Only the main thread's copy of the histogram is left
+            if len(counter._shards) != 0 or len(histogram._shards) != 1:
+                print(f"Exited threads kept their copies: {len(counter._shards)} and {len(histogram._shards)}")
+                return False
+            if totals != {("a",): 400, ("b",): 20} or series[:3] != [1, 21, 1]:
+                print(f"Counts of exited threads were lost: {totals}, {series}")
+                return False
+        finally:
+            # Keep them off the app's own /metrics
+            counter.unregister()
+            histogram.unregister()
+        
+        expected = [
+            'test_things_total{kind="a"} 400',
+            'test_wait_seconds_bucket{le="0.1"} 1',
+            'test_wait_seconds_bucket{le="1.0"} 2',
+            'test_wait_seconds_bucket{le="+Inf"} 3',
+            'test_wait_seconds_count 3',
+        ]
+        missing = [line for line in expected if line not in output]
+        if missing:
+            print(f"Metrics output is missing: {missing}")
+            return False
+        if "test_things_total" in render_metrics():
+            print("Unregistered metric is still shown")
+            return False
+        
+        print("Metrics work")
+        return True
+        
+    except Exception as e:
+        print(f"Metrics test failed: {e}")
+        return False
+
+
 def test_configuration():
     """Test if the configuration is set up correctly."""
     print("\nTesting configuration...")
@@ -274,7 +2072,33 @@ def main():
         ("Password Hashing", test_password_hashing),
         ("JWT Tokens", test_jwt_tokens),
         ("Database Connection", test_database_connection),
+        ("Migrations", test_migrations),
+        ("Seeding", test_seeding),
         ("RBAC Logic", test_rbac_logic),
+        ("Tenant Isolation", test_tenant_isolation),
+        ("Permission Catalog", test_permission_catalog),
+        ("Resource Grants", test_resource_grants),
+        ("Delegated Readers", test_delegated_readers),
+        ("Group Roles", test_group_roles),
+        ("Group Closure", test_group_closure),
+        ("Decision Cache", test_decision_cache),
+        ("Query Tracking", test_query_tracking),
+        ("Metrics", test_metrics),
+        ("Invalidation", test_invalidation),
+        ("Change Log", test_change_log),
+        ("Snapshot", test_snapshot),
+        ("Policy Engine", test_policy_engine),
+        ("Token Cache", test_token_cache),
+        ("Token Introspection", test_introspection),
+        ("Forward Auth", test_forward_auth),
+        ("Fast JSON", test_fast_json),
+        ("Fieldsets", test_fieldsets),
+        ("Conditional GET", test_conditional_get),
+        ("Read Replicas", test_read_replicas),
+        ("Health Checks", test_health_checks),
+        ("RETURNING Writes", test_returning_writes),
+        ("Case-insensitive Users", test_case_insensitive_users),
+        ("Audit Log", test_audit_log),
         ("Configuration", test_configuration),
     ]
     